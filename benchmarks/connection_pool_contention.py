@@ -0,0 +1,92 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Measures ConnectionPool.get_connection throughput with 1 to 64 threads
+sharing one pool, with and without a thread marking connections dead in the
+background, and checks that round robin stays even under contention (the
+spread column is the relative difference between the most and least selected
+of connections 1-9).
+
+    $ python benchmarks/connection_pool_contention.py
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rawes.connection_pool import ConnectionPool  # noqa
+
+# the churn thread keeps marking connection 0 dead
+logging.getLogger('elasticsearch').setLevel(logging.ERROR)
+
+CONNECTIONS = 10
+CALLS = 200000
+
+
+def run(thread_count, churn):
+    pool = ConnectionPool([(x, {}) for x in range(CONNECTIONS)],
+                          dead_timeout=0.001)
+    counts = [[0] * CONNECTIONS for _ in range(thread_count)]
+    calls = CALLS // thread_count
+    stopped = threading.Event()
+
+    def select(counter):
+        get_connection = pool.get_connection
+        for _ in range(calls):
+            counter[get_connection()] += 1
+
+    def fail():
+        while not stopped.is_set():
+            pool.mark_dead(0)
+            time.sleep(0.0005)
+
+    threads = [threading.Thread(target=select, args=(counts[i],))
+               for i in range(thread_count)]
+    churner = threading.Thread(target=fail)
+    if churn:
+        churner.start()
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    stopped.set()
+    if churn:
+        churner.join()
+
+    totals = [sum(c[x] for c in counts) for x in range(CONNECTIONS)]
+    spread = (max(totals[1:]) - min(totals[1:])) / float(max(totals[1:]))
+    return calls * thread_count / elapsed, spread
+
+
+def main():
+    print('%7s  %14s  %7s  %14s' % ('threads', 'calls/s', 'spread',
+                                    'calls/s churn'))
+    for thread_count in (1, 2, 4, 8, 16, 32, 64):
+        rate, spread = run(thread_count, churn=False)
+        churn_rate, _ = run(thread_count, churn=True)
+        print('%7d  %14.0f  %6.2f%%  %14.0f' % (thread_count, rate,
+                                                spread * 100, churn_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Compares the time taken to serialize bulk documents holding several
+timestamps with the original encode_date_optional_time (two timezone()
+lookups, astimezone, normalize and strftime per value) and with the current
+encoders, through the json module and through the fastest installed
+serializer.
+
+    $ python benchmarks/encoders.py
+"""
+
+import datetime
+import json
+import os
+import sys
+import time
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rawes.encoders import encode_common_types, \
+    encode_date_optional_time  # noqa
+from rawes.serializer import get_serializer  # noqa
+
+DOCS = 20000
+
+
+def legacy_encode_date_optional_time(obj):
+    if isinstance(obj, datetime.datetime):
+        return pytz.timezone("UTC").normalize(obj.astimezone(
+            pytz.timezone("UTC"))).strftime('%Y-%m-%dT%H:%M:%SZ')
+    raise TypeError("{0} is not JSON serializable".format(repr(obj)))
+
+
+def make_docs(tzinfo):
+    start = datetime.datetime(2014, 1, 1, tzinfo=tzinfo)
+    docs = []
+    for i in range(DOCS):
+        created = start + datetime.timedelta(seconds=i)
+        docs.append({
+            'user': 'user{0}'.format(i % 100),
+            'message': 'Tweeting about elasticsearch',
+            'created': created,
+            'updated': created + datetime.timedelta(minutes=5),
+            'indexed': created + datetime.timedelta(hours=1),
+        })
+    return docs
+
+
+def run(dumps, encoder, docs):
+    start = time.time()
+    for doc in docs:
+        dumps(doc, default=encoder)
+    return time.time() - start
+
+
+def main():
+    serializer = get_serializer()
+    eastern = pytz.timezone('America/New_York')
+    print('{0} docs with 3 datetimes each, {1} serializer'.format(
+        DOCS, serializer.name))
+    print('{0:>10} {1:>12} {2:>30} {3:>10}'.format(
+        'timezone', 'serializer', 'encoder', 'seconds'))
+    for label, tzinfo in (('UTC', pytz.utc), ('New York', eastern)):
+        docs = make_docs(tzinfo)
+        for dumps, name in ((json.dumps, 'json'),
+                            (serializer.dumps, serializer.name)):
+            for encoder in (legacy_encode_date_optional_time,
+                            encode_date_optional_time, encode_common_types):
+                label_name = encoder.__name__
+                if encoder is legacy_encode_date_optional_time:
+                    label_name = 'encode_date_optional_time (0.5)'
+                print('{0:>10} {1:>12} {2:>30} {3:>10.3f}'.format(
+                    label, name, label_name, run(dumps, encoder, docs)))
+
+
+if __name__ == '__main__':
+    main()
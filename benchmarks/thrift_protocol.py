@@ -0,0 +1,116 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Measures the cost of encoding a RestRequest and decoding a RestResponse in
+memory with the pure python TBinaryProtocol, with
+TBinaryProtocolAccelerated, and with the accelerated protocol of
+ThriftConnection(accelerated=True), which leaves large bodies to the python
+protocol, for a small get and a bulk-sized body.
+
+    $ python benchmarks/thrift_protocol.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thrift.protocol import TBinaryProtocol  # noqa
+from thrift.transport import TTransport  # noqa
+
+from rawes.thrift_elasticsearch import Rest  # noqa
+from rawes.thrift_elasticsearch.ttypes import Method, RestRequest, \
+    RestResponse  # noqa
+
+try:
+    from thrift.protocol import fastbinary  # noqa
+except ImportError:
+    fastbinary = None
+
+ITERATIONS = 20000
+
+BULK_BODY = b'{"index": {"_id": "1"}}\n{"user": "dwnoble", "message": ' \
+    b'"Tweeting about elasticsearch"}\n' * 200
+
+MESSAGES = (
+    ('get', RestRequest(method=Method.GET, uri='tweets/tweet/1',
+                        parameters={'routing': 'dwnoble'}),
+     RestResponse(status=200, headers={'content-type': 'application/json'},
+                  body=b'{"_id": "1", "_source": {"user": "dwnoble"}}')),
+    ('bulk', RestRequest(method=Method.POST, uri='_bulk', body=BULK_BODY,
+                         parameters={'refresh': 'false'}),
+     RestResponse(status=200, body=b'{"took": 3, "items": []}' * 50)),
+)
+
+
+def encode(protocol_class, message):
+    transport = TTransport.TMemoryBuffer()
+    message.write(protocol_class(transport))
+    return transport.getvalue()
+
+
+class Sink(TTransport.TTransportBase):
+    """Transport discarding what is written to it"""
+    def write(self, buf):
+        pass
+
+
+def run(protocol_class, request, response):
+    # requests are encoded as the arguments of the execute call, by a
+    # protocol created once per socket
+    request = Rest.execute_args(request=request)
+    protocol = protocol_class(Sink())
+    start = time.time()
+    for _ in range(ITERATIONS):
+        request.write(protocol)
+    encoding = time.time() - start
+
+    data = encode(protocol_class, response)
+    start = time.time()
+    for _ in range(ITERATIONS):
+        decoded = RestResponse()
+        decoded.read(protocol_class(TTransport.TMemoryBuffer(data)))
+    decoding = time.time() - start
+    return encoding, decoding
+
+
+def main():
+    protocols = [('TBinaryProtocol', TBinaryProtocol.TBinaryProtocol)]
+    if fastbinary is None:
+        print('fastbinary extension not available, skipping '
+              'TBinaryProtocolAccelerated')
+    else:
+        from rawes.thrift_connection import _AcceleratedProtocol
+        protocols.append(('TBinaryProtocolAccelerated',
+                          TBinaryProtocol.TBinaryProtocolAccelerated))
+        protocols.append(('ThriftConnection accelerated',
+                          _AcceleratedProtocol))
+
+    print('{0} iterations'.format(ITERATIONS))
+    print('{0:>8} {1:>28} {2:>14} {3:>14}'.format(
+        'message', 'protocol', 'encode (us)', 'decode (us)'))
+    for name, request, response in MESSAGES:
+        for protocol_name, protocol_class in protocols:
+            encoding, decoding = run(protocol_class, request, response)
+            print('{0:>8} {1:>28} {2:>14.2f} {3:>14.2f}'.format(
+                name, protocol_name, encoding * 1e6 / ITERATIONS,
+                decoding * 1e6 / ITERATIONS))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,3 +15,4 @@
 #
 
 from .elastic import Elastic
+from .bulk import BulkIndexer
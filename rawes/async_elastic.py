@@ -0,0 +1,119 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import time
+
+from .elastic import BaseElastic
+from .transport import Transport
+
+
+class AsyncTransport(Transport):
+    """:class:`~rawes.transport.Transport` for asynchronous connections.
+    Sniffing, hedged reads, adaptive limiting and background health checks
+    (which would ping the hosts with un-awaited coroutines) are not
+    supported.
+    """
+
+    def __init__(self, connection_pool, sniff_on_start=False,
+                 sniffer_interval=None, sniff_on_connection_fail=False,
+                 hedge_after=None, limiter=None, **kwargs):
+        if sniff_on_start or sniffer_interval or sniff_on_connection_fail:
+            raise ValueError("Sniffing is not available for AsyncElastic")
+        if hedge_after is not None:
+            raise ValueError("Hedged reads are not available for "
+                             "AsyncElastic")
+        if limiter is not None:
+            raise ValueError("Adaptive limiting is not available for "
+                             "AsyncElastic")
+        if getattr(connection_pool, 'health_checker', None) is not None:
+            raise ValueError("Health checks are not available for "
+                             "AsyncElastic")
+        super(AsyncTransport, self).__init__(connection_pool, **kwargs)
+
+    async def perform_request(self, method, path, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            connection_pool = self.connection_pool
+            connection = connection_pool.get_connection()
+            event, request_kwargs = self._start_event(connection, method,
+                                                      path, kwargs, attempt)
+            start = time.time()
+            try:
+                result = await self._send(connection_pool, connection,
+                                          method, path, request_kwargs)
+            except Exception as e:
+                self._end_event(event, request_kwargs, time.time() - start,
+                                e)
+                if not self._retry(connection, e, attempt):
+                    raise
+            else:
+                connection_pool.mark_live(connection)
+                self._end_event(event, request_kwargs, time.time() - start)
+                return result
+
+    async def _send(self, connection_pool, connection, method, path, kwargs):
+        """
+        Send a request on a connection, reporting its outcome to the pool
+        even when the request is cancelled, so the selector's count of
+        requests in flight stays right.
+        """
+        start = time.time()
+        failed = False
+        try:
+            return await connection.request(method, path, **kwargs)
+        except Exception as e:
+            failed = self._host_failed(e)
+            raise
+        finally:
+            connection_pool.observe(connection, time.time() - start,
+                                    failed=failed)
+
+
+class AsyncElastic(BaseElastic):
+    """Connect to an elasticsearch instance from asyncio code.
+
+    Takes the same arguments and supports the same path chaining as
+    :class:`Elastic <Elastic>`, but its ``get``, ``put``, ``post``,
+    ``delete``, ``head`` and ``request`` methods return coroutines. Only the
+    http and https protocols are supported, and the ``scan`` and
+    ``sliced_scan`` helpers, which iterate over blocking requests, are not
+    available: ``es.scan`` is a path like any other attribute.
+    """
+
+    transport_class = AsyncTransport
+
+    async def request(self, method, path, **kwargs):
+        new_path = self._prepare_request(path, kwargs)
+        return await self.transport.perform_request(method, new_path, **kwargs)
+
+    async def close(self):
+        """Close the HTTP sessions of every connection in the pool"""
+        for connection, opts in self.connection_pool.connection_opts:
+            await connection.close()
+
+    def _get_connection_from_url(self, url, timeout, **kwargs):
+        """Returns an asynchronous connection object given a string url"""
+
+        url = self._decode_url(url, "")
+
+        if url.scheme != 'http' and url.scheme != 'https':
+            raise ValueError("Only the http and https protocols are "
+                             "available for AsyncElastic")
+        try:
+            from .async_http_connection import AsyncHttpConnection
+        except ImportError:
+            raise ImportError("The 'aiohttp' python package "
+                              "does not seem to be installed.")
+        return AsyncHttpConnection(url.geturl(), timeout=timeout, **kwargs)
@@ -0,0 +1,150 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import asyncio
+import ssl
+import time
+
+import aiohttp
+from .elastic_exception import ElasticException
+from .serializer import get_serializer
+
+# Options of the requests based HttpConnection that aiohttp has no
+# equivalent for
+UNSUPPORTED_OPTIONS = ('pool_maxsize', 'pool_block', 'keep_alive',
+                       'connection_retries', 'compress_threshold', 'stream',
+                       'cert')
+
+
+class AsyncHttpConnection(object):
+    """Connects to elasticsearch over HTTP without blocking the event loop"""
+
+    # Errors after which the transport considers the host dead
+    connection_errors = (aiohttp.ClientConnectionError,)
+    timeout_errors = (asyncio.TimeoutError,)
+
+    def __init__(self, url, timeout=None, serializer=None, **kwargs):
+        """
+        :arg url: base url of the host, such as `http://localhost:9200`
+        :arg timeout: default timeout of the requests, in seconds
+        :arg serializer: serializer decoding the responses, see
+            :func:`~rawes.serializer.get_serializer`
+        :arg kwargs: arguments passed to every `aiohttp` request, such as
+            `auth` (given as a tuple or an `aiohttp.BasicAuth`) or `headers`.
+            `verify` is translated to aiohttp's `ssl` argument, and the
+            socket pool and compression options of
+            :class:`~rawes.http_connection.HttpConnection` raise a
+            ValueError
+        """
+        super(AsyncHttpConnection, self).__init__()
+        self.protocol = 'http'
+        self.url = url
+        self.timeout = timeout
+        self.serializer = get_serializer(serializer)
+        self.kwargs = self._translate(kwargs)
+        # aiohttp sessions must be created inside a running event loop
+        self.session = None
+
+    async def request(self, method, path, **kwargs):
+        args = self.kwargs.copy()
+        args.update(self._translate(kwargs))
+
+        if "json_decoder" in args:
+            json_decoder = args["json_decoder"]
+            del args["json_decoder"]
+        else:
+            json_decoder = None
+
+        # measures of the request reported to the transport's hooks
+        info = args.pop('info', {})
+
+        timeout = args.pop('timeout', self.timeout)
+        if timeout is not None:
+            args['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        if 'params' in args:
+            args['params'] = self._stringify(args['params'])
+        if isinstance(args.get('auth'), tuple):
+            args['auth'] = aiohttp.BasicAuth(*args['auth'])
+
+        if isinstance(args.get('data'), (bytes, str)):
+            info['request_size'] = len(args['data'])
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        start = time.time()
+        async with self.session.request(method, "/".join((self.url, path)),
+                                        **args) as response:
+            content = await response.read()
+        info['status'] = response.status
+        info['response_size'] = len(content)
+        info['network_time'] = time.time() - start
+        start = time.time()
+        try:
+            return self._decode(response.status, content, json_decoder)
+        finally:
+            info['decode_time'] = time.time() - start
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _decode(self, status_code, content, json_decoder):
+        if not content:
+            decoded = status_code < 300
+        else:
+            try:
+                if json_decoder is None:
+                    decoded = self.serializer.loads(content)
+                else:
+                    decoded = json_decoder(content.decode('utf-8'))
+            except ValueError:
+                decoded = False
+
+        if status_code >= 400:
+            raise ElasticException(
+                    message="ElasticSearch Error: {0}".format(
+                        content.decode('utf-8', 'replace')),
+                    result=decoded, status_code=status_code)
+        return decoded
+
+    def _translate(self, kwargs):
+        """Returns the given options with their requests names translated
+        to aiohttp's, raising a ValueError for the ones aiohttp has no
+        equivalent for"""
+        for name in UNSUPPORTED_OPTIONS:
+            if name in kwargs:
+                raise ValueError("The {0} option is not available for "
+                                 "AsyncHttpConnection".format(name))
+        if 'verify' not in kwargs:
+            return kwargs
+        kwargs = kwargs.copy()
+        verify = kwargs.pop('verify')
+        if verify is False:
+            kwargs['ssl'] = False
+        elif verify is not True:
+            # path of the CA bundle to verify the certificates with
+            kwargs['ssl'] = ssl.create_default_context(cafile=verify)
+        return kwargs
+
+    def _stringify(self, params):
+        """
+        aiohttp only accepts str and int query parameter values.
+        """
+        return dict(
+            (k, str(v).lower() if isinstance(v, bool) else v)
+            for k, v in params.items()
+        )
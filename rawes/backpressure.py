@@ -0,0 +1,115 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import random
+import threading
+
+logger = logging.getLogger('rawes')
+
+# Status elasticsearch answers with when one of its thread pool queues is full
+REJECTED_STATUS = 429
+
+
+class AdaptiveLimiter(object):
+    """
+    Bounds the number of requests in flight with an AIMD (additive increase,
+    multiplicative decrease) limit, the way TCP adapts its congestion window.
+
+    Every successful request grows the limit by `increase` requests per
+    `limit` requests, that is by about `increase` each time a full window of
+    requests completes. A rejected request multiplies the limit by
+    `decrease`. Rejections of requests that were sent before the last
+    decrease are ignored, so a burst of rejections only shrinks the limit
+    once.
+    """
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64,
+                 increase=1.0, decrease=0.5):
+        """
+        :arg initial_limit: number of requests allowed in flight at first
+        :arg min_limit: the limit never goes below this number of requests
+        :arg max_limit: the limit never goes above this number of requests
+        :arg increase: number of requests added to the limit for every
+            `limit` successful requests
+        :arg decrease: factor the limit is multiplied by on a rejection
+        """
+        if not 0 < decrease < 1:
+            raise ValueError('decrease must be between 0 and 1')
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.in_flight = 0
+        # bumped on every decrease
+        self.epoch = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until a request can be sent. Returns a token to hand back to
+        :meth:`release`.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return self.epoch
+
+    def release(self, token, rejected=False):
+        """
+        Report the end of a request and adapt the limit.
+
+        :arg token: the value returned by :meth:`acquire`
+        :arg rejected: whether elasticsearch rejected the request, or part of
+            it
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if rejected:
+                if token == self.epoch:
+                    self.limit = max(self.min_limit,
+                                     self.limit * self.decrease)
+                    self.epoch += 1
+                    logger.info('Request rejected, limiting concurrency to '
+                                '%d', int(self.limit))
+            else:
+                self.limit = min(self.max_limit,
+                                 self.limit + self.increase / self.limit)
+            self.condition.notify_all()
+
+
+def backoff(attempt, initial_backoff, max_backoff):
+    """
+    Number of seconds to wait before the given retry attempt (starting at 0):
+    a random duration up to an exponentially growing cap, so that clients
+    rejected together don't all come back at the same time.
+    """
+    return random.uniform(0, min(max_backoff, initial_backoff * 2 ** attempt))
+
+
+def is_rejected(status, error=None):
+    """
+    Whether a response status (and error) means elasticsearch rejected the
+    request because it is overloaded, as opposed to the request being
+    invalid.
+    """
+    if status == REJECTED_STATUS:
+        return True
+    error = str(error or '')
+    return 'es_rejected_execution_exception' in error or \
+        'EsRejectedExecutionException' in error
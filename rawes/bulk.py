@@ -0,0 +1,249 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import time
+
+from .backpressure import backoff, is_rejected
+from .elastic_exception import ElasticException
+from .utils import isstr, parallel_imap
+
+# Keys of an action dict that belong in the bulk action line rather than in
+# the document source
+METADATA_FIELDS = ('_index', '_type', '_id', '_parent', '_routing',
+                   '_version', '_version_type', '_timestamp', '_ttl',
+                   '_retry_on_conflict', '_percolate')
+
+
+class BulkIndexer(object):
+    """Streams actions to the elasticsearch bulk API in bounded chunks"""
+
+    def __init__(self, es, chunk_size=500, max_chunk_bytes=100 * 1024 * 1024,
+                 raise_on_error=False, max_retries=0, initial_backoff=1,
+                 max_backoff=60, limiter=None, **kwargs):
+        """Constructs a :class:`BulkIndexer <BulkIndexer>`.
+
+        :param es: :class:`Elastic <Elastic>` object the bulk requests are
+            posted through. Its path (e.g. ``es.tweets.tweet``) is used as the
+            default index and type, and its ``json_encoder`` serializes the
+            actions
+        :param chunk_size: (optional) maximum number of actions sent in a
+            single bulk request
+        :param max_chunk_bytes: (optional) maximum size in bytes of a single
+            bulk request body
+        :param raise_on_error: (optional) raise an
+            :class:`ElasticException <ElasticException>` holding the failed
+            items when a chunk contains errors instead of yielding them
+        :param max_retries: (optional) number of times a bulk request
+            rejected by an overloaded cluster (status 429) is sent again. When
+            only some items are rejected (``es_rejected_execution_exception``)
+            only those items are sent again
+        :param initial_backoff: (optional) upper bound in seconds of the
+            random wait before the first retry, doubled on every retry
+        :param max_backoff: (optional) maximum wait in seconds between two
+            retries
+        :param limiter: (optional) :class:`AdaptiveLimiter
+            <rawes.backpressure.AdaptiveLimiter>` bounding the number of bulk
+            requests in flight, shrunk when the cluster rejects requests and
+            grown back while it keeps up
+        :param kwargs: (optional) additional arguments passed to every
+            ``_bulk`` call, for example ``params={'refresh': 'true'}``
+        """
+        super(BulkIndexer, self).__init__()
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        self.es = es
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.raise_on_error = raise_on_error
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter
+        self.kwargs = kwargs
+
+    def stream(self, actions):
+        """Index the given actions, yielding an ``(ok, item)`` tuple per action
+        in the order the actions were given.
+
+        ``actions`` can be any iterable (including a generator) and is only
+        consumed one chunk at a time. Each action is either a dict or a
+        ``(action_line, source)`` tuple of already built bulk lines. A dict
+        action holds its operation in ``_op_type`` (``index`` by default), its
+        metadata in underscored keys (``_index``, ``_type``, ``_id``, ...) and
+        its document either in ``_source`` or in the remaining keys.
+        """
+        for chunk in self.chunks(actions):
+            for result in self.send(chunk):
+                yield result
+
+    def parallel(self, actions, thread_count=4, max_in_flight=None,
+                 ordered=True):
+        """Like :meth:`stream`, but posts chunks concurrently from a pool of
+        threads. Every request picks its own connection from the client's
+        connection pool, so all the hosts given to
+        :class:`Elastic <Elastic>` are loaded at the same time. With a
+        ``limiter``, fewer than ``thread_count`` chunks may be in flight while
+        the cluster is rejecting requests.
+
+        :param thread_count: (optional) number of threads posting chunks
+        :param max_in_flight: (optional) maximum number of chunks serialized
+            but not yet yielded back, bounding memory use. Defaults to twice
+            ``thread_count``
+        :param ordered: (optional) yield results in the order of ``actions``;
+            when False results are yielded as soon as their chunk completes
+        """
+        if max_in_flight is None:
+            max_in_flight = 2 * thread_count
+        if max_in_flight < thread_count:
+            raise ValueError('max_in_flight must be at least thread_count')
+
+        for results in parallel_imap(self.send, self.chunks(actions),
+                                     thread_count, max_in_flight, ordered):
+            for result in results:
+                yield result
+
+    def chunks(self, actions):
+        """Serialize ``actions`` and group them into lists of bulk lines that
+        respect ``chunk_size`` and ``max_chunk_bytes``"""
+        chunk = []
+        chunk_actions = 0
+        chunk_bytes = 0
+        for action in actions:
+            lines = [self._dumps(line) for line in self._expand(action)]
+            size = sum(len(line) + 1 for line in lines)
+            if chunk and (chunk_actions == self.chunk_size or
+                          chunk_bytes + size > self.max_chunk_bytes):
+                yield chunk
+                chunk = []
+                chunk_actions = 0
+                chunk_bytes = 0
+            chunk.extend(lines)
+            chunk_actions += 1
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def send(self, chunk):
+        """Post one chunk of bulk lines and return its ``(ok, item)`` results,
+        retrying the items rejected by an overloaded cluster"""
+        results = self._post(chunk)
+
+        rejected = [i for i, (ok, item) in enumerate(results)
+                    if _item_rejected(item)]
+        if rejected and self.max_retries:
+            actions = _split_actions(chunk, self.es.serializer.loads)
+            for attempt in range(self.max_retries):
+                time.sleep(backoff(attempt, self.initial_backoff,
+                                   self.max_backoff))
+                retried = self._post([line for i in rejected
+                                      for line in actions[i]])
+                for i, result in zip(rejected, retried):
+                    results[i] = result
+                rejected = [i for i, (ok, item) in zip(rejected, retried)
+                            if _item_rejected(item)]
+                if not rejected:
+                    break
+
+        if self.raise_on_error:
+            errors = [item for ok, item in results if not ok]
+            if errors:
+                raise ElasticException(
+                    message='{0} bulk item(s) failed'.format(len(errors)),
+                    result=errors, status_code=_item_status(errors[0]))
+        return results
+
+    def _post(self, chunk):
+        """Post bulk lines, retrying the whole request while the cluster
+        answers with a 429"""
+        body = b'\n'.join(chunk) + b'\n'
+        attempt = 0
+        while True:
+            token = self.limiter.acquire() if self.limiter else None
+            rejected = False
+            try:
+                response = self.es.post('_bulk', data=body, **self.kwargs)
+                results = [(_item_ok(item), item)
+                           for item in response['items']]
+                rejected = any(_item_rejected(item) for _, item in results)
+                return results
+            except ElasticException as e:
+                rejected = is_rejected(e.status_code, e.result)
+                if not rejected or attempt >= self.max_retries:
+                    raise
+            finally:
+                if self.limiter:
+                    self.limiter.release(token, rejected)
+            time.sleep(backoff(attempt, self.initial_backoff,
+                               self.max_backoff))
+            attempt += 1
+
+    def _dumps(self, obj):
+        # lines given already serialized are passed through
+        if isinstance(obj, bytes):
+            return obj
+        if isstr(obj):
+            return obj.encode('utf-8')
+        line = self.es.serializer.dumps(obj, default=self.es.json_encoder)
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        return line
+
+    def _expand(self, action):
+        """Turn an action into its action line and optional source line"""
+        if isinstance(action, tuple):
+            header, source = action
+            return [header] if source is None else [header, source]
+
+        action = action.copy()
+        op_type = action.pop('_op_type', 'index')
+        metadata = {}
+        for field in METADATA_FIELDS:
+            if field in action:
+                metadata[field] = action.pop(field)
+
+        header = {op_type: metadata}
+        if op_type == 'delete':
+            return [header]
+        return [header, action.pop('_source', action)]
+
+
+def _item_ok(item):
+    info = list(item.values())[0]
+    return 'error' not in info and _item_status(item) < 300
+
+
+def _item_status(item):
+    info = list(item.values())[0]
+    return info.get('status', 200)
+
+
+def _item_rejected(item):
+    info = list(item.values())[0]
+    return 'error' in info and is_rejected(_item_status(item), info['error'])
+
+
+def _split_actions(chunk, loads):
+    """Group bulk lines by action: every action line is followed by a source
+    line, except for deletes. The action lines are decoded with `loads`"""
+    actions = []
+    lines = iter(chunk)
+    for line in lines:
+        header = loads(line)
+        if 'delete' in header:
+            actions.append([line])
+        else:
+            actions.append([line, next(lines)])
+    return actions
@@ -1,6 +1,10 @@
+import math
+import itertools
 import time
 import random
 import logging
+import threading
+import weakref
 
 try:
     from Queue import PriorityQueue, Empty
@@ -10,6 +14,11 @@ except ImportError:
 logger = logging.getLogger('elasticsearch')
 
 
+class ConnectionPoolEmpty(Exception):
+    """Raised by :meth:`ConnectionPool.get_connection` when the pool holds
+    no connection at all, or, with a health checker, no live connection"""
+
+
 class ConnectionSelector(object):
     """
     Simple class used to select a connection from a list of currently live
@@ -42,6 +51,17 @@ class ConnectionSelector(object):
         """
         pass
 
+    def observe(self, connection, duration, failed=False):
+        """
+        Called after each request with the time it took, for selectors that
+        take the connections' response times into account.
+
+        :arg connection: the connection the request was sent on
+        :arg duration: response time of the request, in seconds
+        :arg failed: whether the request failed because of the host
+        """
+        pass
+
 
 class RandomSelector(ConnectionSelector):
     """
@@ -57,12 +77,155 @@ class RoundRobinSelector(ConnectionSelector):
     """
     def __init__(self, opts):
         super(RoundRobinSelector, self).__init__(opts)
-        self.rr = -1
+        # advancing an itertools counter is atomic, so concurrent threads
+        # never get the same position
+        self.rr = itertools.count()
 
     def select(self, connections):
-        self.rr += 1
-        self.rr %= len(connections)
-        return connections[self.rr]
+        return connections[next(self.rr) % len(connections)]
+
+
+class EwmaSelector(ConnectionSelector):
+    """
+    Latency-aware selector. It keeps an exponentially weighted moving average
+    (EWMA) of each connection's response time and, for every request, picks
+    two connections at random and returns the one with the lowest average
+    ("power of two choices"), so slow nodes receive less traffic without
+    starving them completely.
+
+    Averages decay towards zero while a connection is not used, so a node
+    that was slow gets probed again once it had time to recover.
+
+    A failed request doesn't count as a response time, as a node quickly
+    answering with errors would otherwise attract more traffic: its
+    connection is scored as slower than the slowest one instead, up to
+    `max_penalty` so that a node that failed many times in a row is probed
+    again soon after it recovers.
+    """
+    def __init__(self, opts, alpha=0.3, decay_time=10.0,
+                 failure_penalty=2.0, max_penalty=10.0):
+        """
+        :arg alpha: weight of the latest response time in the average
+        :arg decay_time: time in seconds it takes for an unused connection's
+            average to decay by a factor e
+        :arg failure_penalty: after a failed request, a connection's average
+            becomes the highest average (or the request's duration, if
+            longer) multiplied by this factor
+        :arg max_penalty: highest average, in seconds, a connection gets
+            after a failed request
+        """
+        super(EwmaSelector, self).__init__(opts)
+        self.alpha = alpha
+        self.decay_time = decay_time
+        self.failure_penalty = failure_penalty
+        self.max_penalty = max_penalty
+        # connection -> (average response time, time of last update)
+        self.ewma = {}
+
+    def score(self, connection, now=None):
+        """
+        Current average response time of a connection, 0 if it was never
+        observed.
+        """
+        try:
+            average, updated = self.ewma[connection]
+        except KeyError:
+            return 0.0
+        now = now if now else time.time()
+        return average * math.exp(-max(now - updated, 0) / self.decay_time)
+
+    def select(self, connections):
+        if len(connections) == 1:
+            return connections[0]
+        first, second = random.sample(connections, 2)
+        now = time.time()
+        if self.score(second, now) < self.score(first, now):
+            return second
+        return first
+
+    def observe(self, connection, duration, failed=False):
+        now = time.time()
+        if failed:
+            worst = max([self.score(c, now) for c in list(self.ewma)] +
+                        [duration])
+            # the worst average may be this connection's own, penalized
+            # already: without a bound repeated failures grow it
+            # exponentially
+            average = min(worst * self.failure_penalty, self.max_penalty)
+        elif connection in self.ewma:
+            average = self.score(connection, now)
+            average += self.alpha * (duration - average)
+        else:
+            average = duration
+        self.ewma[connection] = (average, now)
+
+
+class LeastOutstandingSelector(ConnectionSelector):
+    """
+    Selector picking the connection with the fewest requests in flight,
+    breaking ties at random. Useful when many threads share one client, so
+    that long running requests don't pile up on the same node.
+
+    A request is counted as in flight from the moment its connection is
+    selected until the pool's `observe` method is called for it.
+    """
+    def __init__(self, opts):
+        super(LeastOutstandingSelector, self).__init__(opts)
+        self.outstanding = {}
+        self.lock = threading.Lock()
+
+    def select(self, connections):
+        with self.lock:
+            fewest = None
+            candidates = []
+            for connection in connections:
+                count = self.outstanding.get(connection, 0)
+                if fewest is None or count < fewest:
+                    fewest = count
+                    candidates = [connection]
+                elif count == fewest:
+                    candidates.append(connection)
+            connection = random.choice(candidates)
+            self.outstanding[connection] = fewest + 1
+            return connection
+
+    def observe(self, connection, duration, failed=False):
+        with self.lock:
+            count = self.outstanding.get(connection, 0)
+            if count > 1:
+                self.outstanding[connection] = count - 1
+            else:
+                self.outstanding.pop(connection, None)
+
+
+class ZoneAwareSelector(ConnectionSelector):
+    """
+    Selector preferring the connections located in its own zone, read from
+    the 'zone' option of each connection. Connections in other zones are only
+    used when no connection of the zone is live. Among the candidates a
+    connection is picked at random, in proportion to its 'weight' option
+    (1 by default).
+    """
+    def __init__(self, opts, zone=None):
+        """
+        :arg zone: the zone the client runs in
+        """
+        super(ZoneAwareSelector, self).__init__(opts)
+        self.zone = zone
+
+    def select(self, connections):
+        local = [c for c in connections
+                 if self.connection_opts.get(c, {}).get('zone') == self.zone]
+        candidates = local or connections
+
+        weights = [self.connection_opts.get(c, {}).get('weight', 1)
+                   for c in candidates]
+        point = random.uniform(0, sum(weights))
+        for connection, weight in zip(candidates, weights):
+            point -= weight
+            if point < 0:
+                return connection
+        return candidates[-1]
 
 
 class ConnectionPool(object):
@@ -86,9 +249,29 @@ class ConnectionPool(object):
     the timeout is over the connection will be resurrected and returned to the
     live pool. A connection that has been peviously marked as dead and
     succeedes will be marked as live (it's fail count will be deleted).
+
+    The pool can be shared between threads. The list of live connections is
+    never modified in place: marking a connection dead or resurrecting one
+    replaces it with a new list under a lock, so `get_connection` can hand the
+    current list to the selector without locking, and only takes the lock
+    when a dead connection is due for resurrection.
+
+    With `health_check_interval` set, dead connections are not resurrected by
+    `get_connection` any more: a background thread pings every connection
+    whose timeout is over (with a `HEAD /` request by default) and only
+    returns it to the live pool once it answers. A connection failing its
+    health check is put back on a longer timeout.
+
+    With `circuit_breaker_kwargs` set, every connection also gets a
+    :class:`CircuitBreaker` watching its error rate and response times. A
+    tripped breaker marks its connection as dead even if it never failed
+    hard, and once the connection is resurrected only a fraction of the
+    requests is sent to it until it proves healthy again.
     """
     def __init__(self, connections, dead_timeout=60, timeout_cutoff=5,
-        selector_class=RoundRobinSelector, randomize_hosts=True, **kwargs):
+        selector_class=RoundRobinSelector, randomize_hosts=True,
+        selector_kwargs={}, health_check_interval=None, ping=None,
+        circuit_breaker_kwargs=None, **kwargs):
         """
         :arg connections: list of tuples containing the
             :class:`~elasticsearch.Connection` instance and it's options
@@ -100,12 +283,32 @@ class ConnectionPool(object):
             subclass to use
         :arg randomize_hosts: shuffle the list of connections upon arrival to
             avoid dog piling effect across processes
+        :arg selector_kwargs: additional arguments passed to the
+            `selector_class` constructor, such as the client's zone for the
+            :class:`ZoneAwareSelector`
+        :arg health_check_interval: number of seconds between two checks of
+            the dead connections by the background health checker. Disabled
+            by default, in which case dead connections are resurrected without
+            any check when their timeout is over
+        :arg ping: callable taking a connection, raising an exception if the
+            connection is not healthy. Defaults to a `HEAD /` request
+        :arg circuit_breaker_kwargs: enables a :class:`CircuitBreaker` per
+            connection, created with these arguments
         """
+        # settings of the pools rebuilt by with_connections
+        self.settings = dict(
+            dead_timeout=dead_timeout, timeout_cutoff=timeout_cutoff,
+            selector_class=selector_class, randomize_hosts=randomize_hosts,
+            selector_kwargs=selector_kwargs,
+            health_check_interval=health_check_interval, ping=ping,
+            circuit_breaker_kwargs=circuit_breaker_kwargs)
         self.connection_opts = connections
         self.connections = [c for (c, opts) in connections]
         # PriorityQueue for thread safety and ease of timeout management
         self.dead = PriorityQueue(len(self.connections))
         self.dead_count = {}
+        # guards the replacement of the live connections list and dead_count
+        self.lock = threading.Lock()
 
         if randomize_hosts:
             # randomize the connection list to avoid all clients hitting same
@@ -116,7 +319,33 @@ class ConnectionPool(object):
         self.dead_timeout = dead_timeout
         self.timeout_cutoff = timeout_cutoff
 
-        self.selector = selector_class(dict(connections))
+        self.selector = selector_class(dict(connections), **selector_kwargs)
+
+        self.breakers = None
+        # connections whose circuit breaker is half-open
+        self.half_open = set()
+        if circuit_breaker_kwargs is not None:
+            self.breakers = dict((c, CircuitBreaker(**circuit_breaker_kwargs))
+                                 for c in self.connections)
+
+        self.ping = ping or _head
+        self.health_check_interval = health_check_interval
+        self.health_checker = None
+        if health_check_interval is not None:
+            self.health_checker = HealthChecker(self, health_check_interval)
+            self.health_checker.start()
+
+    def with_connections(self, connections, **kwargs):
+        """
+        Returns a new pool of the given connections with the settings of
+        this one, such as its selector, circuit breakers and health checks.
+
+        :arg connections: list of tuples containing the connection instance
+            and its options
+        :arg kwargs: settings overriding the ones of this pool
+        """
+        settings = dict(self.settings, **kwargs)
+        return self.__class__(connections, **settings)
 
     def mark_dead(self, connection, now=None):
         """
@@ -127,22 +356,31 @@ class ConnectionPool(object):
         """
         # allow inject for testing purposes
         now = now if now else time.time()
-        try:
-            self.connections.remove(connection)
-        except ValueError:
-            # connection not alive or another thread marked it already, ignore
-            return
-        else:
-            dead_count = self.dead_count.get(connection, 0) + 1
-            self.dead_count[connection] = dead_count
-            timeout = self.dead_timeout * 2 ** min(dead_count - 1,
-                                                   self.timeout_cutoff)
-            self.dead.put((now + timeout, connection))
-            logger.warning(
-                'Connection %r has failed for %i times in a row,'
-                ' putting on %i second timeout.',
-                connection, dead_count, timeout
-            )
+        with self.lock:
+            if connection not in self.connections:
+                # connection not alive or another thread marked it already,
+                # ignore
+                return
+            self.connections = [c for c in self.connections
+                                if c != connection]
+            dead_count, timeout = self._put_dead(connection, now)
+        logger.warning(
+            'Connection %r has failed for %i times in a row,'
+            ' putting on %i second timeout.',
+            connection, dead_count, timeout
+        )
+
+    def _put_dead(self, connection, now):
+        """
+        Increase the fail count of a connection and put it on a timeout. Must
+        be called with the lock held.
+        """
+        dead_count = self.dead_count.get(connection, 0) + 1
+        self.dead_count[connection] = dead_count
+        timeout = self.dead_timeout * 2 ** min(dead_count - 1,
+                                               self.timeout_cutoff)
+        self.dead.put((now + timeout, connection))
+        return dead_count, timeout
 
     def mark_live(self, connection):
         """
@@ -151,11 +389,37 @@ class ConnectionPool(object):
 
         :arg connection: the connection to redeem
         """
-        try:
-            del self.dead_count[connection]
-        except KeyError:
-            # race condition, safe to ignore
-            pass
+        # nothing to do for connections that never failed, which is the
+        # common case on every successful request
+        if connection not in self.dead_count:
+            return
+        with self.lock:
+            self.dead_count.pop(connection, None)
+
+    def observe(self, connection, duration, failed=False):
+        """
+        Report the outcome of a request to the `ConnectionSelector` and to
+        the connection's circuit breaker, marking the connection as dead if
+        its breaker trips.
+
+        :arg connection: the connection the request was sent on
+        :arg duration: response time of the request, in seconds
+        :arg failed: whether the request failed because of the host
+        """
+        self.selector.observe(connection, duration, failed)
+
+        if self.breakers is None:
+            return
+        breaker = self.breakers.get(connection)
+        if breaker is None:
+            return
+        tripped = breaker.record(duration, failed)
+        if breaker.state != CircuitBreaker.HALF_OPEN:
+            self.half_open.discard(connection)
+        if tripped:
+            logger.warning('Circuit breaker of connection %r tripped.',
+                           connection)
+            self.mark_dead(connection)
 
     def resurrect(self, force=False):
         """
@@ -167,42 +431,243 @@ class ConnectionPool(object):
             when we have no live connections)
 
         """
-        # no dead connections
-        if self.dead.empty():
-            return
-
+        # peek at the earliest timeout without locking: in the common case
+        # there is no dead connection, or none is eligible yet
         try:
-            # retrieve a connection to check
-            timeout, connection = self.dead.get(block=False)
-        except Empty:
-            # other thread has been faster and the queue is now empty
+            timeout = self.dead.queue[0][0]
+        except IndexError:
+            # no dead connections
             return
-
         if not force and timeout > time.time():
-            # return it back if not eligible and not forced
-            self.dead.put((timeout, connection))
             return
 
-        # either we were forced or the connection is elligible to be retried
-        self.connections.append(connection)
+        with self.lock:
+            try:
+                # retrieve a connection to check
+                timeout, connection = self.dead.get(block=False)
+            except Empty:
+                # other thread has been faster and the queue is now empty
+                return
+
+            if not force and timeout > time.time():
+                # return it back if not eligible and not forced
+                self.dead.put((timeout, connection))
+                return
+
+            # either we were forced or the connection is elligible to be
+            # retried
+            self._revive(connection)
         logger.info('Resurrecting connection %r (force=%s).', connection, force)
 
+    def check_dead(self, now=None):
+        """
+        Ping every dead connection whose timeout is over. Connections that
+        answer are returned to the live pool and marked as live, the others
+        are put back on a (longer) timeout. Called by the `HealthChecker`.
+        """
+        now = now if now else time.time()
+        eligible = []
+        with self.lock:
+            while self.dead.queue and self.dead.queue[0][0] <= now:
+                eligible.append(self.dead.get(block=False)[1])
+
+        for connection in eligible:
+            try:
+                self.ping(connection)
+            except Exception as e:
+                with self.lock:
+                    dead_count, timeout = self._put_dead(connection, now)
+                logger.warning(
+                    'Connection %r failed its health check (%s) %i times in a'
+                    ' row, putting on %i second timeout.',
+                    connection, e, dead_count, timeout
+                )
+            else:
+                with self.lock:
+                    self._revive(connection)
+                self.mark_live(connection)
+                logger.info('Connection %r passed its health check.',
+                            connection)
+
+    def _revive(self, connection):
+        """
+        Return a dead connection to the live pool, half-opening its circuit
+        breaker if it had tripped. Must be called with the lock held.
+        """
+        self.connections = self.connections + [connection]
+        if self.breakers is not None:
+            breaker = self.breakers.get(connection)
+            if breaker is not None and breaker.state == CircuitBreaker.OPEN:
+                breaker.half_open()
+                self.half_open.add(connection)
+
+    def close(self):
+        """
+        Stop the background health checker, if any.
+        """
+        if self.health_checker is not None:
+            self.health_checker.stop()
+
     def get_connection(self):
         """
-        Return a connection from the pool using the `ConnectionSelector`
+        Return a live connection from the pool using the `ConnectionSelector`
         instance.
 
-        It tries to resurrect eligible connections, forces a resurrection when
-        no connections are availible and passes the list of live connections to
-        the selector instance to choose from.
+        Without a health checker, eligible dead connections are resurrected
+        first, and one is resurrected by force when no connection is live.
+        With a health checker, dead connections only return to the pool once
+        they answer a health check: requests are never used to probe them,
+        and :class:`ConnectionPoolEmpty` is raised when no connection is
+        live.
+        """
+        # work on a snapshot, other threads may replace the list meanwhile
+        if self.health_checker is not None:
+            connections = self.connections
+            if not connections:
+                raise ConnectionPoolEmpty('No live connection, the dead ones '
+                                          'are left to the health checker')
+        else:
+            self.resurrect()
+            connections = self.connections
+            # no live nodes, resurrect one by force
+            if not connections:
+                self.resurrect(True)
+                connections = self.connections
+            if not connections:
+                raise ConnectionPoolEmpty('No connection available')
+        if self.half_open:
+            connections = self._skip_half_open(connections)
+        connection = self.selector.select(connections)
+
+        return connection
 
-        Returns a connection instance and it's current fail count.
+    def _skip_half_open(self, connections):
+        """
+        Remove from the candidates the half-open connections that don't get
+        to probe this time, unless that leaves no candidate.
         """
-        self.resurrect()
+        skipped = [c for c in list(self.half_open)
+                   if random.random() >= self.breakers[c].half_open_ratio]
+        if not skipped:
+            return connections
+        candidates = [c for c in connections if c not in skipped]
+        return candidates or connections
 
-        # no live nodes, resurrect one by force
-        if not self.connections:
-            self.resurrect(True)
-        connection = self.selector.select(self.connections)
 
-        return connection
+class CircuitBreaker(object):
+    """
+    Watches the requests sent to a connection over a sliding window of
+    `window` seconds and trips when, out of at least `min_requests`, the
+    share of failed requests reaches `max_error_rate` or the share of
+    requests slower than `slow_request_time` reaches `max_slow_rate`.
+
+    The breaker is then open (its connection is dead) until the connection
+    pool resurrects the connection, which half-opens it: only
+    `half_open_ratio` of the requests are let through, and the breaker closes
+    again after `half_open_requests` consecutive good ones. A single bad
+    request while half-open trips it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, window=10, min_requests=20, max_error_rate=0.5,
+                 slow_request_time=None, max_slow_rate=0.5,
+                 half_open_ratio=0.1, half_open_requests=5):
+        self.window = window
+        self.min_requests = min_requests
+        self.max_error_rate = max_error_rate
+        self.slow_request_time = slow_request_time
+        self.max_slow_rate = max_slow_rate
+        self.half_open_ratio = half_open_ratio
+        self.half_open_requests = half_open_requests
+
+        self.state = self.CLOSED
+        self.probes = 0
+        self.lock = threading.Lock()
+        self._reset()
+
+    def record(self, duration, failed, now=None):
+        """
+        Record the outcome of a request. Returns True if it tripped the
+        breaker.
+        """
+        slow = self.slow_request_time is not None and \
+            duration >= self.slow_request_time
+        with self.lock:
+            if self.state == self.OPEN:
+                # requests started before the breaker tripped
+                return False
+            if self.state == self.HALF_OPEN:
+                if failed or slow:
+                    self.state = self.OPEN
+                    return True
+                self.probes += 1
+                if self.probes >= self.half_open_requests:
+                    self.state = self.CLOSED
+                    self._reset()
+                return False
+
+            # one bucket per second of the window: [second, total, failed,
+            # slow]
+            now = int(now if now else time.time())
+            bucket = self.buckets[now % self.window]
+            if bucket[0] != now:
+                bucket[:] = [now, 0, 0, 0]
+            bucket[1] += 1
+            bucket[2] += failed
+            bucket[3] += slow
+
+            total = errors = slows = 0
+            for second, count, failures, slow_count in self.buckets:
+                if second is not None and second > now - self.window:
+                    total += count
+                    errors += failures
+                    slows += slow_count
+            if total >= self.min_requests and (
+                    errors >= self.max_error_rate * total or
+                    slows >= self.max_slow_rate * total):
+                self.state = self.OPEN
+                return True
+            return False
+
+    def half_open(self):
+        with self.lock:
+            self.state = self.HALF_OPEN
+            self.probes = 0
+
+    def _reset(self):
+        self.buckets = [[None, 0, 0, 0] for _ in range(self.window)]
+
+
+class HealthChecker(threading.Thread):
+    """
+    Daemon thread calling :meth:`ConnectionPool.check_dead` every `interval`
+    seconds. It only holds a weak reference to its pool and stops by itself
+    once the pool is garbage collected.
+    """
+    def __init__(self, pool, interval):
+        super(HealthChecker, self).__init__(name='rawes-health-checker')
+        self.daemon = True
+        self.pool = weakref.ref(pool)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            pool = self.pool()
+            if pool is None:
+                return
+            try:
+                pool.check_dead()
+            except Exception:
+                logger.exception('Health check failed')
+            # don't keep the pool alive while waiting
+            del pool
+
+    def stop(self):
+        self.stopped.set()
+
+
+def _head(connection):
+    connection.request('head', '')
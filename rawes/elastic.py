@@ -14,16 +14,17 @@
 #   limitations under the License.
 #
 
+import functools
 import sys
+import time
 
 from .connection_pool import ConnectionPool
 from .encoders import encode_date_optional_time
 from .http_connection import HttpConnection
+from .scroll import scan, sliced_scan
+from .serializer import get_serializer
+from .transport import Transport
 from .utils import isstr
-try:
-    import simplejson as json
-except ImportError:
-    import json  # noqa
 
 if sys.version_info[0] > 2:
     import urllib.parse as urlparse
@@ -31,13 +32,20 @@ else:
     import urlparse
 
 
-class Elastic(object):
-    """Connect to an elasticsearch instance"""
+class BaseElastic(object):
+    """Path chaining and request methods shared by :class:`Elastic` and
+    :class:`~rawes.async_elastic.AsyncElastic`"""
+
+    transport_class = Transport
 
     def __init__(self, url='localhost:9200', path='', timeout=30,
                  json_encoder=encode_date_optional_time,
                  connection_pool=None,
                  connection_pool_kwargs={},
+                 transport=None,
+                 transport_kwargs={},
+                 serializer=None,
+                 hooks=(),
                  **kwargs):
         """Constructs an :class:`Elastic <Elastic>`, client object.
         Returns :class:`Elastic <Elastic>` object.
@@ -46,7 +54,10 @@ class Elastic(object):
             A list of URL's can be provided if you want to use a connection
             pool for your requests. Each new call will use a different host
             from the conenction pool. If you don't provide any arguments to
-            this constructor then the default url will be used.
+            this constructor then the default url will be used. A host in the
+            list can also be given as a dictionary holding its url under the
+            'url' key along with host attributes (such as 'zone' or
+            'weight') made available to the connection pool's selector.
         :param path: (optional) elasticserach api path you want to make the
             call to.
         :param timeout: (optional) an integer specifying the number of seconds
@@ -59,9 +70,24 @@ class Elastic(object):
         :param connection_pool_kwargs: (optional) a dictionary of arguments to
             be passed to the connection pool in order to expose its options
             directly to the rawes constructor
+        :param transport: (optional) if you have a transport object that you
+            want to reuse you can pass it in here; in this case, the url and
+            connection pool values will be ignored
+        :param transport_kwargs: (optional) a dictionary of arguments to be
+            passed to the transport, such as its retry and sniffing options
+        :param serializer: (optional) JSON backend encoding requests and
+            decoding responses: a name such as 'orjson', 'ujson',
+            'rapidjson', 'simplejson' or 'json', or a serializer object. The
+            fastest installed backend is used by default, see
+            :func:`rawes.serializer.get_serializer`
+        :param hooks: (optional) list of
+            :class:`rawes.metrics.RequestHooks`, such as a
+            :class:`rawes.metrics.MetricsCollector`, called by the transport
+            on send, response and error of every request, with the host it
+            was sent to and its timings
         """
 
-        super(Elastic, self).__init__()
+        super(BaseElastic, self).__init__()
 
         if not isinstance(url, list) and not isstr(url):
             raise ValueError('Url provided is not of right type')
@@ -74,23 +100,47 @@ class Elastic(object):
             if decoded_url.scheme:
                 url = '{0}://{1}'.format(decoded_url.scheme, url)
 
-        if connection_pool is None:
-            urls = [url] if isstr(url) else url
-            # Validate all urls are of correct format host:port
-            for host_url in urls:
-                if '//' not in host_url:
-                    host_url = '//' + host_url
-                if urlparse.urlsplit(host_url).path not in ['', '/']:
+        serializer = get_serializer(serializer)
+        # connections decode the responses with the same serializer
+        kwargs['serializer'] = serializer
+
+        if transport is None and connection_pool is None:
+            hosts = [url] if isstr(url) else url
+            connections = []
+            for host in hosts:
+                # Split host attributes from the url
+                if isinstance(host, dict):
+                    opts = host.copy()
+                    host_url = opts.pop('url')
+                else:
+                    host_url, opts = host, {}
+                # Validate all urls are of correct format host:port
+                split_url = host_url if '//' in host_url else '//' + host_url
+                if urlparse.urlsplit(split_url).path not in ['', '/']:
                     raise ValueError('Url paths not allowed in hosts list')
-            connections = [(self._get_connection_from_url(host_url, timeout,
-                        **kwargs), {}) for host_url in urls]
+                connections.append((self._get_connection_from_url(
+                    host_url, timeout, **kwargs), opts))
             connection_pool = ConnectionPool(connections,
                             **connection_pool_kwargs)
+        if transport is None:
+            # Sniffed hosts get the same connection settings as the given ones
+            options = dict(connection_pool_kwargs=connection_pool_kwargs,
+                           connection_factory=functools.partial(
+                               self._get_connection_from_url,
+                               timeout=timeout, **kwargs),
+                           hooks=hooks)
+            options.update(transport_kwargs)
+            transport = self.transport_class(connection_pool, **options)
 
         self.path = path
         self.timeout = timeout  # seconds
         self.json_encoder = json_encoder
-        self.connection_pool = connection_pool
+        self.serializer = serializer
+        self.transport = transport
+
+    @property
+    def connection_pool(self):
+        return self.transport.connection_pool
 
     def put(self, path='', **kwargs):
         return self.request('put', path, **kwargs)
@@ -108,6 +158,32 @@ class Elastic(object):
         return self.request('head', path, **kwargs)
 
     def request(self, method, path, **kwargs):
+        new_path = self._prepare_request(path, kwargs)
+
+        # The transport selects a connection from the pool for each new
+        # request and fails over to the next one on connection errors
+        return self.transport.perform_request(method, new_path, **kwargs)
+
+    def __getattr__(self, path_item):
+        return self.__getitem__(path_item)
+
+    def __getitem__(self, path_item):
+        return self._with_path(self._build_path(self.path, path_item))
+
+    def _with_path(self, path):
+        """Returns a client sharing this client's settings and connection
+        pool, rooted at the given absolute path"""
+        return self.__class__(
+            timeout=self.timeout,
+            path=path,
+            json_encoder=self.json_encoder,
+            transport=self.transport,
+            serializer=self.serializer
+        )
+
+    def _prepare_request(self, path, kwargs):
+        """Encodes the request data in place and returns the full path"""
+        start = time.time()
         new_path = self._build_path(self.path, path)
 
         # Look for a custom json encoder
@@ -119,22 +195,14 @@ class Elastic(object):
 
         # Encode data dict to json if necessary
         if 'data' in kwargs and type(kwargs['data']) == dict:
-            kwargs['data'] = json.dumps(kwargs['data'], default=json_encoder)
+            kwargs['data'] = self.serializer.dumps(kwargs['data'],
+                                                   default=json_encoder)
 
-        # Always select a connection from the pool for each new request
-        return self.connection_pool.get_connection().request(
-                                                    method, new_path, **kwargs)
+        # reported to the request hooks, see rawes.metrics
+        if getattr(self.transport, 'hooks', None):
+            kwargs['encode_time'] = time.time() - start
 
-    def __getattr__(self, path_item):
-        return self.__getitem__(path_item)
-
-    def __getitem__(self, path_item):
-        new_path = self._build_path(self.path, path_item)
-        return Elastic(
-            timeout=self.timeout,
-            path=new_path,
-            connection_pool=self.connection_pool
-        )
+        return new_path
 
     def _build_path(self, base_path, path_item):
         new_path = '/'.join((str(base_path), str(path_item))) if base_path != '' else str(path_item)
@@ -185,15 +253,30 @@ class Elastic(object):
         if url.scheme == 'http' or url.scheme == 'https':
             return HttpConnection(url.geturl(), timeout=timeout, **kwargs)
         else:
-            if sys.version_info[0] > 2:
-                raise ValueError("Thrift transport is not available "
-                                 "for Python 3")
-
             try:
-                from thrift_connection import ThriftConnection
+                from .thrift_connection import ThriftConnection
             except ImportError:
                 raise ImportError("The 'thrift' python package "
                                     "does not seem to be installed.")
             return ThriftConnection(url.hostname, url.port,
                                     timeout=timeout, **kwargs)
 
+
+class Elastic(BaseElastic):
+    """Connect to an elasticsearch instance"""
+
+    def scan(self, path='', **kwargs):
+        """Iterate over every hit of a search using the scroll API.
+
+        Hits are fetched one page at a time and yielded lazily, so arbitrarily
+        large result sets are read in constant memory. See
+        :func:`rawes.scroll.scan` for the accepted arguments.
+        """
+        return scan(self, path, **kwargs)
+
+    def sliced_scan(self, path='', **kwargs):
+        """Iterate over every hit of a search using several sliced scrolls
+        read concurrently. See :func:`rawes.scroll.sliced_scan` for the
+        accepted arguments.
+        """
+        return sliced_scan(self, path, **kwargs)
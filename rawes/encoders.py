@@ -15,12 +15,57 @@
 #
 
 import datetime
+import decimal
+import uuid
+
 from pytz import timezone
 
+UTC = timezone("UTC")
+_FORMAT = '%04d-%02d-%02dT%02d:%02d:%02dZ'
+
+
+def _format_utc(obj):
+    return _FORMAT % (obj.year, obj.month, obj.day,
+                      obj.hour, obj.minute, obj.second)
+
+
+def _encode_datetime(obj, naive_utc):
+    offset = obj.utcoffset()
+    if offset is None:
+        if not naive_utc:
+            obj = UTC.normalize(obj.astimezone(UTC))
+    elif offset:
+        # shifting by the offset is what astimezone(UTC) does
+        obj = obj - offset
+    return _format_utc(obj)
+
+
 def encode_date_optional_time(obj):
     """
     ISO encode timezone-aware datetimes
     """
     if isinstance(obj, datetime.datetime):
-        return timezone("UTC").normalize(obj.astimezone(timezone("UTC"))).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return _encode_datetime(obj, False)
+    raise TypeError("{0} is not JSON serializable".format(repr(obj)))
+
+
+def encode_common_types(obj):
+    """
+    ISO encode datetimes like encode_date_optional_time, treating naive ones
+    as UTC, and encode dates, decimals, uuids and numpy values
+    """
+    if isinstance(obj, datetime.datetime):
+        return _encode_datetime(obj, True)
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if type(obj).__module__ == 'numpy' and hasattr(obj, 'tolist'):
+        # numpy scalars and arrays, without importing numpy
+        value = obj.tolist()
+        if isinstance(value, (datetime.date, decimal.Decimal)):
+            return encode_common_types(value)
+        return value
     raise TypeError("{0} is not JSON serializable".format(repr(obj)))
@@ -14,24 +14,67 @@
 #   limitations under the License.
 #
 
-try:
-    import simplejson as json
-except ImportError:
-    import json  # noqa
+import time
+import zlib
 
 import requests
+from requests.adapters import HTTPAdapter
 from .elastic_exception import ElasticException
+from .serializer import get_serializer
+from .streaming import HITS_PATH, iter_items
 
 
 class HttpConnection(object):
     """Connects to elasticsearch over HTTP"""
-    def __init__(self, url, timeout=None, **kwargs):
+
+    # Errors after which the transport considers the host dead
+    connection_errors = (requests.exceptions.ConnectionError,)
+    # a connect timeout is a connection error, the request was not sent
+    timeout_errors = (requests.exceptions.ReadTimeout,)
+
+    def __init__(self, url, timeout=None, pool_maxsize=10, pool_block=False,
+                 keep_alive=True, connection_retries=0,
+                 compress_threshold=None, serializer=None, **kwargs):
+        """
+        :arg url: base url of the host, such as `http://localhost:9200`
+        :arg timeout: default timeout of the requests, in seconds
+        :arg pool_maxsize: maximum number of sockets kept open to the host.
+            Use at least as many as the number of threads sharing the
+            connection, otherwise the extra sockets are closed after every
+            request
+        :arg pool_block: when every socket is in use, wait for one to be
+            returned instead of opening an extra one
+        :arg keep_alive: keep the sockets open between requests
+        :arg connection_retries: number of times urllib3 retries a request
+            that failed to connect, before the transport fails over to
+            another host
+        :arg compress_threshold: gzip the request bodies of at least this
+            many bytes, sending them with a `Content-Encoding: gzip` header.
+            Bodies given as an iterable of chunks are always compressed, one
+            chunk at a time. Disabled by default; elasticsearch only accepts
+            compressed requests with `http.compression` enabled
+        :arg serializer: serializer decoding the responses, see
+            :func:`~rawes.serializer.get_serializer`
+        :arg kwargs: arguments passed to every `requests` call, such as
+            `auth` or `verify`
+        """
         super(HttpConnection, self).__init__()
         self.protocol = 'http'
         self.url = url
         self.timeout = timeout
         self.kwargs = kwargs
+        self.compress_threshold = compress_threshold
+        self.serializer = get_serializer(serializer)
         self.session = requests.session()
+        # the connection talks to a single host, hence a single socket pool
+        self.adapter = HTTPAdapter(pool_connections=1,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block,
+                                   max_retries=connection_retries)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
 
     def request(self, method, path, **kwargs):
         args = self.kwargs.copy()
@@ -41,20 +84,97 @@ class HttpConnection(object):
             json_decoder = args["json_decoder"]
             del args["json_decoder"]
         else:
-            json_decoder = json.loads
+            json_decoder = None
+
+        # measures of the request reported to the transport's hooks
+        info = args.pop('info', {})
+
+        # stream=True, or the dotted path of the array to stream
+        stream = args.pop('stream', None)
+        if stream is True:
+            stream = HITS_PATH
 
         if 'timeout' not in args:
             args['timeout'] = self.timeout
+        if self.compress_threshold is not None and \
+                args.get('data') is not None:
+            self._compress(args)
+        if isinstance(args.get('data'), (bytes, type(u''))):
+            info['request_size'] = len(args['data'])
+        start = time.time()
         response = self.session.request(method,
-                                        "/".join((self.url, path)), **args)
-        return self._decode(response, json_decoder)
+                                        "/".join((self.url, path)),
+                                        stream=bool(stream), **args)
+        info['status'] = response.status_code
+        if stream and response.status_code < 400:
+            info['network_time'] = time.time() - start
+            return self._stream(response, stream)
+        info['response_size'] = len(response.content)
+        info['network_time'] = time.time() - start
+        start = time.time()
+        try:
+            return self._decode(response, json_decoder)
+        finally:
+            info['decode_time'] = time.time() - start
+
+    def _stream(self, response, path):
+        """Yield the items of the response found at the given path while the
+        body is being received"""
+        try:
+            chunks = response.iter_content(chunk_size=64 * 1024)
+            for item in iter_items(chunks, path,
+                                   response.encoding or 'utf-8'):
+                yield item
+        finally:
+            response.close()
+
+    def _compress(self, args):
+        data = args['data']
+        if isinstance(data, (bytes, type(u''))):
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            if len(data) < self.compress_threshold:
+                return
+            compressor = _gzip_compressor()
+            args['data'] = compressor.compress(data) + compressor.flush()
+        elif hasattr(data, '__iter__') and not isinstance(data, dict):
+            args['data'] = _gzip_chunks(data)
+        else:
+            # form data and files are left to requests
+            return
+        headers = dict(args.get('headers') or {})
+        headers['Content-Encoding'] = 'gzip'
+        args['headers'] = headers
+
+    def pool_stats(self):
+        """
+        Returns the number of `requests` sent to the host, of `connections`
+        the socket pool had to create because none was free, and how many
+        requests `reused` a pooled connection. A steadily growing number of
+        connections means `pool_maxsize` is too small for the number of
+        threads. Pooled connections reopened after the server closed their
+        socket are not counted.
+        """
+        requests_count = connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_count += pool.num_requests
+                connections += pool.num_connections
+        return {'requests': requests_count, 'connections': connections,
+                'reused': requests_count - connections}
 
     def _decode(self, response, json_decoder):
-        if not response.text:
+        if not response.content:
             decoded = response.status_code < 300
         else:
             try:
-                decoded = json_decoder(response.text)
+                if json_decoder is None:
+                    # decode the raw bytes, skipping charset detection
+                    decoded = self.serializer.loads(response.content)
+                else:
+                    decoded = json_decoder(response.text)
             except ValueError:
                 decoded = False
 
@@ -63,3 +183,20 @@ class HttpConnection(object):
                     message="ElasticSearch Error: {0}".format(response.text),
                     result=decoded, status_code=response.status_code)
         return decoded
+
+
+def _gzip_compressor():
+    # 16 + MAX_WBITS writes a gzip header and trailer around the deflate data
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _gzip_chunks(chunks):
+    """Compress an iterable of body chunks as it is consumed"""
+    compressor = _gzip_compressor()
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,200 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import collections
+import logging
+import threading
+
+logger = logging.getLogger('rawes')
+
+# Percentiles reported by MetricsCollector
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+class RequestEvent(object):
+    """
+    One attempt at sending a request to a host, handed to the request hooks.
+
+    Sizes are in bytes (in characters for request bodies given as text) and
+    times in seconds; the ones a connection cannot measure, such as the size
+    of a streamed response, are None.
+
+    - `host`: url (or host:port) of the connection the attempt was sent on
+    - `attempt`: 0 for the first attempt, then the number of the retry
+    - `encode_time`: time spent encoding the request body to JSON
+    - `network_time`: time from sending the request to receiving the whole
+      response, including the time elasticsearch took to process it
+    - `decode_time`: time spent decoding the response
+    - `duration`: total time of the attempt, once it completed
+    - `error`: the exception the attempt failed with, if any
+    """
+    def __init__(self, method, path, host, attempt=0, encode_time=None):
+        self.method = method
+        self.path = path
+        self.host = host
+        self.attempt = attempt
+        self.status = None
+        self.request_size = None
+        self.response_size = None
+        self.encode_time = encode_time
+        self.network_time = None
+        self.decode_time = None
+        self.duration = None
+        self.error = None
+
+    def update(self, info):
+        """Copy the measures a connection stored in its `info` dictionary"""
+        for name, value in info.items():
+            setattr(self, name, value)
+
+    @property
+    def endpoint(self):
+        """
+        The method and the API endpoint of the request, such as
+        `POST _search`: the last path item starting with an underscore, so
+        that index names and document ids are left out.
+        """
+        items = [item for item in self.path.split('/')
+                 if item.startswith('_')]
+        if not items:
+            return self.method.upper()
+        return '{0} {1}'.format(self.method.upper(), items[-1])
+
+    def __repr__(self):
+        return '<RequestEvent: {0} {1} on {2}, status {3}>'.format(
+            self.method.upper(), self.path, self.host, self.status)
+
+
+class RequestHooks(object):
+    """
+    Base class of the hooks called by the transport for every attempt at
+    sending a request, with a :class:`RequestEvent`. Override the methods
+    of interest and pass instances to `Elastic(hooks=[...])`.
+
+    Hooks are called from the thread sending the request, and an exception
+    raised by a hook is logged without failing the request.
+    """
+    def on_send(self, event):
+        """Called before the request is sent on `event.host`"""
+
+    def on_response(self, event):
+        """Called once the response has been received and decoded"""
+
+    def on_error(self, event):
+        """Called when the attempt failed with `event.error`, which may be
+        an :class:`~rawes.elastic_exception.ElasticException` holding the
+        status of an error response"""
+
+
+class MetricsCollector(RequestHooks):
+    """
+    Request hooks keeping counters and latency histograms in memory, per
+    host and per endpoint (see :attr:`RequestEvent.endpoint`). The
+    percentiles are computed over the last `max_samples` latencies of each
+    host and endpoint.
+    """
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.endpoints = {}
+
+    def on_response(self, event):
+        self._record(event)
+
+    def on_error(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        with self.lock:
+            for stats, key in ((self.hosts, event.host),
+                               (self.endpoints, event.endpoint)):
+                if key not in stats:
+                    stats[key] = _Stats(self.max_samples)
+                stats[key].record(event)
+
+    def snapshot(self):
+        """
+        Returns `{'hosts': {host: stats}, 'endpoints': {endpoint: stats}}`,
+        where `stats` holds the number of `requests` and `errors`, the
+        `p50`, `p95` and `p99` latencies, the total `request_bytes` and
+        `response_bytes`, and the total `encode_time`, `network_time` and
+        `decode_time`.
+        """
+        with self.lock:
+            return {
+                'hosts': dict((key, stats.summary())
+                              for key, stats in self.hosts.items()),
+                'endpoints': dict((key, stats.summary())
+                                  for key, stats in self.endpoints.items()),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.hosts = {}
+            self.endpoints = {}
+
+
+class _Stats(object):
+    def __init__(self, max_samples):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=max_samples)
+        self.totals = dict((name, 0) for name in (
+            'request_bytes', 'response_bytes', 'encode_time',
+            'network_time', 'decode_time'))
+
+    def record(self, event):
+        self.requests += 1
+        if event.error is not None:
+            self.errors += 1
+        if event.duration is not None:
+            self.latencies.append(event.duration)
+        for name, value in (('request_bytes', event.request_size),
+                            ('response_bytes', event.response_size),
+                            ('encode_time', event.encode_time),
+                            ('network_time', event.network_time),
+                            ('decode_time', event.decode_time)):
+            if value is not None:
+                self.totals[name] += value
+
+    def summary(self):
+        summary = dict(self.totals, requests=self.requests,
+                       errors=self.errors)
+        ordered = sorted(self.latencies)
+        for name, percentile in PERCENTILES:
+            summary[name] = ordered[int(percentile * (len(ordered) - 1))] \
+                if ordered else None
+        return summary
+
+
+def call_hooks(hooks, name, event):
+    """Call the given method of every hook, logging their exceptions"""
+    for hook in hooks:
+        try:
+            getattr(hook, name)(event)
+        except Exception:
+            logger.exception('Request hook %r failed', hook)
+
+
+def connection_host(connection):
+    """Name of the host of a connection, as reported in the events"""
+    url = getattr(connection, 'url', None)
+    if url:
+        return url
+    if hasattr(connection, 'host') and hasattr(connection, 'port'):
+        return '{0}:{1}'.format(connection.host, connection.port)
+    return repr(connection)
@@ -0,0 +1,161 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import sys
+import threading
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+from .utils import isstr
+
+logger = logging.getLogger('rawes')
+
+# Marks the end of a slice in the merged hits queue
+_SLICE_DONE = object()
+
+
+class _SliceError(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def scan(es, path='', data=None, scroll='5m', size=None, clear_scroll=True,
+         **kwargs):
+    """
+    Generator yielding every hit of a search, one at a time, using the scroll
+    API.
+
+    Only one page of hits is held in memory. The scroll is kept alive for
+    ``scroll`` between pages and is cleared once the hits are exhausted or the
+    generator is closed or garbage collected.
+
+    :arg es: :class:`~rawes.Elastic` instance to search through
+    :arg path: index/type path to search, relative to the client's path
+    :arg data: search body (a dict or a JSON string), defaults to match_all
+    :arg scroll: how long elasticsearch should keep the scroll alive between
+        two pages
+    :arg size: number of hits fetched for every page
+    :arg clear_scroll: free the scroll context on the server when done
+    :arg kwargs: additional arguments passed to every request
+    """
+    params = dict(kwargs.pop('params', None) or {})
+    params['scroll'] = scroll
+    if size is not None:
+        params['size'] = size
+    if data is None:
+        data = {'query': {'match_all': {}}}
+
+    response = es.post(es._build_path(path, '_search'), data=data,
+                       params=params, **kwargs)
+    scroll_id = response.get('_scroll_id')
+
+    root = es._with_path('')
+    try:
+        while True:
+            hits = response['hits']['hits']
+            if not hits:
+                break
+            for hit in hits:
+                yield hit
+            if not scroll_id:
+                break
+            response = root.post('_search/scroll', data={
+                'scroll': scroll,
+                'scroll_id': scroll_id
+            }, **kwargs)
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id and clear_scroll:
+            try:
+                root.delete('_search/scroll', data={'scroll_id': [scroll_id]})
+            except Exception:
+                logger.warning('Could not clear scroll %s', scroll_id,
+                               exc_info=True)
+
+
+def sliced_scan(es, path='', slices=4, data=None, queue_size=1000, **kwargs):
+    """
+    Generator yielding every hit of a search like :func:`scan`, but reading
+    ``slices`` sliced scrolls concurrently, each on its own thread.
+
+    Every page request picks its connection from the client's connection
+    pool, so the slices are spread over all pooled hosts. Hits from the
+    different slices are merged in arrival order; at most ``queue_size`` hits
+    are buffered before the slice threads wait for the consumer. Remaining
+    arguments are the same as for :func:`scan`.
+
+    :arg slices: number of slices (and threads) the scroll is split into
+    :arg queue_size: maximum number of hits buffered between the slice threads
+        and the consumer
+    """
+    if slices < 2:
+        for hit in scan(es, path, data=data, **kwargs):
+            yield hit
+        return
+
+    if data is None:
+        data = {'query': {'match_all': {}}}
+    elif isstr(data):
+        data = es.serializer.loads(data)
+
+    hits = Queue(queue_size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                hits.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def read_slice(slice_id):
+        body = dict(data)
+        body['slice'] = {'id': slice_id, 'max': slices}
+        slice_hits = scan(es, path, data=body, **kwargs)
+        try:
+            for hit in slice_hits:
+                put(hit)
+                if stopped.is_set():
+                    break
+        except Exception:
+            put(_SliceError(sys.exc_info()[1]))
+        finally:
+            slice_hits.close()
+            put(_SLICE_DONE)
+
+    threads = [threading.Thread(target=read_slice, args=(slice_id,))
+               for slice_id in range(slices)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    running = slices
+    try:
+        while running:
+            hit = hits.get()
+            if hit is _SLICE_DONE:
+                running -= 1
+            elif isinstance(hit, _SliceError):
+                raise hit.error
+            else:
+                yield hit
+    finally:
+        stopped.set()
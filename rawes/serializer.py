@@ -0,0 +1,169 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import datetime
+import logging
+
+from .utils import isstr
+
+logger = logging.getLogger('rawes')
+
+# Encoded by a backend before it is selected: a backend has to encode
+# numeric keys like json does and leave datetimes to `default`
+_PROBE = {1: datetime.datetime(2013, 7, 4, 23, 14, 53)}
+_PROBE_RESULT = {'1': '2013-07-04T23:14:53'}
+
+
+class JsonSerializer(object):
+    """
+    Encodes request bodies and decodes responses with the standard library
+    `json` module. The other serializers wrap a faster backend behind the
+    same two methods.
+
+    `loads` takes the raw response body as bytes (or text), so connections
+    can skip decoding it to text first.
+    """
+    name = 'json'
+
+    def __init__(self):
+        import json
+        self.json = json
+
+    def dumps(self, obj, default=None):
+        """Encode `obj`, calling `default` for objects the backend can't
+        serialize. Returns text or utf-8 encoded bytes."""
+        return self.json.dumps(obj, default=default)
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return self.json.loads(data)
+
+    def __repr__(self):
+        return '<{0}>'.format(self.__class__.__name__)
+
+
+class SimplejsonSerializer(JsonSerializer):
+    name = 'simplejson'
+
+    def __init__(self):
+        import simplejson
+        self.json = simplejson
+
+
+class OrjsonSerializer(JsonSerializer):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        # datetimes are left to `default` so json_encoder keeps its say on
+        # their format, and dictionary keys may be numbers as with json
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | \
+            orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, default=None):
+        return self.orjson.dumps(obj, default=default, option=self.options)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+
+class UjsonSerializer(JsonSerializer):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def dumps(self, obj, default=None):
+        return self.ujson.dumps(obj, default=default)
+
+    def loads(self, data):
+        return self.ujson.loads(data)
+
+
+class RapidjsonSerializer(JsonSerializer):
+    name = 'rapidjson'
+
+    def __init__(self):
+        import rapidjson
+        self.rapidjson = rapidjson
+
+    def dumps(self, obj, default=None):
+        # numeric keys are rejected otherwise, while json turns them into
+        # strings
+        return self.rapidjson.dumps(
+            obj, default=default,
+            mapping_mode=self.rapidjson.MM_COERCE_KEYS_TO_STRINGS)
+
+    def loads(self, data):
+        return self.rapidjson.loads(data)
+
+
+# Backends by order of preference
+SERIALIZERS = (OrjsonSerializer, UjsonSerializer, RapidjsonSerializer,
+               SimplejsonSerializer, JsonSerializer)
+
+_default = None
+
+
+def get_serializer(serializer=None):
+    """
+    Returns a serializer instance.
+
+    :arg serializer: a serializer instance, which is returned as is, the
+        name of a backend such as `'orjson'` or `'json'`, or None for the
+        fastest backend installed. That one is selected once, and logged.
+        A backend is only used if it encodes a dictionary with a numeric
+        key and a datetime like json does: a named one raises a ValueError
+        otherwise, and the next one is selected by default.
+    """
+    global _default
+    if serializer is None:
+        if _default is None:
+            _default = _first_available(SERIALIZERS)
+            logger.info('Using %s to encode and decode JSON', _default.name)
+        return _default
+    if not isstr(serializer):
+        return serializer
+    for cls in SERIALIZERS:
+        if cls.name == serializer:
+            backend = cls()
+            try:
+                _probe(backend)
+            except Exception as e:
+                raise ValueError('The {0} JSON serializer is not usable: '
+                                 '{1}'.format(serializer, e))
+            return backend
+    raise ValueError('Unknown JSON serializer {0!r}'.format(serializer))
+
+
+def _first_available(classes):
+    for cls in classes:
+        try:
+            backend = cls()
+            _probe(backend)
+            return backend
+        except Exception as e:
+            # not installed, or too old to encode like json
+            logger.debug('Skipping the %s JSON serializer: %s', cls.name, e)
+
+
+def _probe(backend):
+    encoded = backend.dumps(_PROBE, default=lambda obj: obj.isoformat())
+    if backend.loads(encoded) != _PROBE_RESULT:
+        raise ValueError('unexpected encoding {0!r}'.format(encoded))
@@ -0,0 +1,180 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import codecs
+import re
+
+# not the client's serializer: parsing a response as it is received needs
+# the raw_decode method that only the json and simplejson decoders have
+try:
+    import simplejson as json
+except ImportError:
+    import json  # noqa
+
+# Path of the hits in a search response
+HITS_PATH = 'hits.hits'
+
+_WHITESPACE = re.compile(r'\s*')
+# characters that open or close a container or a string
+_STRUCTURE = re.compile(r'["{}\[\]]')
+# characters that end a string or escape the next one
+_STRING_END = re.compile(r'["\\]')
+# characters that may go on a number cut short by the end of a chunk, as in
+# `1` followed by `.5` or `1.` followed by `5`
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+def iter_items(chunks, path=HITS_PATH, encoding='utf-8'):
+    """
+    Parse a JSON document arriving as an iterable of chunks and yield the
+    items of the array found at the given dotted path (the hits of a search
+    response by default), each one as soon as it has been received.
+
+    Only one item is held in memory at a time: the values found before and
+    after the path are skipped without being decoded. If the value at the
+    path is not an array it is yielded as a single item, and nothing is
+    yielded if the path does not exist.
+
+    :arg chunks: iterable of bytes or text
+    :arg path: keys leading to the array, separated by dots
+    :arg encoding: encoding of the chunks given as bytes
+    """
+    reader = _Reader(chunks, encoding)
+    if not reader.seek(path.split('.') if path else []):
+        return
+    if reader.peek() != '[':
+        yield reader.decode_value()
+        return
+    reader.pos += 1
+    while reader.peek() != ']':
+        yield reader.decode_value()
+        if reader.peek() == ',':
+            reader.pos += 1
+
+
+class _Reader(object):
+    """Incremental reader over a buffer of the received text"""
+    def __init__(self, chunks, encoding):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = u''
+        self.pos = 0
+        self.done = False
+
+    def fill(self):
+        """Read the next chunk, returning False at the end of the input"""
+        while not self.done:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.done = True
+                chunk = self.decoder.decode(b'', True)
+            else:
+                if isinstance(chunk, bytes):
+                    chunk = self.decoder.decode(chunk)
+            if chunk:
+                # drop what has already been read
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self):
+        """Skip whitespace and return the next character"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON input')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {0!r} at {1!r}'.format(
+                char, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def decode_value(self):
+        """Decode the next value, reading more input until it is complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the end of the buffer may go on in the next chunk
+            if (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS) \
+                    and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        """Move past the next value without decoding it"""
+        if self.peek() not in '{[':
+            self.decode_value()
+            return
+        depth = 0
+        in_string = False
+        while True:
+            pattern = _STRING_END if in_string else _STRUCTURE
+            match = pattern.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    raise ValueError('Unexpected end of JSON input')
+                continue
+            char = match.group()
+            if char == '\\':
+                # the escaped character may be in the next chunk
+                if match.end() == len(self.buf):
+                    self.pos = match.start()
+                    if not self.fill():
+                        raise ValueError('Unexpected end of JSON input')
+                    continue
+                self.pos = match.end() + 1
+                continue
+            self.pos = match.end()
+            if char == '"':
+                in_string = not in_string
+            elif char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def seek(self, keys):
+        """Move to the value found at the given keys, returning False if one
+        of them is missing"""
+        for key in keys:
+            if self.peek() != '{':
+                return False
+            self.pos += 1
+            while True:
+                if self.peek() == '}':
+                    return False
+                name = self.decode_value()
+                self.expect(':')
+                if name == key:
+                    break
+                self.skip_value()
+                if self.peek() == ',':
+                    self.pos += 1
+        return True
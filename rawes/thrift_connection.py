@@ -14,36 +14,177 @@
 #   limitations under the License.
 #
 
+import functools
+import logging
+import socket
+import threading
+import time
+
 try:
-    import simplejson as json
+    from Queue import LifoQueue, Empty
 except ImportError:
-    import json  # noqa
+    from queue import LifoQueue, Empty
 
+from thrift.Thrift import TApplicationException, TMessageType
 from thrift.transport import TSocket
 from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
 
-from rawes.thrift_elasticsearch import Rest
-from rawes.thrift_elasticsearch.ttypes import Method, RestRequest
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
+
+from .elastic_exception import ElasticException
+from .serializer import get_serializer
+from .thrift_elasticsearch import Rest
+from .thrift_elasticsearch.ttypes import Method, RestRequest
+
+logger = logging.getLogger('rawes')
+
+# Methods of the requests that can be sent again when a stale socket may
+# have received them
+IDEMPOTENT_METHODS = (Method.GET, Method.HEAD)
+
+# Bodies from which the fastbinary extension encodes requests more slowly
+# than the python protocol, see benchmarks/thrift_protocol.py
+LARGE_BODY = 6 * 1024
+
+
+class ThriftTimeout(TTransport.TTransportException):
+    """The host did not answer a thrift request within the timeout"""
+
 
-from elastic_exception import ElasticException
+class _AcceleratedProtocol(TBinaryProtocol.TBinaryProtocolAccelerated):
+    """
+    Accelerated protocol leaving requests with a large body to the python
+    protocol: fastbinary copies the body into a buffer it grows as it goes,
+    costing about 2us per KB, while the python protocol hands the body to
+    the transport in one write.
+    """
+    def __init__(self, *args, **kwargs):
+        TBinaryProtocol.TBinaryProtocolAccelerated.__init__(self, *args,
+                                                            **kwargs)
+        # bound to the transport rather than to the protocol, which would
+        # make a reference cycle of every protocol
+        if self._fast_encode is not None:
+            self._fast_encode = functools.partial(
+                _encode_accelerated, TBinaryProtocol.TBinaryProtocol(self.trans))
+
+
+def _encode_accelerated(python_protocol, obj, spec):
+    """Returns the encoded struct, or writes it to the transport with the
+    python protocol if it holds a large request body"""
+    request = getattr(obj, 'request', None)
+    if request is not None and request.body is not None and \
+            len(request.body) >= LARGE_BODY:
+        obj.write(python_protocol)
+        return b''
+    return fastbinary.encode_binary(obj, spec)
+
+
+class _Socket(TSocket.TSocket):
+    """
+    Thrift socket recording whether a write failed and counting the bytes it
+    received, to tell a stale idle socket from a request the host may have
+    received, and raising timeouts as :class:`ThriftTimeout`.
+    """
+    def __init__(self, *args, **kwargs):
+        TSocket.TSocket.__init__(self, *args, **kwargs)
+        self.reset()
+
+    def reset(self):
+        self.write_failed = False
+        self.bytes_read = 0
+
+    def write(self, buff):
+        try:
+            TSocket.TSocket.write(self, buff)
+        except Exception:
+            self.write_failed = True
+            raise
+
+    def read(self, sz):
+        try:
+            buff = TSocket.TSocket.read(self, sz)
+        except TTransport.TTransportException as e:
+            if e.type == TTransport.TTransportException.TIMED_OUT:
+                raise ThriftTimeout(e.type, e.message)
+            raise
+        self.bytes_read += len(buff)
+        return buff
 
 
 class ThriftConnection(object):
-    """Connects to elasticsearch over thrift protocol"""
-    def __init__(self, host, port, timeout=None, **kwargs):
+    """
+    Connects to elasticsearch over thrift protocol.
+
+    Each request checks a socket out of a pool of up to `pool_size` sockets
+    to the host, so that concurrent threads never share one. Sockets are
+    opened when first needed and reused afterwards. A socket failing with a
+    transport error is closed along with the idle ones, which are likely
+    broken as well, and the error is raised for the transport to mark the
+    host as dead. A request failing on a reused socket, which the host may
+    have closed while it was idle, is first retried once on a new socket if
+    it could not be written, or if it is a `get` or `head` request that got
+    no answer at all. Other requests may have been executed by the host.
+
+    Requests can also be pipelined with :meth:`pipeline`: several requests
+    are written back-to-back on one socket before their responses are read,
+    so that a batch of small requests costs about one round trip instead of
+    one per request.
+    """
+
+    # Errors after which the transport considers the host dead
+    connection_errors = (TTransport.TTransportException, socket.error)
+    # Timeouts, only retried by the transport with retry_on_timeout
+    timeout_errors = (ThriftTimeout,)
+
+    def __init__(self, host, port, timeout=None, serializer=None,
+                 pool_size=10, accelerated=False, framed=False,
+                 buffer_size=4096, **kwargs):
+        """
+        :arg host: host name of the elasticsearch node
+        :arg port: port of its thrift plugin
+        :arg timeout: socket timeout, in seconds
+        :arg serializer: serializer decoding the responses, see
+            :func:`~rawes.serializer.get_serializer`
+        :arg pool_size: maximum number of sockets open to the host. Requests
+            wait for a free socket once they are all in use
+        :arg accelerated: encode requests and decode responses with the
+            `TBinaryProtocolAccelerated` C extension of the thrift package.
+            Falls back to the pure python protocol, with a warning, when the
+            extension is not compiled
+        :arg framed: use the framed transport, for thrift servers expecting
+            framed messages
+        :arg buffer_size: read buffer size of the buffered (non framed)
+            transport, in bytes
+        """
         self.protocol = 'thrift'
         self.host = host
         self.port = port
-        tsocket = TSocket.TSocket(self.host, self.port)
-        if timeout is not None:
-            tsocket.setTimeout(timeout * 1000)  # thrift expects ms
-        transport = TTransport.TBufferedTransport(tsocket)
-        protocol = TBinaryProtocol.TBinaryProtocol(transport)
-        self.client = Rest.Client(protocol)
-        transport.open()
+        self.timeout = timeout
+        self.serializer = get_serializer(serializer)
+        self.pool_size = pool_size
+        # idle clients, the most recently used first as its socket is the
+        # least likely to have been closed by the host
+        self.clients = LifoQueue()
+        self.slots = threading.Semaphore(pool_size)
         self.kwargs = kwargs
 
+        self.framed = framed
+        self.buffer_size = buffer_size
+        self.protocol_class = TBinaryProtocol.TBinaryProtocol
+        if accelerated:
+            if fastbinary is None:
+                logger.warning('The thrift fastbinary extension is not '
+                               'available, falling back to TBinaryProtocol')
+            else:
+                self.protocol_class = _AcceleratedProtocol
+
+    def __repr__(self):
+        return '<ThriftConnection: {0}:{1}>'.format(self.host, self.port)
+
     method_mappings = {
         'get': Method.GET,
         'post': Method.POST,
@@ -53,17 +194,56 @@ class ThriftConnection(object):
     }
 
     def request(self, method, path, **kwargs):
+        # measures of the request reported to the transport's hooks
+        info = kwargs.pop('info', {})
+        request, json_decoder = self._build_request(method, path, kwargs)
+        info['request_size'] = len(request.body or b'')
+        start = time.time()
+        response = self._execute(request)
+        info['status'] = response.status
+        info['response_size'] = len(response.body or b'')
+        info['network_time'] = time.time() - start
+        start = time.time()
+        try:
+            return self._decode(response, json_decoder)
+        finally:
+            info['decode_time'] = time.time() - start
+
+    def pipeline(self, window=100, transport=None):
+        """
+        Returns a :class:`ThriftPipeline` queueing requests to send together
+        on one socket.
+
+        :arg window: maximum number of requests sent ahead of the responses
+            read. Bounds the data buffered by the sockets, which would
+            otherwise block both ends once full
+        :arg transport: :class:`~rawes.transport.Transport` sending the
+            pipeline on a connection of its pool, see
+            :meth:`~rawes.transport.Transport.pipeline`
+        """
+        return ThriftPipeline(self, window, transport)
+
+    def _build_request(self, method, path, kwargs):
+        """Returns the RestRequest and the json_decoder of a request"""
         newkwargs = self.kwargs.copy()
         newkwargs.update(kwargs)
         thriftargs = {}
 
+        if newkwargs.get('stream'):
+            raise ValueError("Streamed responses are not available for "
+                             "ThriftConnection")
+
         if "json_decoder" in newkwargs:
             json_decoder = newkwargs["json_decoder"]
         else:
-            json_decoder = json.loads
+            json_decoder = None
 
         if 'data' in newkwargs:
-            thriftargs['body'] = newkwargs['data']
+            body = newkwargs['data']
+            # the body is sent as thrift binary
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            thriftargs['body'] = body
 
         if 'params' in newkwargs:
             thriftargs['parameters'] = self._dict_to_map_str_str(newkwargs['params'])
@@ -72,17 +252,168 @@ class ThriftConnection(object):
             thriftargs['headers'] = self._dict_to_map_str_str(newkwargs['headers'])
 
         mapped_method = ThriftConnection.method_mappings[method]
-        request = RestRequest(method=mapped_method, uri=path, **thriftargs)
-        response = self.client.execute(request)
+        return (RestRequest(method=mapped_method, uri=path, **thriftargs),
+                json_decoder)
+
+    def _execute(self, request):
+        return self._with_client(lambda client: client.execute(request),
+                                 request.method in IDEMPOTENT_METHODS)
 
-        return self._decode(response, json_decoder)
+    def _execute_pipelined(self, requests, window):
+        """
+        Send the requests on one socket, returning a list holding the
+        response, or the TApplicationException, of each one
+        """
+        results = {}
+        # requests written before a failed write may have been received
+        self._with_client(
+            lambda client: self._pipeline(client, requests, window, results),
+            all(request.method in IDEMPOTENT_METHODS for request in requests),
+            single=False)
+        return [results[seqid] for seqid in range(len(requests))]
+
+    def _with_client(self, send, idempotent, single=True):
+        """
+        Call `send` with a client checked out of the pool and return its
+        result. When it fails on a reused socket that the host closed while
+        it was idle, it is called again once with a new socket.
+
+        :arg idempotent: whether the requests sent can be executed twice by
+            the host
+        :arg single: whether `send` writes a single request, which the host
+            cannot have received in full if writing it failed
+        """
+        self.slots.acquire()
+        try:
+            try:
+                client = self.clients.get_nowait()
+                reused = True
+            except Empty:
+                client = self._open_client()
+                reused = False
+            client.tsocket.reset()
+            try:
+                result = send(client)
+            except self.connection_errors as e:
+                self._close_client(client)
+                self.close()
+                if not reused or not self._stale(client, e, idempotent,
+                                                 single):
+                    raise
+                # the host may have closed the idle socket, reconnect
+                client = self._open_client()
+                try:
+                    result = send(client)
+                except Exception:
+                    self._close_client(client)
+                    raise
+            except Exception:
+                # the socket may be left in the middle of a message
+                self._close_client(client)
+                raise
+            self.clients.put(client)
+            return result
+        finally:
+            self.slots.release()
+
+    def _pipeline(self, client, requests, window, results):
+        """
+        Write the requests numbered by their sequence id, reading a response
+        whenever `window` requests are waiting for one, and store the
+        responses in `results` by the sequence id they answer.
+        """
+        oprot = client._oprot
+        pending = set()
+        for seqid, request in enumerate(requests):
+            if len(pending) >= window:
+                oprot.trans.flush()
+                self._receive(client, pending, results)
+            oprot.writeMessageBegin('execute', TMessageType.CALL, seqid)
+            Rest.execute_args(request=request).write(oprot)
+            oprot.writeMessageEnd()
+            pending.add(seqid)
+        oprot.trans.flush()
+        while pending:
+            self._receive(client, pending, results)
+
+    def _receive(self, client, pending, results):
+        iprot = client._iprot
+        fname, mtype, rseqid = iprot.readMessageBegin()
+        if mtype == TMessageType.EXCEPTION:
+            result = TApplicationException()
+            result.read(iprot)
+        else:
+            response = Rest.execute_result()
+            response.read(iprot)
+            result = response.success
+            if result is None:
+                result = TApplicationException(
+                    TApplicationException.MISSING_RESULT,
+                    'execute failed: unknown result')
+        iprot.readMessageEnd()
+        if rseqid not in pending:
+            # the socket is out of sync, and closed by the caller
+            raise TApplicationException(
+                TApplicationException.BAD_SEQUENCE_ID,
+                'Unexpected response sequence id {0}'.format(rseqid))
+        pending.remove(rseqid)
+        results[rseqid] = result
+
+    def _stale(self, client, error, idempotent, single):
+        """
+        Whether requests can be sent again after failing on a socket the
+        host may have closed while it was idle: the host answered nothing,
+        and either a single request could not be written, or the host did
+        not time out and sending the requests twice is harmless. The host
+        may have received requests that were written before it closed the
+        socket.
+        """
+        tsocket = client.tsocket
+        if tsocket.bytes_read:
+            return False
+        if tsocket.write_failed and single:
+            return True
+        return idempotent and not isinstance(error, self.timeout_errors)
+
+    def _open_client(self):
+        tsocket = _Socket(self.host, self.port)
+        if self.timeout is not None:
+            tsocket.setTimeout(self.timeout * 1000)  # thrift expects ms
+        if self.framed:
+            transport = TTransport.TFramedTransport(tsocket)
+        else:
+            transport = TTransport.TBufferedTransport(tsocket,
+                                                      self.buffer_size)
+        protocol = self.protocol_class(transport)
+        transport.open()
+        client = Rest.Client(protocol)
+        client.tsocket = tsocket
+        return client
+
+    def _close_client(self, client):
+        try:
+            client._oprot.trans.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close the idle sockets"""
+        while True:
+            try:
+                client = self.clients.get_nowait()
+            except Empty:
+                return
+            self._close_client(client)
 
     def _decode(self, response, json_decoder):
         if not response.body:
             decoded = response.status < 300
         else:
             try:
-                decoded = json_decoder(response.body)
+                if json_decoder is None:
+                    decoded = self.serializer.loads(response.body)
+                else:
+                    decoded = json_decoder(response.body.decode('utf-8'))
             except ValueError:
                 decoded = False
 
@@ -95,7 +426,109 @@ class ThriftConnection(object):
         """
         Thrift requires the params and headers dict values to only contain str values.
         """
-        return dict(map(
-            lambda (k, v): (k, str(v).lower() if isinstance(v, bool) else str(v)),
-            d.iteritems()
-        ))
+        return dict(
+            (k, str(v).lower() if isinstance(v, bool) else str(v))
+            for k, v in d.items()
+        )
+
+
+class ThriftPipeline(object):
+    """
+    Queues requests to a :class:`ThriftConnection` and sends them together
+    on one socket, matching each response to its request by the sequence id
+    of the thrift message.
+
+    :meth:`request` returns a :class:`ThriftFuture` holding the result once
+    :meth:`execute` has been called, which happens when leaving a `with`
+    block::
+
+        with connection.pipeline() as pipeline:
+            first = pipeline.request('get', 'tweets/tweet/1')
+            second = pipeline.request('get', 'tweets/tweet/2')
+        first.result()
+
+    The requests are not retried on another host: a connection error is
+    raised by :meth:`execute`, and by the futures left without a response.
+    A pipeline created by :meth:`rawes.transport.Transport.pipeline` is
+    sent on a connection picked from the transport's pool on every
+    :meth:`execute` call, and reported to the pool and the request hooks.
+    Otherwise it is always sent on its connection, unknown to the pool.
+    """
+    def __init__(self, connection, window=100, transport=None):
+        self.connection = connection
+        self.window = window
+        self.transport = transport
+        self.queued = []
+
+    def request(self, method, path, **kwargs):
+        """Queue a request, taking the arguments of
+        :meth:`ThriftConnection.request`. Returns a :class:`ThriftFuture`"""
+        request, json_decoder = self.connection._build_request(method, path,
+                                                               kwargs)
+        future = ThriftFuture(self.connection, json_decoder)
+        self.queued.append((method, path, request, future))
+        return future
+
+    def execute(self):
+        """Send the queued requests and complete their futures, which are
+        returned in the order of the requests"""
+        queued, self.queued = self.queued, []
+        if not queued:
+            return []
+        requests = [request for method, path, request, future in queued]
+        futures = [future for method, path, request, future in queued]
+
+        def send(connection):
+            return connection._execute_pipelined(requests, self.window)
+
+        try:
+            if self.transport is None:
+                responses = send(self.connection)
+            else:
+                responses = self.transport._send_pipeline(
+                    send, [(method, path) for method, path, request, future
+                           in queued])
+        except Exception as e:
+            for future in futures:
+                future._set(error=e)
+            raise
+        for future, response in zip(futures, responses):
+            if isinstance(response, Exception):
+                future._set(error=response)
+            else:
+                future._set(response=response)
+        return futures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+
+class ThriftFuture(object):
+    """Result of a request sent through a :class:`ThriftPipeline`"""
+    def __init__(self, connection, json_decoder):
+        self.connection = connection
+        self.json_decoder = json_decoder
+        self.response = None
+        self.error = None
+        self.completed = False
+
+    def _set(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.completed = True
+
+    def result(self):
+        """
+        Returns the decoded response, or raises the error of the request:
+        an :class:`~rawes.elastic_exception.ElasticException` for an error
+        response, or the error that broke the pipeline.
+        """
+        if not self.completed:
+            raise ValueError('The pipeline has not been executed')
+        if self.error is not None:
+            raise self.error
+        return self.connection._decode(self.response, self.json_decoder)
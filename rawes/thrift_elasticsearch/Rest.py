@@ -1,5 +1,6 @@
 #
-# Autogenerated by Thrift Compiler (0.8.0)
+# Autogenerated by Thrift Compiler (0.8.0), ported to the Python 3 compatible
+# API of thrift 0.10 and later
 #
 # DO NOT EDIT UNLESS YOU ARE SURE THAT YOU KNOW WHAT YOU ARE DOING
 #
@@ -7,18 +8,13 @@
 #
 
 from thrift.Thrift import TType, TMessageType, TException, TApplicationException
-from ttypes import *
+from .ttypes import *
 from thrift.Thrift import TProcessor
 from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol, TProtocol
+from thrift.protocol import TProtocol
 
-try:
-    from thrift.protocol import fastbinary
-except:
-    fastbinary = None
 
-
-class Iface:
+class Iface(object):
 
     def execute(self, request):
         """
@@ -103,7 +99,7 @@ class Processor(Iface, TProcessor):
 # HELPER FUNCTIONS AND STRUCTURES
 
 
-class execute_args:
+class execute_args(object):
     """
     Attributes:
     - request
@@ -111,15 +107,15 @@ class execute_args:
 
     thrift_spec = (
         None,  # 0
-        (1, TType.STRUCT, 'request', (RestRequest, RestRequest.thrift_spec), None, ),  # 1
+        (1, TType.STRUCT, 'request', [RestRequest, RestRequest.thrift_spec], None, ),  # 1
     )
 
     def __init__(self, request=None):
         self.request = request
 
     def read(self, iprot):
-        if iprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None and fastbinary is not None:
-            fastbinary.decode_binary(self, iprot.trans, (self.__class__, self.thrift_spec))
+        if iprot._fast_decode is not None and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None:
+            iprot._fast_decode(self, iprot, [self.__class__, self.thrift_spec])
             return
         iprot.readStructBegin()
         while True:
@@ -138,8 +134,8 @@ class execute_args:
         iprot.readStructEnd()
 
     def write(self, oprot):
-        if oprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and self.thrift_spec is not None and fastbinary is not None:
-            oprot.trans.write(fastbinary.encode_binary(self, (self.__class__, self.thrift_spec)))
+        if oprot._fast_encode is not None and self.thrift_spec is not None:
+            oprot.trans.write(oprot._fast_encode(self, [self.__class__, self.thrift_spec]))
             return
         oprot.writeStructBegin('execute_args')
         if self.request is not None:
@@ -156,7 +152,7 @@ class execute_args:
 
     def __repr__(self):
         L = ['%s=%r' % (key, value)
-             for key, value in self.__dict__.iteritems()]
+             for key, value in self.__dict__.items()]
         return '%s(%s)' % (self.__class__.__name__, ', '.join(L))
 
     def __eq__(self, other):
@@ -166,22 +162,22 @@ class execute_args:
         return not (self == other)
 
 
-class execute_result:
+class execute_result(object):
     """
     Attributes:
     - success
     """
 
     thrift_spec = (
-        (0, TType.STRUCT, 'success', (RestResponse, RestResponse.thrift_spec), None, ),  # 0
+        (0, TType.STRUCT, 'success', [RestResponse, RestResponse.thrift_spec], None, ),  # 0
     )
 
     def __init__(self, success=None,):
         self.success = success
 
     def read(self, iprot):
-        if iprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None and fastbinary is not None:
-            fastbinary.decode_binary(self, iprot.trans, (self.__class__, self.thrift_spec))
+        if iprot._fast_decode is not None and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None:
+            iprot._fast_decode(self, iprot, [self.__class__, self.thrift_spec])
             return
         iprot.readStructBegin()
         while True:
@@ -200,8 +196,8 @@ class execute_result:
         iprot.readStructEnd()
 
     def write(self, oprot):
-        if oprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and self.thrift_spec is not None and fastbinary is not None:
-            oprot.trans.write(fastbinary.encode_binary(self, (self.__class__, self.thrift_spec)))
+        if oprot._fast_encode is not None and self.thrift_spec is not None:
+            oprot.trans.write(oprot._fast_encode(self, [self.__class__, self.thrift_spec]))
             return
         oprot.writeStructBegin('execute_result')
         if self.success is not None:
@@ -216,7 +212,7 @@ class execute_result:
 
     def __repr__(self):
         L = ['%s=%r' % (key, value)
-             for key, value in self.__dict__.iteritems()]
+             for key, value in self.__dict__.items()]
         return '%s(%s)' % (self.__class__.__name__, ', '.join(L))
 
     def __eq__(self, other):
@@ -1,22 +1,20 @@
 #
-# Autogenerated by Thrift Compiler (0.8.0)
+# Autogenerated by Thrift Compiler (0.8.0), ported to the Python 3 compatible
+# API of thrift 0.10 and later
 #
 # DO NOT EDIT UNLESS YOU ARE SURE THAT YOU KNOW WHAT YOU ARE DOING
 #
 #  options string: py
 #
 
+import sys
+
 from thrift.Thrift import TType, TMessageType, TException
 from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol, TProtocol
-
-try:
-    from thrift.protocol import fastbinary
-except:
-    fastbinary = None
+from thrift.protocol import TProtocol
 
 
-class Method:
+class Method(object):
     GET = 0
     PUT = 1
     POST = 2
@@ -43,7 +41,7 @@ class Method:
     }
 
 
-class Status:
+class Status(object):
     CONT = 100
     SWITCHING_PROTOCOLS = 101
     OK = 200
@@ -184,7 +182,7 @@ class Status:
     }
 
 
-class RestRequest:
+class RestRequest(object):
     """
     Attributes:
     - method
@@ -197,10 +195,10 @@ class RestRequest:
     thrift_spec = (
         None,  # 0
         (1, TType.I32, 'method', None, None, ),  # 1
-        (2, TType.STRING, 'uri', None, None, ),  # 2
-        (3, TType.MAP, 'parameters', (TType.STRING, None, TType.STRING, None), None, ),  # 3
-        (4, TType.MAP, 'headers', (TType.STRING, None, TType.STRING, None), None, ),  # 4
-        (5, TType.STRING, 'body', None, None, ),  # 5
+        (2, TType.STRING, 'uri', 'UTF8', None, ),  # 2
+        (3, TType.MAP, 'parameters', (TType.STRING, 'UTF8', TType.STRING, 'UTF8', False), None, ),  # 3
+        (4, TType.MAP, 'headers', (TType.STRING, 'UTF8', TType.STRING, 'UTF8', False), None, ),  # 4
+        (5, TType.STRING, 'body', 'BINARY', None, ),  # 5
     )
 
     def __init__(self, method=None, uri=None, parameters=None, headers=None, body=None,):
@@ -211,8 +209,8 @@ class RestRequest:
         self.body = body
 
     def read(self, iprot):
-        if iprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None and fastbinary is not None:
-            fastbinary.decode_binary(self, iprot.trans, (self.__class__, self.thrift_spec))
+        if iprot._fast_decode is not None and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None:
+            iprot._fast_decode(self, iprot, [self.__class__, self.thrift_spec])
             return
         iprot.readStructBegin()
         while True:
@@ -226,16 +224,16 @@ class RestRequest:
                     iprot.skip(ftype)
             elif fid == 2:
                 if ftype == TType.STRING:
-                    self.uri = iprot.readString()
+                    self.uri = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
                 else:
                     iprot.skip(ftype)
             elif fid == 3:
                 if ftype == TType.MAP:
                     self.parameters = {}
                     (_ktype1, _vtype2, _size0) = iprot.readMapBegin()
-                    for _i4 in xrange(_size0):
-                        _key5 = iprot.readString()
-                        _val6 = iprot.readString()
+                    for _i4 in range(_size0):
+                        _key5 = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
+                        _val6 = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
                         self.parameters[_key5] = _val6
                     iprot.readMapEnd()
                 else:
@@ -244,16 +242,16 @@ class RestRequest:
                 if ftype == TType.MAP:
                     self.headers = {}
                     (_ktype8, _vtype9, _size7) = iprot.readMapBegin()
-                    for _i11 in xrange(_size7):
-                        _key12 = iprot.readString()
-                        _val13 = iprot.readString()
+                    for _i11 in range(_size7):
+                        _key12 = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
+                        _val13 = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
                         self.headers[_key12] = _val13
                     iprot.readMapEnd()
                 else:
                     iprot.skip(ftype)
             elif fid == 5:
                 if ftype == TType.STRING:
-                    self.body = iprot.readString()
+                    self.body = iprot.readBinary()
                 else:
                     iprot.skip(ftype)
             else:
@@ -262,8 +260,8 @@ class RestRequest:
         iprot.readStructEnd()
 
     def write(self, oprot):
-        if oprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and self.thrift_spec is not None and fastbinary is not None:
-            oprot.trans.write(fastbinary.encode_binary(self, (self.__class__, self.thrift_spec)))
+        if oprot._fast_encode is not None and self.thrift_spec is not None:
+            oprot.trans.write(oprot._fast_encode(self, [self.__class__, self.thrift_spec]))
             return
         oprot.writeStructBegin('RestRequest')
         if self.method is not None:
@@ -272,27 +270,27 @@ class RestRequest:
             oprot.writeFieldEnd()
         if self.uri is not None:
             oprot.writeFieldBegin('uri', TType.STRING, 2)
-            oprot.writeString(self.uri)
+            oprot.writeString(self.uri.encode('utf-8') if sys.version_info[0] == 2 else self.uri)
             oprot.writeFieldEnd()
         if self.parameters is not None:
             oprot.writeFieldBegin('parameters', TType.MAP, 3)
             oprot.writeMapBegin(TType.STRING, TType.STRING, len(self.parameters))
             for kiter14, viter15 in self.parameters.items():
-                oprot.writeString(kiter14)
-                oprot.writeString(viter15)
+                oprot.writeString(kiter14.encode('utf-8') if sys.version_info[0] == 2 else kiter14)
+                oprot.writeString(viter15.encode('utf-8') if sys.version_info[0] == 2 else viter15)
             oprot.writeMapEnd()
             oprot.writeFieldEnd()
         if self.headers is not None:
             oprot.writeFieldBegin('headers', TType.MAP, 4)
             oprot.writeMapBegin(TType.STRING, TType.STRING, len(self.headers))
             for kiter16, viter17 in self.headers.items():
-                oprot.writeString(kiter16)
-                oprot.writeString(viter17)
+                oprot.writeString(kiter16.encode('utf-8') if sys.version_info[0] == 2 else kiter16)
+                oprot.writeString(viter17.encode('utf-8') if sys.version_info[0] == 2 else viter17)
             oprot.writeMapEnd()
             oprot.writeFieldEnd()
         if self.body is not None:
             oprot.writeFieldBegin('body', TType.STRING, 5)
-            oprot.writeString(self.body)
+            oprot.writeBinary(self.body)
             oprot.writeFieldEnd()
         oprot.writeFieldStop()
         oprot.writeStructEnd()
@@ -306,7 +304,7 @@ class RestRequest:
 
     def __repr__(self):
         L = ['%s=%r' % (key, value)
-             for key, value in self.__dict__.iteritems()]
+             for key, value in self.__dict__.items()]
         return '%s(%s)' % (self.__class__.__name__, ', '.join(L))
 
     def __eq__(self, other):
@@ -316,7 +314,7 @@ class RestRequest:
         return not (self == other)
 
 
-class RestResponse:
+class RestResponse(object):
     """
     Attributes:
     - status
@@ -327,8 +325,8 @@ class RestResponse:
     thrift_spec = (
         None,  # 0
         (1, TType.I32, 'status', None, None, ),  # 1
-        (2, TType.MAP, 'headers', (TType.STRING, None, TType.STRING, None), None, ),  # 2
-        (3, TType.STRING, 'body', None, None, ),  # 3
+        (2, TType.MAP, 'headers', (TType.STRING, 'UTF8', TType.STRING, 'UTF8', False), None, ),  # 2
+        (3, TType.STRING, 'body', 'BINARY', None, ),  # 3
     )
 
     def __init__(self, status=None, headers=None, body=None,):
@@ -337,8 +335,8 @@ class RestResponse:
         self.body = body
 
     def read(self, iprot):
-        if iprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None and fastbinary is not None:
-            fastbinary.decode_binary(self, iprot.trans, (self.__class__, self.thrift_spec))
+        if iprot._fast_decode is not None and isinstance(iprot.trans, TTransport.CReadableTransport) and self.thrift_spec is not None:
+            iprot._fast_decode(self, iprot, [self.__class__, self.thrift_spec])
             return
         iprot.readStructBegin()
         while True:
@@ -354,16 +352,16 @@ class RestResponse:
                 if ftype == TType.MAP:
                     self.headers = {}
                     (_ktype19, _vtype20, _size18) = iprot.readMapBegin()
-                    for _i22 in xrange(_size18):
-                        _key23 = iprot.readString()
-                        _val24 = iprot.readString()
+                    for _i22 in range(_size18):
+                        _key23 = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
+                        _val24 = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
                         self.headers[_key23] = _val24
                     iprot.readMapEnd()
                 else:
                     iprot.skip(ftype)
             elif fid == 3:
                 if ftype == TType.STRING:
-                    self.body = iprot.readString()
+                    self.body = iprot.readBinary()
                 else:
                     iprot.skip(ftype)
             else:
@@ -372,8 +370,8 @@ class RestResponse:
         iprot.readStructEnd()
 
     def write(self, oprot):
-        if oprot.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and self.thrift_spec is not None and fastbinary is not None:
-            oprot.trans.write(fastbinary.encode_binary(self, (self.__class__, self.thrift_spec)))
+        if oprot._fast_encode is not None and self.thrift_spec is not None:
+            oprot.trans.write(oprot._fast_encode(self, [self.__class__, self.thrift_spec]))
             return
         oprot.writeStructBegin('RestResponse')
         if self.status is not None:
@@ -384,13 +382,13 @@ class RestResponse:
             oprot.writeFieldBegin('headers', TType.MAP, 2)
             oprot.writeMapBegin(TType.STRING, TType.STRING, len(self.headers))
             for kiter25, viter26 in self.headers.items():
-                oprot.writeString(kiter25)
-                oprot.writeString(viter26)
+                oprot.writeString(kiter25.encode('utf-8') if sys.version_info[0] == 2 else kiter25)
+                oprot.writeString(viter26.encode('utf-8') if sys.version_info[0] == 2 else viter26)
             oprot.writeMapEnd()
             oprot.writeFieldEnd()
         if self.body is not None:
             oprot.writeFieldBegin('body', TType.STRING, 3)
-            oprot.writeString(self.body)
+            oprot.writeBinary(self.body)
             oprot.writeFieldEnd()
         oprot.writeFieldStop()
         oprot.writeStructEnd()
@@ -402,7 +400,7 @@ class RestResponse:
 
     def __repr__(self):
         L = ['%s=%r' % (key, value)
-             for key, value in self.__dict__.iteritems()]
+             for key, value in self.__dict__.items()]
         return '%s(%s)' % (self.__class__.__name__, ', '.join(L))
 
     def __eq__(self, other):
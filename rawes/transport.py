@@ -0,0 +1,569 @@
+#
+#   Copyright 2012 The HumanGeo Group, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import collections
+import logging
+import sys
+import threading
+import time
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from .backpressure import is_rejected
+from .elastic_exception import ElasticException
+from .metrics import RequestEvent, call_hooks, connection_host
+
+if sys.version_info[0] > 2:
+    import urllib.parse as urlparse
+else:
+    import urlparse
+
+logger = logging.getLogger('rawes')
+
+# Endpoints that only read data and can safely be sent twice
+HEDGED_ENDPOINTS = ('_search', '_mget')
+
+
+class Transport(object):
+    """
+    Sends requests through a :class:`~rawes.connection_pool.ConnectionPool`,
+    failing over to the next host when one cannot be reached.
+
+    A request that fails with one of the connection's `connection_errors` or
+    `timeout_errors`, or with one of the `retry_on_status` http statuses,
+    marks its connection as dead in the pool. It is then retried on the next
+    connection, up to `max_retries` times (timeouts only when
+    `retry_on_timeout` is set). A connection that answers successfully is
+    marked as live again, resetting its fail count.
+
+    The transport can also keep the connection pool in sync with the cluster
+    by sniffing: it asks a live node for the http address of every node
+    (`_nodes/http`) and rebuilds the pool with one connection per node, on
+    start, every `sniffer_interval` seconds and/or whenever a connection
+    fails.
+
+    To cut tail latency, read requests (`get` and `head` requests, and
+    `_search` and `_mget` calls, except the ones opening or reading a
+    scroll) can be hedged: when the first host hasn't
+    answered after `hedge_after`, the same request is sent to another host
+    and whichever answers first is returned.
+
+    An :class:`~rawes.backpressure.AdaptiveLimiter` can bound the number of
+    requests in flight through the transport, backing off while the cluster
+    rejects requests with a 429.
+
+    Request hooks (see :class:`~rawes.metrics.RequestHooks`) are called for
+    every attempt, with the host it was sent to and its timings.
+    """
+    def __init__(self, connection_pool, max_retries=3,
+                 retry_on_status=(502, 503, 504), retry_on_timeout=False,
+                 sniff_on_start=False, sniffer_interval=None,
+                 sniff_on_connection_fail=False, sniff_timeout=0.1,
+                 connection_factory=None, connection_pool_kwargs={},
+                 hedge_after=None, hedge_min_samples=20, limiter=None,
+                 hooks=()):
+        """
+        :arg connection_pool: the
+            :class:`~rawes.connection_pool.ConnectionPool` to pick connections
+            from
+        :arg max_retries: maximum number of times a failed request is retried
+            on another connection
+        :arg retry_on_status: http status codes that mark a connection as dead
+            and trigger a retry
+        :arg retry_on_timeout: also retry requests that timed out. Off by
+            default as the timed out request may still be executed by
+            elasticsearch
+        :arg sniff_on_start: sniff the cluster nodes when the transport is
+            created
+        :arg sniffer_interval: number of seconds between two sniffs, checked
+            before each request. Disabled by default
+        :arg sniff_on_connection_fail: sniff the cluster nodes every time a
+            connection is marked as dead
+        :arg sniff_timeout: timeout of the `_nodes/http` sniffing request
+        :arg connection_factory: callable creating a connection object from a
+            url string, required for sniffing
+        :arg connection_pool_kwargs: arguments used to create the new
+            connection pool after sniffing, overriding the settings of the
+            previous pool
+        :arg hedge_after: enables hedged reads. Either the number of seconds
+            to wait for the first host before sending the request to a second
+            one, or a percentile of the observed read latencies such as
+            `'p95'`. Disabled by default
+        :arg hedge_min_samples: number of read latencies to observe before
+            hedging based on a percentile
+        :arg limiter: :class:`~rawes.backpressure.AdaptiveLimiter` shared by
+            the threads sending requests through the transport
+        :arg hooks: list of :class:`~rawes.metrics.RequestHooks` called on
+            send, response and error of every attempt
+        """
+        self.connection_pool = connection_pool
+        self.max_retries = max_retries
+        self.retry_on_status = retry_on_status
+        self.retry_on_timeout = retry_on_timeout
+
+        self.sniffer_interval = sniffer_interval
+        self.sniff_on_connection_fail = sniff_on_connection_fail
+        self.sniff_timeout = sniff_timeout
+        self.connection_factory = connection_factory
+        self.connection_pool_kwargs = connection_pool_kwargs
+        self.last_sniff = time.time()
+        self.sniff_lock = threading.Lock()
+
+        self.limiter = limiter
+        self.hooks = list(hooks)
+
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_delay = None
+        self.hedge_percentile = None
+        if isinstance(hedge_after, (int, float)):
+            self.hedge_delay = hedge_after
+        elif hedge_after is not None:
+            if not hedge_after.startswith('p'):
+                raise ValueError('hedge_after must be a number of seconds or '
+                                 'a percentile such as "p95"')
+            self.hedge_percentile = float(hedge_after[1:]) / 100
+            self.read_latencies = collections.deque(maxlen=1000)
+            self.read_count = 0
+
+        if sniff_on_start or sniffer_interval is not None or \
+                sniff_on_connection_fail:
+            _check_sniffable(connection_pool)
+        if sniff_on_start:
+            self.sniff_hosts()
+
+    def perform_request(self, method, path, **kwargs):
+        """
+        Send the request on a connection from the pool and return the decoded
+        response, retrying on other connections on failure.
+        """
+        if self.sniffer_interval is not None and \
+                time.time() >= self.last_sniff + self.sniffer_interval:
+            self.sniff_hosts()
+
+        if self.limiter is not None:
+            return self._perform_limited_request(method, path, kwargs)
+        return self._perform_unlimited_request(method, path, kwargs)
+
+    def _perform_limited_request(self, method, path, kwargs):
+        token = self.limiter.acquire()
+        try:
+            result = self._perform_unlimited_request(method, path, kwargs)
+        except ElasticException as e:
+            self.limiter.release(token, is_rejected(e.status_code, e.result))
+            raise
+        except BaseException:
+            self.limiter.release(token, False)
+            raise
+        return _when_done(result,
+                          lambda error: self.limiter.release(token, False))
+
+    def _perform_unlimited_request(self, method, path, kwargs):
+        if self.hedge_after is None or not self._is_read(method, path,
+                                                          kwargs):
+            return self._perform_request(method, path, kwargs)
+
+        start = time.time()
+        result = self._perform_hedged_request(method, path, kwargs)
+        if self.hedge_percentile is not None:
+            self._observe_read_latency(time.time() - start)
+        return result
+
+    def _perform_request(self, method, path, kwargs):
+        for attempt in range(self.max_retries + 1):
+            connection_pool = self.connection_pool
+            connection = connection_pool.get_connection()
+            event, request_kwargs = self._start_event(connection, method,
+                                                      path, kwargs, attempt)
+            start = time.time()
+            try:
+                result = self._send(connection_pool, connection, method, path,
+                                    request_kwargs)
+            except Exception as e:
+                self._end_event(event, request_kwargs, time.time() - start,
+                                e)
+                if not self._retry(connection, e, attempt):
+                    raise
+            else:
+                connection_pool.mark_live(connection)
+                return _when_done(result, lambda error: self._end_event(
+                    event, request_kwargs, time.time() - start, error))
+
+    def _send(self, connection_pool, connection, method, path, kwargs):
+        """
+        Send a request on a connection, reporting its outcome to the pool
+        even when the request is interrupted, so the selector's count of
+        requests in flight stays right. The outcome of a streamed response
+        is reported once it has been read.
+        """
+        return self._send_with(
+            connection_pool, connection,
+            lambda connection: connection.request(method, path, **kwargs))
+
+    def _send_with(self, connection_pool, connection, send):
+        """Call `send` with the connection, reporting the outcome to the
+        pool as :meth:`_send` does"""
+        start = time.time()
+
+        def observe(error):
+            failed = error is not None and self._host_failed(error)
+            connection_pool.observe(connection, time.time() - start,
+                                    failed=failed)
+
+        try:
+            result = send(connection)
+        except Exception as e:
+            observe(e)
+            raise
+        except BaseException:
+            # interrupted, which is not the host's fault
+            observe(None)
+            raise
+        return _when_done(result, observe)
+
+    def _perform_hedged_request(self, method, path, kwargs):
+        """
+        Send the request from a background thread and, if it hasn't completed
+        after the hedging delay, send it again from a second thread. The
+        first successful response wins; the other one is ignored.
+        """
+        delay = self.hedge_delay
+        if delay is None or len(self.connection_pool.connections) < 2:
+            return self._perform_request(method, path, kwargs)
+
+        results = Queue()
+
+        def send():
+            try:
+                results.put((True, self._perform_request(method, path,
+                                                         kwargs)))
+            except Exception:
+                results.put((False, sys.exc_info()[1]))
+
+        def start():
+            thread = threading.Thread(target=send)
+            thread.daemon = True
+            thread.start()
+
+        start()
+        try:
+            ok, value = results.get(timeout=delay)
+        except Empty:
+            logger.debug('No answer after %.3fs, hedging %s %s', delay,
+                         method, path)
+            start()
+            ok, value = results.get()
+            if not ok:
+                # the hedged request may still succeed
+                ok, value = results.get()
+        if not ok:
+            raise value
+        return value
+
+    def pipeline(self, window=100):
+        """
+        Returns a :class:`~rawes.thrift_connection.ThriftPipeline` sent on a
+        connection picked from the pool every time it is executed. Like the
+        other requests, pipelines are observed by the pool's selector and
+        circuit breakers, mark their connection as dead when its host fails
+        and are reported to the request hooks, with one event per request.
+        They are not retried on another connection.
+
+        :arg window: maximum number of requests sent ahead of the responses
+            read
+        """
+        connections = [c for c, opts in self.connection_pool.connection_opts]
+        if not all(hasattr(c, 'pipeline') for c in connections):
+            raise ValueError('Pipelines are only available for thrift '
+                             'connections')
+        return connections[0].pipeline(window, transport=self)
+
+    def _send_pipeline(self, send, requests):
+        """
+        Call `send` with a connection from the pool and return the list of
+        responses it returns, reporting the outcome like a single request.
+
+        :arg requests: `(method, path)` of the pipelined requests
+        """
+        connection_pool = self.connection_pool
+        connection = connection_pool.get_connection()
+        started = [self._start_event(connection, method, path, {}, 0)
+                   for method, path in requests]
+        start = time.time()
+        try:
+            responses = self._send_with(connection_pool, connection, send)
+        except Exception as e:
+            duration = time.time() - start
+            for event, request_kwargs in started:
+                self._end_event(event, request_kwargs, duration, e)
+            # marks the connection as dead when the host failed, without
+            # retrying the requests
+            self._retry(connection, e, self.max_retries)
+            raise
+        connection_pool.mark_live(connection)
+        duration = time.time() - start
+        for (event, request_kwargs), response in zip(started, responses):
+            if event is not None:
+                event.status = getattr(response, 'status', None)
+            self._end_event(event, request_kwargs, duration,
+                            response if isinstance(response, Exception)
+                            else None)
+        return responses
+
+    def _is_read(self, method, path, kwargs):
+        # opening or advancing a scroll changes state on the server: a copy
+        # would leak a scroll context or skip a page. The losing copy of a
+        # streamed response would hold its socket until it is read
+        if kwargs.get('stream'):
+            return False
+        if '_search/scroll' in path or 'scroll=' in path or \
+                'scroll' in (kwargs.get('params') or {}):
+            return False
+        if method in ('get', 'head'):
+            return True
+        return path.rsplit('/', 1)[-1] in HEDGED_ENDPOINTS
+
+    def _observe_read_latency(self, duration):
+        """Record a read latency and update the percentile hedging delay"""
+        latencies = self.read_latencies
+        latencies.append(duration)
+        self.read_count += 1
+        # the percentile is recomputed on every sample at first, then only
+        # every 100 samples to keep the sorting cost off most requests
+        if self.read_count >= self.hedge_min_samples and \
+                (self.read_count < 100 or self.read_count % 100 == 0):
+            ordered = sorted(latencies)
+            self.hedge_delay = ordered[int(self.hedge_percentile *
+                                           (len(ordered) - 1))]
+
+    def _start_event(self, connection, method, path, kwargs, attempt):
+        """
+        Call the send hooks. Returns the event of the attempt, None without
+        hooks, and the arguments of the connection's request, which stores
+        its measures in their `info` dictionary.
+        """
+        if not self.hooks:
+            return None, kwargs
+        request_kwargs = dict(kwargs, info={})
+        event = RequestEvent(method, path, connection_host(connection),
+                             attempt, request_kwargs.pop('encode_time', None))
+        call_hooks(self.hooks, 'on_send', event)
+        return event, request_kwargs
+
+    def _end_event(self, event, request_kwargs, duration, error=None):
+        """Call the response or error hooks"""
+        if event is None:
+            return
+        event.update(request_kwargs['info'])
+        event.duration = duration
+        if error is None:
+            call_hooks(self.hooks, 'on_response', event)
+        else:
+            event.error = error
+            if event.status is None:
+                event.status = getattr(error, 'status_code', None)
+            call_hooks(self.hooks, 'on_error', event)
+
+    def _host_failed(self, error):
+        """
+        Whether an error is the host's fault, as opposed to an error response
+        to an invalid request.
+        """
+        if isinstance(error, ElasticException):
+            return error.status_code >= 500
+        return True
+
+    def _retry(self, connection, error, attempt):
+        """
+        Decide whether a failed request should be retried, marking its
+        connection as dead if the failure is the host's fault.
+        """
+        # timeouts are checked first, as they may also be connection errors
+        if isinstance(error, ElasticException):
+            retry = error.status_code in self.retry_on_status
+        elif isinstance(error, getattr(connection, 'timeout_errors', ())):
+            # a slow host is put on a timeout even if the request is not
+            # retried
+            self.connection_pool.mark_dead(connection)
+            return self.retry_on_timeout and attempt < self.max_retries
+        elif isinstance(error, getattr(connection, 'connection_errors', ())):
+            retry = True
+        else:
+            retry = False
+
+        if not retry:
+            return False
+        if self.sniff_on_connection_fail:
+            self.sniff_hosts()
+        self.connection_pool.mark_dead(connection)
+        if attempt >= self.max_retries:
+            return False
+        logger.warning('Request to %r failed (%s), retrying (%d/%d)',
+                       connection, error, attempt + 1, self.max_retries)
+        return True
+
+    def sniff_hosts(self):
+        """
+        Replace the connection pool with one holding a connection for every
+        node of the cluster that has http enabled.
+
+        Connections to nodes that were already known are kept along with their
+        options, and the new pool gets the settings of the previous one. If
+        another thread is already sniffing, or no node can be reached, the
+        current pool is left untouched.
+
+        Only pools of http connections can be sniffed, as the nodes only
+        publish their http address.
+        """
+        if self.connection_factory is None:
+            raise ValueError('Sniffing requires a connection_factory')
+        _check_sniffable(self.connection_pool)
+        if not self.sniff_lock.acquire(False):
+            return
+        try:
+            self.last_sniff = time.time()
+            nodes = self._get_sniffed_nodes()
+            if not nodes:
+                logger.warning('Sniffing found no nodes, keeping %r',
+                               self.connection_pool.connections)
+                return
+
+            known = dict((c.url, (c, opts))
+                         for c, opts in self.connection_pool.connection_opts)
+            scheme = urlparse.urlsplit(list(known)[0]).scheme
+            connections = []
+            for address, attributes in nodes:
+                url = '{0}://{1}'.format(scheme, address)
+                if url in known:
+                    connections.append(known[url])
+                else:
+                    connections.append((self.connection_factory(url),
+                                        attributes))
+            previous_pool = self.connection_pool
+            self.connection_pool = previous_pool.with_connections(
+                connections, **self.connection_pool_kwargs)
+            previous_pool.close()
+            logger.info('Sniffed %d node(s)', len(connections))
+        finally:
+            self.sniff_lock.release()
+
+    def _get_sniffed_nodes(self):
+        """
+        Ask the known connections, live ones first, for the cluster's nodes
+        until one answers. Returns a list of (address, attributes) tuples.
+        """
+        pool = self.connection_pool
+        dead = [c for c, opts in pool.connection_opts
+                if c not in pool.connections]
+        for connection in list(pool.connections) + dead:
+            try:
+                response = connection.request('get', '_nodes/http',
+                                               timeout=self.sniff_timeout)
+            except Exception as e:
+                logger.warning('Sniffing %r failed (%s)', connection, e)
+                continue
+
+            nodes = []
+            for node in response.get('nodes', {}).values():
+                address = _publish_address(node)
+                if address is not None:
+                    nodes.append((address, node.get('attributes', {})))
+            return nodes
+        return []
+
+
+def _publish_address(node):
+    """
+    Extract the host:port of a node's http publish address, which looks like
+    `10.0.0.1:9200`, `hostname/10.0.0.1:9200` or `inet[/10.0.0.1:9200]`
+    depending on the elasticsearch version.
+    """
+    address = node.get('http', {}).get('publish_address') or \
+        node.get('http_address')
+    if not address:
+        return None
+    if address.startswith('inet[') and address.endswith(']'):
+        address = address[len('inet['):-1]
+    return address.rsplit('/', 1)[-1]
+
+
+class StreamedResponse(object):
+    """
+    Iterator over the items of a streamed response (see the `stream` option
+    of :class:`~rawes.http_connection.HttpConnection`), reporting the end of
+    the request to the transport once every item has been read or the
+    iterator is closed. Read it to the end or close it, otherwise the
+    request stays in flight for the connection pool and the limiter.
+    """
+    def __init__(self, items, callback):
+        self.items = items
+        self.callback = callback
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.items)
+        except StopIteration:
+            self._finish(None)
+            raise
+        except Exception as e:
+            self._finish(e)
+            raise
+        except BaseException:
+            self._finish(None)
+            raise
+
+    next = __next__
+
+    def close(self):
+        """Stop reading the response, releasing its socket"""
+        try:
+            if hasattr(self.items, 'close'):
+                self.items.close()
+        finally:
+            self._finish(None)
+
+    def _finish(self, error):
+        callback, self.callback = self.callback, None
+        if callback is not None:
+            callback(error)
+
+
+def _check_sniffable(connection_pool):
+    """Raise a ValueError unless every connection of the pool has an http
+    url, the scheme of the sniffed nodes' connections"""
+    for connection, opts in connection_pool.connection_opts:
+        if not getattr(connection, 'url', None):
+            raise ValueError('Sniffing is only available for http '
+                             'connections, not {0!r}'.format(connection))
+
+
+def _when_done(result, callback):
+    """
+    Call `callback` with None, or the error reading a streamed response
+    failed with, once a request has completed. That is right away, unless
+    the result is a streamed response, which is then returned wrapped in a
+    :class:`StreamedResponse` calling `callback` once it has been read.
+    """
+    if hasattr(result, '__next__') or hasattr(result, 'next'):
+        return StreamedResponse(result, callback)
+    callback(None)
+    return result
@@ -14,6 +14,14 @@
 #   limitations under the License.
 #
 
+import sys
+import threading
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
 # python2.x and 3.x compatible way of checking if an object is a string
 try:
     basestring  # attempt to evaluate basestring
@@ -22,3 +30,85 @@ try:
 except NameError:
     def isstr(s):
         return isinstance(s, str)
+
+
+def parallel_imap(func, iterable, thread_count, max_in_flight, ordered=True):
+    """
+    Apply ``func`` to every item of ``iterable`` on a pool of ``thread_count``
+    threads, yielding the results as a generator.
+
+    At most ``max_in_flight`` items are pulled from ``iterable`` and not yet
+    yielded at any time, so memory stays bounded however long the iterable
+    is. With ``ordered`` results come back in input order, otherwise as soon
+    as they are ready. An exception raised by ``func`` or by the iterable is
+    re-raised in the consuming thread.
+    """
+    slots = threading.Semaphore(max_in_flight)
+    tasks = Queue()
+    results = Queue()
+    stopped = threading.Event()
+
+    def feed():
+        count = 0
+        try:
+            for item in iterable:
+                slots.acquire()
+                if stopped.is_set():
+                    break
+                tasks.put((count, item))
+                count += 1
+        except Exception:
+            results.put((None, False, sys.exc_info()[1]))
+        finally:
+            for _ in range(thread_count):
+                tasks.put(None)
+            results.put((None, True, count))
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            index, item = task
+            if stopped.is_set():
+                continue
+            try:
+                results.put((index, True, func(item)))
+            except Exception:
+                results.put((index, False, sys.exc_info()[1]))
+
+    threads = [threading.Thread(target=feed)]
+    threads.extend(threading.Thread(target=work) for _ in range(thread_count))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    total = None
+    done = 0
+    pending = {}
+    try:
+        while total is None or done < total:
+            index, ok, value = results.get()
+            if index is None:
+                if not ok:
+                    raise value
+                total = value
+                continue
+            if not ok:
+                raise value
+            if not ordered:
+                done += 1
+                slots.release()
+                yield value
+                continue
+            pending[index] = value
+            while done in pending:
+                value = pending.pop(done)
+                done += 1
+                slots.release()
+                yield value
+    finally:
+        stopped.set()
+        # wake up the feeder if it is waiting for a free slot
+        for _ in range(max_in_flight):
+            slots.release()
@@ -29,7 +29,8 @@ install_requires = [
 ]
 
 extras_requires = {
-    'thrift': ['thrift==0.8.0'],
+    'thrift': ['thrift>=0.10.0'],
+    'async': ['aiohttp>=3.0'],
     'mock': ['mock==1.0.1']
 }
 
@@ -14,6 +14,22 @@
 #   limitations under the License.
 #
 
+import sys
+
 from tests.core_tests import *
 from tests.connection_pool_tests import *
-from tests.integration.connection_pool_integration_tests import *
\ No newline at end of file
+from tests.bulk_tests import *
+from tests.scroll_tests import *
+from tests.transport_tests import *
+from tests.backpressure_tests import *
+from tests.http_connection_tests import *
+from tests.streaming_tests import *
+from tests.serializer_tests import *
+from tests.encoders_tests import *
+from tests.thrift_connection_tests import *
+from tests.metrics_tests import *
+from tests.integration.connection_pool_integration_tests import *
+
+if sys.version_info >= (3, 7):
+    from tests.async_elastic_tests import *
+    from tests.async_http_connection_tests import *
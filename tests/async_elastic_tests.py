@@ -0,0 +1,86 @@
+import asyncio
+import json
+import unittest
+
+from rawes.async_elastic import AsyncElastic
+from rawes.connection_pool import ConnectionPool, LeastOutstandingSelector
+
+
+class FakeAsyncConnection(object):
+    def __init__(self):
+        self.calls = []
+        self.closed = False
+
+    async def request(self, method, path, **kwargs):
+        await asyncio.sleep(0)
+        self.calls.append((method, path, kwargs))
+        return {'ok': True}
+
+    async def close(self):
+        self.closed = True
+
+
+class HangingAsyncConnection(FakeAsyncConnection):
+    async def request(self, method, path, **kwargs):
+        await asyncio.sleep(10)
+
+
+class TestAsyncElastic(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeAsyncConnection()
+        self.es = AsyncElastic(connection_pool=ConnectionPool(
+            [(self.connection, {})]))
+
+    def test_path_chaining_returns_async_clients(self):
+        tweets = self.es.tweets['tweet']
+        self.assertIsInstance(tweets, AsyncElastic)
+        self.assertEqual('tweets/tweet', tweets.path)
+        self.assertIs(self.es.connection_pool, tweets.connection_pool)
+
+    def test_requests_are_awaitable(self):
+        async def run():
+            return await self.es.tweets.tweet.put('1', data={'user': 'dan'})
+
+        self.assertEqual({'ok': True}, asyncio.run(run()))
+        method, path, kwargs = self.connection.calls[0]
+        self.assertEqual(('put', 'tweets/tweet/1'), (method, path))
+        self.assertEqual({'user': 'dan'}, json.loads(kwargs['data']))
+
+    def test_requests_run_concurrently(self):
+        async def run():
+            return await asyncio.gather(
+                *[self.es.get('tweets/%d' % i) for i in range(10)])
+
+        self.assertEqual(10, len(asyncio.run(run())))
+
+    def test_scroll_helpers_are_not_inherited(self):
+        self.assertFalse(hasattr(AsyncElastic, 'scan'))
+        self.assertFalse(hasattr(AsyncElastic, 'sliced_scan'))
+        self.assertEqual('scan', self.es.scan.path)
+
+    def test_close_closes_connections(self):
+        asyncio.run(self.es.close())
+        self.assertTrue(self.connection.closed)
+
+    def test_thrift_urls_are_rejected(self):
+        self.assertRaises(ValueError, AsyncElastic, 'thrift://localhost')
+
+    def test_health_checks_are_rejected(self):
+        pool = ConnectionPool([(FakeAsyncConnection(), {})],
+                              health_check_interval=60)
+        self.assertRaises(ValueError, AsyncElastic, connection_pool=pool)
+        pool.close()
+
+    def test_cancelled_requests_are_not_left_outstanding(self):
+        connection = HangingAsyncConnection()
+        pool = ConnectionPool([(connection, {})],
+                              selector_class=LeastOutstandingSelector)
+        es = AsyncElastic(connection_pool=pool)
+
+        async def run():
+            for _ in range(3):
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(es.get(''), 0.01)
+
+        asyncio.run(run())
+        self.assertEqual(0, pool.selector.outstanding.get(connection, 0))
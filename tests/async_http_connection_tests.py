@@ -0,0 +1,146 @@
+import asyncio
+import base64
+import json
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from rawes.elastic_exception import ElasticException
+
+if aiohttp is not None:
+    from rawes.async_elastic import AsyncElastic
+    from rawes.async_http_connection import AsyncHttpConnection
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        status, body = 200, b'{"ok": true}'
+        if self.path.startswith('/missing'):
+            status, body = 404, b'{"error": "missing"}'
+        elif self.path.startswith('/slow'):
+            time.sleep(0.5)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class TestAsyncHttpConnection(unittest.TestCase):
+    """Runs an http server on a random local port"""
+    def setUp(self):
+        self.server = ThreadingServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _request(self, connection, method, path, **kwargs):
+        async def run():
+            try:
+                return await connection.request(method, path, **kwargs)
+            finally:
+                await connection.close()
+        return asyncio.run(run())
+
+    def test_request(self):
+        connection = AsyncHttpConnection(self.url, timeout=5)
+        self.assertTrue(connection.session is None)
+        self.assertEqual({'ok': True}, self._request(connection, 'get', ''))
+        self.assertTrue(connection.session is None)
+
+    def test_params_are_stringified(self):
+        connection = AsyncHttpConnection(self.url)
+        self._request(connection, 'get', '_search',
+                      params={'refresh': True, 'size': 10})
+        path = self.server.requests[0][0]
+        self.assertTrue(path.startswith('/_search?'))
+        self.assertEqual(set(['refresh=true', 'size=10']),
+                         set(path.split('?')[1].split('&')))
+
+    def test_auth_tuple(self):
+        connection = AsyncHttpConnection(self.url, auth=('user', 'secret'))
+        self._request(connection, 'get', '')
+        self.assertEqual(
+            'Basic ' + base64.b64encode(b'user:secret').decode('ascii'),
+            self.server.requests[0][1]['Authorization'])
+
+    def test_error_status_raises_elastic_exception(self):
+        connection = AsyncHttpConnection(self.url)
+        with self.assertRaises(ElasticException) as context:
+            self._request(connection, 'get', 'missing')
+        self.assertEqual(404, context.exception.status_code)
+        self.assertEqual({'error': 'missing'}, context.exception.result)
+
+    def test_timeout(self):
+        connection = AsyncHttpConnection(self.url, timeout=0.1)
+        self.assertRaises(connection.timeout_errors, self._request,
+                          connection, 'get', 'slow')
+
+    def test_unreachable_host_raises_connection_error(self):
+        connection = AsyncHttpConnection(
+            'http://127.0.0.1:{0}'.format(unused_port()), timeout=5)
+        self.assertRaises(connection.connection_errors, self._request,
+                          connection, 'get', '')
+
+    def test_unreachable_host_fails_over(self):
+        dead = 'http://127.0.0.1:{0}'.format(unused_port())
+        es = AsyncElastic([dead, self.url])
+
+        async def run():
+            try:
+                return [await es.get('') for _ in range(4)]
+            finally:
+                await es.close()
+
+        self.assertEqual([{'ok': True}] * 4, asyncio.run(run()))
+        self.assertEqual(1, len(es.connection_pool.connections))
+
+    def test_requests_only_options_are_rejected(self):
+        for name, value in (('pool_maxsize', 2), ('pool_block', True),
+                            ('compress_threshold', 100), ('stream', True)):
+            self.assertRaises(ValueError, AsyncHttpConnection, self.url,
+                              **{name: value})
+        connection = AsyncHttpConnection(self.url)
+        self.assertRaises(ValueError, self._request, connection, 'get',
+                          '_search', stream=True)
+
+    def test_verify_is_translated_to_ssl(self):
+        connection = AsyncHttpConnection(self.url, verify=False)
+        self.assertEqual({'ssl': False}, connection.kwargs)
+        connection = AsyncHttpConnection(self.url, verify=True)
+        self.assertEqual({}, connection.kwargs)
+        self.assertEqual({'ok': True}, self._request(connection, 'get', ''))
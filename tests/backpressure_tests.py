@@ -0,0 +1,172 @@
+import json
+import threading
+import unittest
+
+from rawes.backpressure import AdaptiveLimiter, backoff, is_rejected
+from rawes.bulk import BulkIndexer
+from rawes.connection_pool import ConnectionPool
+from rawes.elastic import Elastic
+from rawes.elastic_exception import ElasticException
+from rawes.serializer import JsonSerializer
+
+REJECTION = {'type': 'es_rejected_execution_exception',
+             'reason': 'rejected execution of bulk'}
+
+
+class RecordingSerializer(JsonSerializer):
+    """Records the data it decodes"""
+    def __init__(self):
+        super(RecordingSerializer, self).__init__()
+        self.loaded = []
+
+    def loads(self, data):
+        self.loaded.append(data)
+        return super(RecordingSerializer, self).loads(data)
+
+
+class RejectingBulkConnection(object):
+    """Rejects the given ids the first `rejections` times they are sent"""
+    def __init__(self, rejected_ids=(), rejections=1, request_rejections=0):
+        self.calls = []
+        self.remaining = dict((i, rejections) for i in rejected_ids)
+        self.request_rejections = request_rejections
+
+    def request(self, method, path, **kwargs):
+        lines = kwargs['data'].decode('utf-8').splitlines()
+        self.calls.append(lines)
+        if self.request_rejections:
+            self.request_rejections -= 1
+            raise ElasticException('rejected', REJECTION, 429)
+
+        items = []
+        for line in lines:
+            header = json.loads(line)
+            if len(header) != 1 or list(header.keys())[0] not in (
+                    'index', 'delete'):
+                continue
+            op_type = list(header.keys())[0]
+            doc_id = header[op_type]['_id']
+            if self.remaining.get(doc_id):
+                self.remaining[doc_id] -= 1
+                items.append({op_type: {'_id': doc_id, 'status': 429,
+                                        'error': REJECTION}})
+            else:
+                items.append({op_type: {'_id': doc_id, 'status': 201}})
+        return {'took': 1, 'items': items}
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_rejection_halves_the_limit(self):
+        limiter = AdaptiveLimiter(initial_limit=8)
+        limiter.release(limiter.acquire(), rejected=True)
+        self.assertEqual(4, limiter.limit)
+
+    def test_burst_of_rejections_decreases_once(self):
+        limiter = AdaptiveLimiter(initial_limit=8)
+        tokens = [limiter.acquire() for _ in range(4)]
+        for token in tokens:
+            limiter.release(token, rejected=True)
+        self.assertEqual(4, limiter.limit)
+
+    def test_limit_grows_back_additively(self):
+        limiter = AdaptiveLimiter(initial_limit=4, max_limit=5)
+        # about one more request per window of 4 successes
+        for _ in range(5):
+            limiter.release(limiter.acquire())
+        self.assertEqual(5, int(limiter.limit))
+        for _ in range(100):
+            limiter.release(limiter.acquire())
+        self.assertEqual(5, limiter.limit)
+
+    def test_limit_bounds_requests_in_flight(self):
+        limiter = AdaptiveLimiter(initial_limit=1)
+        token = limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release(token)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+    def test_backoff_is_bounded(self):
+        for attempt in range(10):
+            self.assertTrue(0 <= backoff(attempt, 1, 8) <= 8)
+
+    def test_is_rejected(self):
+        self.assertTrue(is_rejected(429))
+        self.assertTrue(is_rejected(500, REJECTION))
+        self.assertFalse(is_rejected(400, 'MapperParsingException'))
+
+
+class TestBulkRetries(unittest.TestCase):
+    def _es(self, connection, serializer=None):
+        return Elastic(connection_pool=ConnectionPool([(connection, {})]),
+                       serializer=serializer)
+
+    def test_only_rejected_items_are_retried(self):
+        connection = RejectingBulkConnection(rejected_ids=('1', '3'))
+        indexer = BulkIndexer(self._es(connection), max_retries=2,
+                              initial_backoff=0)
+        actions = [{'_id': str(i)} for i in range(4)]
+        actions.append({'_op_type': 'delete', '_id': '5'})
+        results = list(indexer.stream(actions))
+
+        self.assertEqual([True] * 5, [ok for ok, _ in results])
+        self.assertEqual(['0', '1', '2', '3', '5'],
+                         [list(item.values())[0]['_id'] for _, item in results])
+        self.assertEqual(2, len(connection.calls))
+        self.assertEqual([{'index': {'_id': '1'}}, {}, {'index': {'_id': '3'}},
+                          {}], [json.loads(l) for l in connection.calls[1]])
+
+    def test_retried_actions_are_split_with_the_client_serializer(self):
+        connection = RejectingBulkConnection(rejected_ids=('1',))
+        serializer = RecordingSerializer()
+        indexer = BulkIndexer(self._es(connection, serializer), max_retries=1,
+                              initial_backoff=0)
+        actions = [{'_id': '0'}, {'_op_type': 'delete', '_id': '1'}]
+        self.assertEqual([True, True],
+                         [ok for ok, _ in indexer.stream(actions)])
+        self.assertEqual([b'{"index": {"_id": "0"}}',
+                          b'{"delete": {"_id": "1"}}'], serializer.loaded)
+
+    def test_items_still_rejected_after_retries_are_failures(self):
+        connection = RejectingBulkConnection(rejected_ids=('1',),
+                                             rejections=5)
+        indexer = BulkIndexer(self._es(connection), max_retries=2,
+                              initial_backoff=0)
+        results = list(indexer.stream([{'_id': str(i)} for i in range(3)]))
+        self.assertEqual([True, False, True], [ok for ok, _ in results])
+        self.assertEqual(3, len(connection.calls))
+
+    def test_rejected_request_is_retried(self):
+        connection = RejectingBulkConnection(request_rejections=2)
+        limiter = AdaptiveLimiter(initial_limit=4)
+        indexer = BulkIndexer(self._es(connection), max_retries=2,
+                              initial_backoff=0, limiter=limiter)
+        results = list(indexer.stream([{'_id': '1'}]))
+        self.assertEqual([True], [ok for ok, _ in results])
+        self.assertEqual(3, len(connection.calls))
+        self.assertTrue(limiter.limit < 4)
+
+    def test_rejections_are_raised_without_retries(self):
+        connection = RejectingBulkConnection(request_rejections=1)
+        indexer = BulkIndexer(self._es(connection))
+        self.assertRaises(ElasticException, list,
+                          indexer.stream([{'_id': '1'}]))
+
+    def test_transport_limiter_backs_off_on_429(self):
+        connection = RejectingBulkConnection(request_rejections=1)
+        limiter = AdaptiveLimiter(initial_limit=4)
+        es = Elastic(connection_pool=ConnectionPool([(connection, {})]),
+                     transport_kwargs={'limiter': limiter})
+        self.assertRaises(ElasticException, es.post, '_bulk',
+                          data=b'{"index": {"_id": "1"}}\n{}\n')
+        self.assertEqual(2, limiter.limit)
+        es.post('_bulk', data=b'{"index": {"_id": "1"}}\n{}\n')
+        self.assertEqual(0, limiter.in_flight)
@@ -0,0 +1,117 @@
+import json
+import unittest
+
+from rawes.bulk import BulkIndexer
+from rawes.connection_pool import ConnectionPool
+from rawes.elastic import Elastic
+from rawes.elastic_exception import ElasticException
+
+
+class FakeBulkConnection(object):
+    """Records bulk bodies and acknowledges every item"""
+    def __init__(self, fail_ids=()):
+        self.calls = []
+        self.fail_ids = fail_ids
+
+    def request(self, method, path, **kwargs):
+        lines = kwargs['data'].decode('utf-8').splitlines()
+        self.calls.append((method, path, lines))
+        items = []
+        for line in lines:
+            header = json.loads(line)
+            op_type = list(header.keys())[0] if len(header) == 1 else None
+            if op_type not in ('index', 'create', 'update', 'delete'):
+                continue
+            doc_id = header[op_type].get('_id')
+            if doc_id in self.fail_ids:
+                items.append({op_type: {'_id': doc_id, 'status': 400,
+                                        'error': 'MapperParsingException'}})
+            else:
+                items.append({op_type: {'_id': doc_id, 'status': 201}})
+        return {'took': 1, 'items': items}
+
+
+class TestBulkIndexer(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeBulkConnection(fail_ids=('3',))
+        self.es = Elastic(connection_pool=ConnectionPool(
+            [(self.connection, {})]))
+
+    def test_actions_are_chunked_by_count(self):
+        indexer = BulkIndexer(self.es.tweets.tweet, chunk_size=2)
+        actions = ({'_id': str(i), 'value': i} for i in range(5))
+        results = list(indexer.stream(actions))
+
+        self.assertEqual(5, len(results))
+        self.assertEqual([4, 4, 2],
+                         [len(lines) for _, _, lines in self.connection.calls])
+        self.assertEqual('tweets/tweet/_bulk', self.connection.calls[0][1])
+        self.assertEqual([True, True, True, False, True],
+                         [ok for ok, _ in results])
+
+    def test_actions_are_chunked_by_size(self):
+        indexer = BulkIndexer(self.es, max_chunk_bytes=60)
+        actions = [{'_id': str(i), 'value': 'x' * 10} for i in range(3)]
+        list(indexer.stream(actions))
+        self.assertEqual(3, len(self.connection.calls))
+
+    def test_action_lines(self):
+        indexer = BulkIndexer(self.es)
+        list(indexer.stream([
+            {'_op_type': 'delete', '_index': 'i', '_id': '1'},
+            {'_op_type': 'update', '_id': '2', '_source': {'doc': {'a': 1}}},
+            ({'create': {'_id': '4'}}, {'b': 2}),
+        ]))
+        lines = [json.loads(l) for l in self.connection.calls[0][2]]
+        self.assertEqual([
+            {'delete': {'_index': 'i', '_id': '1'}},
+            {'update': {'_id': '2'}},
+            {'doc': {'a': 1}},
+            {'create': {'_id': '4'}},
+            {'b': 2},
+        ], lines)
+
+    def test_serialized_lines_are_passed_verbatim(self):
+        indexer = BulkIndexer(self.es)
+        results = list(indexer.stream([
+            ('{"index": {"_id": "1"}}', '{"a": 1}'),
+            (b'{"delete": {"_id": "2"}}', None),
+        ]))
+        self.assertEqual([
+            '{"index": {"_id": "1"}}',
+            '{"a": 1}',
+            '{"delete": {"_id": "2"}}',
+        ], self.connection.calls[0][2])
+        self.assertEqual([True, True], [ok for ok, _ in results])
+
+    def test_raise_on_error(self):
+        indexer = BulkIndexer(self.es, raise_on_error=True)
+        actions = [{'_id': str(i)} for i in range(5)]
+        with self.assertRaises(ElasticException) as context:
+            list(indexer.stream(actions))
+        self.assertEqual(400, context.exception.status_code)
+        self.assertEqual(1, len(context.exception.result))
+
+    def test_parallel_keeps_action_order(self):
+        indexer = BulkIndexer(self.es, chunk_size=3)
+        actions = ({'_id': str(i)} for i in range(100))
+        results = list(indexer.parallel(actions, thread_count=4))
+
+        self.assertEqual([str(i) for i in range(100)],
+                         [item['index']['_id'] for _, item in results])
+        self.assertEqual(34, len(self.connection.calls))
+
+    def test_parallel_unordered_returns_every_result(self):
+        indexer = BulkIndexer(self.es, chunk_size=3)
+        actions = ({'_id': str(i)} for i in range(100))
+        results = list(indexer.parallel(actions, thread_count=4,
+                                        ordered=False))
+
+        self.assertEqual(set(str(i) for i in range(100)),
+                         set(item['index']['_id'] for _, item in results))
+
+    def test_parallel_propagates_errors(self):
+        indexer = BulkIndexer(self.es, chunk_size=1, raise_on_error=True)
+        actions = ({'_id': str(i)} for i in range(100))
+        self.assertRaises(ElasticException, list,
+                          indexer.parallel(actions, thread_count=4))
@@ -1,6 +1,10 @@
+import math
+import threading
 import time
 
-from rawes.connection_pool import ConnectionPool, RoundRobinSelector
+from rawes.connection_pool import ConnectionPool, RoundRobinSelector, \
+    EwmaSelector, LeastOutstandingSelector, ZoneAwareSelector, HealthChecker, \
+    CircuitBreaker, ConnectionPoolEmpty
 
 from unittest import TestCase
 
@@ -100,3 +104,274 @@ class TestConnectionPool(TestCase):
         self.assertEquals(3, pool.dead_count[42])
         pool.mark_live(42)
         self.assertNotIn(42, pool.dead_count)
+
+    def test_round_robin_is_even_across_threads(self):
+        pool = ConnectionPool([(x, {}) for x in range(10)])
+        selected = []
+
+        def select():
+            selected.extend(pool.get_connection() for _ in range(1000))
+
+        threads = [threading.Thread(target=select) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(8000, len(selected))
+        self.assertEqual([800] * 10, [selected.count(x) for x in range(10)])
+
+    def test_concurrent_failures_and_resurrections(self):
+        pool = ConnectionPool([(x, {}) for x in range(4)], dead_timeout=0)
+        errors = []
+
+        def churn():
+            try:
+                for _ in range(2000):
+                    connection = pool.get_connection()
+                    if connection % 2:
+                        pool.mark_dead(connection)
+                    else:
+                        pool.mark_live(connection)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=churn) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(4, len(pool.connections) + pool.dead.qsize())
+
+
+class TestHealthChecker(TestCase):
+    def _pool(self, healthy, **kwargs):
+        def ping(connection):
+            if connection not in healthy:
+                raise IOError('connection refused')
+        return ConnectionPool([(x, {}) for x in range(3)], ping=ping,
+                              health_check_interval=60, **kwargs)
+
+    def test_dead_connections_are_not_resurrected_inline(self):
+        pool = self._pool(healthy=[0])
+        pool.mark_dead(0, now=time.time() - 61)
+        for _ in range(10):
+            self.assertNotEqual(0, pool.get_connection())
+        pool.close()
+
+    def test_healthy_connection_is_returned_to_the_pool(self):
+        pool = self._pool(healthy=[0])
+        pool.mark_dead(0, now=time.time() - 61)
+        pool.check_dead()
+
+        self.assertIn(0, pool.connections)
+        self.assertNotIn(0, pool.dead_count)
+        self.assertEqual(0, pool.dead.qsize())
+        pool.close()
+
+    def test_unhealthy_connection_gets_longer_timeout(self):
+        pool = self._pool(healthy=[])
+        now = time.time()
+        pool.mark_dead(0, now=now - 61)
+        pool.check_dead(now=now)
+
+        self.assertNotIn(0, pool.connections)
+        self.assertEqual(2, pool.dead_count[0])
+        self.assertEqual((now + 2 * 60, 0), pool.dead.get())
+        pool.close()
+
+    def test_connections_not_due_are_not_checked(self):
+        pinged = []
+        pool = ConnectionPool([(x, {}) for x in range(3)],
+                              ping=pinged.append, health_check_interval=60)
+        pool.mark_dead(0)
+        pool.check_dead()
+        self.assertEqual([], pinged)
+        pool.close()
+
+    def test_requests_do_not_probe_dead_connections(self):
+        pool = self._pool(healthy=[0], dead_timeout=0)
+        for connection in range(3):
+            pool.mark_dead(connection)
+        self.assertRaises(ConnectionPoolEmpty, pool.get_connection)
+        self.assertEqual([], pool.connections)
+        pool.check_dead()
+        self.assertEqual(0, pool.get_connection())
+        pool.close()
+
+    def test_empty_pool_raises(self):
+        pool = ConnectionPool([])
+        self.assertRaises(ConnectionPoolEmpty, pool.get_connection)
+
+    def test_background_thread_checks_dead_connections(self):
+        pool = self._pool(healthy=[0], dead_timeout=0)
+        pool.health_checker.stop()
+        pool.health_checker = HealthChecker(pool, 0.01)
+        pool.health_checker.start()
+
+        pool.mark_dead(0)
+        for _ in range(100):
+            if 0 in pool.connections:
+                break
+            time.sleep(0.01)
+        self.assertIn(0, pool.connections)
+        pool.close()
+
+
+class TestEwmaSelector(TestCase):
+    def test_slow_connection_is_avoided(self):
+        pool = ConnectionPool([(x, {}) for x in range(3)],
+                              selector_class=EwmaSelector)
+        pool.observe(0, 0.01)
+        pool.observe(1, 0.01)
+        pool.observe(2, 2.0)
+
+        selected = [pool.get_connection() for _ in range(300)]
+        self.assertEqual(set([0, 1]), set(selected))
+
+    def test_connection_failing_fast_is_avoided(self):
+        pool = ConnectionPool([(x, {}) for x in range(3)],
+                              selector_class=EwmaSelector)
+        pool.observe(0, 0.05)
+        pool.observe(1, 0.05)
+        pool.observe(2, 0.001, failed=True)
+
+        self.assertTrue(pool.selector.score(2) > pool.selector.score(0))
+        selected = [pool.get_connection() for _ in range(300)]
+        self.assertEqual(set([0, 1]), set(selected))
+
+    def test_repeated_failures_are_bounded(self):
+        selector = EwmaSelector({}, max_penalty=5.0)
+        selector.observe(0, 0.05)
+        for _ in range(100):
+            selector.observe(1, 0.5, failed=True)
+        now = selector.ewma[1][1]
+        self.assertAlmostEqual(5.0, selector.score(1, now))
+        # probed again within a minute of its last failure
+        self.assertTrue(selector.score(1, now + 60) < 0.05)
+
+    def test_moving_average(self):
+        selector = EwmaSelector({}, alpha=0.5)
+        selector.observe(0, 1.0)
+        selector.observe(0, 0.0)
+        self.assertAlmostEqual(0.5, selector.score(0), places=2)
+
+    def test_unused_connection_average_decays(self):
+        selector = EwmaSelector({}, decay_time=10)
+        selector.observe(0, 1.0)
+        now = selector.ewma[0][1]
+        self.assertAlmostEqual(1.0, selector.score(0, now))
+        self.assertAlmostEqual(math.exp(-1), selector.score(0, now + 10))
+
+
+class TestLeastOutstandingSelector(TestCase):
+    def test_connection_with_fewest_requests_in_flight_is_selected(self):
+        pool = ConnectionPool([(x, {}) for x in range(3)],
+                              selector_class=LeastOutstandingSelector)
+        self.assertEqual(set(range(3)),
+                         set(pool.get_connection() for _ in range(3)))
+
+        pool.observe(1, 0.1)
+        self.assertEqual(1, pool.get_connection())
+
+    def test_requests_are_spread_evenly(self):
+        pool = ConnectionPool([(x, {}) for x in range(4)],
+                              selector_class=LeastOutstandingSelector)
+        for _ in range(40):
+            pool.get_connection()
+        self.assertEqual(dict((x, 10) for x in range(4)),
+                         pool.selector.outstanding)
+
+        for x in range(4):
+            pool.observe(x, 0.1)
+        self.assertEqual(dict((x, 9) for x in range(4)),
+                         pool.selector.outstanding)
+
+
+class TestZoneAwareSelector(TestCase):
+    def _pool(self):
+        return ConnectionPool(
+            [(0, {'zone': 'a'}), (1, {'zone': 'a', 'weight': 3}),
+             (2, {'zone': 'b'})],
+            selector_class=ZoneAwareSelector, selector_kwargs={'zone': 'a'})
+
+    def test_same_zone_connections_are_preferred(self):
+        pool = self._pool()
+        selected = [pool.get_connection() for _ in range(400)]
+        self.assertEqual(set([0, 1]), set(selected))
+        # connection 1 has three times the weight of connection 0
+        self.assertTrue(selected.count(1) > 2 * selected.count(0))
+
+    def test_other_zones_are_used_when_zone_is_dead(self):
+        pool = self._pool()
+        pool.mark_dead(0)
+        pool.mark_dead(1)
+        self.assertEqual([2, 2], [pool.get_connection(),
+                                  pool.get_connection()])
+
+
+class TestCircuitBreaker(TestCase):
+    def test_trips_on_error_rate(self):
+        breaker = CircuitBreaker(min_requests=4, max_error_rate=0.5)
+        self.assertFalse(breaker.record(0.1, False, now=100))
+        self.assertFalse(breaker.record(0.1, True, now=100))
+        self.assertFalse(breaker.record(0.1, False, now=101))
+        self.assertTrue(breaker.record(0.1, True, now=101))
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+    def test_trips_on_slow_requests(self):
+        breaker = CircuitBreaker(min_requests=2, slow_request_time=1.0)
+        breaker.record(2.0, False, now=100)
+        self.assertTrue(breaker.record(1.5, False, now=100))
+
+    def test_old_requests_leave_the_window(self):
+        breaker = CircuitBreaker(window=10, min_requests=4)
+        for _ in range(3):
+            breaker.record(0.1, True, now=100)
+        self.assertFalse(breaker.record(0.1, True, now=110))
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+    def test_half_open_closes_after_good_probes(self):
+        breaker = CircuitBreaker(min_requests=1, half_open_requests=2)
+        breaker.record(0.1, True, now=100)
+        breaker.half_open()
+        self.assertFalse(breaker.record(0.1, False))
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        self.assertFalse(breaker.record(0.1, False))
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+    def test_half_open_reopens_on_failure(self):
+        breaker = CircuitBreaker(min_requests=1)
+        breaker.record(0.1, True, now=100)
+        breaker.half_open()
+        self.assertTrue(breaker.record(0.1, True))
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+    def test_pool_marks_tripped_connection_dead(self):
+        pool = ConnectionPool([(0, {}), (1, {})], circuit_breaker_kwargs={
+            'min_requests': 2})
+        pool.observe(0, 0.1, failed=True)
+        self.assertEqual(2, len(pool.connections))
+        pool.observe(0, 0.1, failed=True)
+        self.assertEqual([1], pool.connections)
+
+    def test_resurrected_connection_is_probed(self):
+        pool = ConnectionPool([(0, {}), (1, {})], randomize_hosts=False,
+                              circuit_breaker_kwargs={
+                                  'min_requests': 1, 'half_open_ratio': 0.1,
+                                  'half_open_requests': 3})
+        pool.observe(0, 0.1, failed=True)
+        pool.resurrect(True)
+        self.assertEqual(set([0]), pool.half_open)
+
+        selected = [pool.get_connection() for _ in range(400)]
+        # the half-open connection only gets a fraction of the requests
+        self.assertTrue(0 < selected.count(0) < 100)
+
+        for _ in range(3):
+            pool.observe(0, 0.1)
+        self.assertEqual(set(), pool.half_open)
+        selected = [pool.get_connection() for _ in range(10)]
+        self.assertEqual(5, selected.count(0))
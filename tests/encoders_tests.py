@@ -0,0 +1,62 @@
+import datetime
+import decimal
+import unittest
+import uuid
+
+import pytz
+
+from rawes.encoders import encode_common_types, encode_date_optional_time
+
+
+def legacy_encode(obj):
+    return pytz.timezone("UTC").normalize(obj.astimezone(
+        pytz.timezone("UTC"))).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeNumpyScalar(object):
+    """Quacks like a numpy scalar"""
+    __module__ = 'numpy'
+
+    def __init__(self, value):
+        self.value = value
+
+    def tolist(self):
+        return self.value
+
+
+class TestEncoders(unittest.TestCase):
+    def test_aware_datetimes_match_the_original_encoding(self):
+        eastern = pytz.timezone('America/New_York')
+        dates = [
+            datetime.datetime(2012, 8, 27, 8, 0, 30, tzinfo=pytz.utc),
+            eastern.localize(datetime.datetime(2012, 8, 27, 8, 0, 30)),
+            eastern.localize(datetime.datetime(2012, 3, 11, 3, 30)),
+            eastern.localize(datetime.datetime(2012, 12, 31, 22, 59, 59,
+                                               999999)),
+            pytz.timezone('Asia/Kolkata').localize(
+                datetime.datetime(2013, 1, 1, 1, 0)),
+        ]
+        for date in dates:
+            self.assertEqual(legacy_encode(date),
+                             encode_date_optional_time(date))
+            self.assertEqual(legacy_encode(date), encode_common_types(date))
+
+    def test_naive_datetimes_are_utc(self):
+        self.assertEqual('2013-07-04T23:14:53Z', encode_common_types(
+            datetime.datetime(2013, 7, 4, 23, 14, 53)))
+
+    def test_other_types(self):
+        value = uuid.UUID('12345678123456781234567812345678')
+        self.assertEqual('12345678-1234-5678-1234-567812345678',
+                         encode_common_types(value))
+        self.assertEqual('2013-07-04',
+                         encode_common_types(datetime.date(2013, 7, 4)))
+        self.assertEqual(1.5, encode_common_types(decimal.Decimal('1.5')))
+        self.assertEqual(3, encode_common_types(FakeNumpyScalar(3)))
+        self.assertEqual('2013-07-04', encode_common_types(
+            FakeNumpyScalar(datetime.date(2013, 7, 4))))
+
+    def test_unknown_types_raise_type_error(self):
+        self.assertRaises(TypeError, encode_date_optional_time,
+                          datetime.date(2013, 7, 4))
+        self.assertRaises(TypeError, encode_common_types, object())
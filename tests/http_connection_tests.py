@@ -0,0 +1,184 @@
+import gzip
+import io
+import threading
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from rawes.elastic import Elastic
+from rawes.http_connection import HttpConnection
+from rawes.metrics import MetricsCollector
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connection_headers.append(self.headers.get('Connection'))
+        body = b'{"ok": true}'
+        if self.path.endswith('_search'):
+            body = b'{"hits": {"hits": [{"_id": "1"}, {"_id": "2"}]}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    break
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.bodies.append((self.headers.get('Content-Encoding'),
+                                   body))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """Runs a keep-alive http server on a random local port"""
+    def setUp(self):
+        self.server = ThreadingServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.connection_headers = []
+        self.server.bodies = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestHttpConnectionPooling(LocalServerTestCase):
+    def test_sockets_are_reused(self):
+        connection = HttpConnection(self.url, timeout=5)
+        for _ in range(5):
+            self.assertEqual({'ok': True}, connection.request('get', ''))
+        self.assertEqual({'requests': 5, 'connections': 1, 'reused': 4},
+                         connection.pool_stats())
+
+    def test_keep_alive_can_be_disabled(self):
+        connection = HttpConnection(self.url, timeout=5, keep_alive=False)
+        connection.request('get', '')
+        self.assertEqual(['close'], self.server.connection_headers)
+
+    def test_pool_size_bounds_sockets_across_threads(self):
+        connection = HttpConnection(self.url, timeout=5, pool_maxsize=2,
+                                    pool_block=True)
+
+        def send():
+            for _ in range(5):
+                connection.request('get', '')
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = connection.pool_stats()
+        self.assertEqual(20, stats['requests'])
+        self.assertTrue(stats['connections'] <= 2)
+
+
+class TestHttpCompression(LocalServerTestCase):
+    def _received(self):
+        encoding, body = self.server.bodies[-1]
+        if encoding == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        return encoding, body
+
+    def test_small_bodies_are_sent_raw(self):
+        connection = HttpConnection(self.url, compress_threshold=100)
+        connection.request('post', '_search', data='{"size": 1}')
+        self.assertEqual((None, b'{"size": 1}'), self._received())
+
+    def test_large_bodies_are_compressed(self):
+        connection = HttpConnection(self.url, compress_threshold=100)
+        body = b'{"index": {}}\n{"field": "value"}\n' * 100
+        connection.request('post', '_bulk', data=body,
+                           headers={'X-Opaque-Id': '1'})
+        self.assertEqual(('gzip', body), self._received())
+        _, raw = self.server.bodies[-1]
+        self.assertTrue(len(raw) < len(body) / 10)
+
+    def test_iterable_bodies_are_compressed_incrementally(self):
+        connection = HttpConnection(self.url, compress_threshold=100)
+        lines = (u'{"index": {"_id": "%d"}}\n{}\n' % i for i in range(50))
+        connection.request('post', '_bulk', data=lines)
+        self.assertEqual(
+            ('gzip', b''.join(b'{"index": {"_id": "%d"}}\n{}\n' % i
+                              for i in range(50))),
+            self._received())
+
+
+class TestHttpStreaming(LocalServerTestCase):
+    def test_hits_are_streamed(self):
+        connection = HttpConnection(self.url)
+        hits = connection.request('get', '_search', stream=True)
+        self.assertEqual([{'_id': '1'}, {'_id': '2'}], list(hits))
+
+    def test_stream_path(self):
+        connection = HttpConnection(self.url)
+        self.assertEqual([True], list(connection.request('get', '',
+                                                         stream='ok')))
+
+
+class TestHttpDecoding(LocalServerTestCase):
+    def test_responses_are_decoded_by_the_serializer(self):
+        connection = HttpConnection(self.url, serializer='json')
+        self.assertEqual({'ok': True}, connection.request('get', ''))
+
+    def test_custom_json_decoder_gets_text(self):
+        received = []
+
+        def decoder(text):
+            received.append(text)
+            return text
+
+        connection = HttpConnection(self.url)
+        connection.request('get', '', json_decoder=decoder)
+        self.assertEqual([u'{"ok": true}'], received)
+
+
+class TestHttpMeasures(LocalServerTestCase):
+    def test_measures_are_stored_in_info(self):
+        connection = HttpConnection(self.url)
+        info = {}
+        connection.request('post', '', data='{"a": 1}', info=info)
+        self.assertEqual(200, info['status'])
+        self.assertEqual(8, info['request_size'])
+        self.assertEqual(12, info['response_size'])
+        self.assertTrue(info['network_time'] >= 0)
+        self.assertTrue(info['decode_time'] >= 0)
+
+    def test_elastic_reports_requests_to_hooks(self):
+        collector = MetricsCollector()
+        es = Elastic(self.url, hooks=[collector])
+        es.tweets.post('_search', data={'query': {'match_all': {}}})
+        snapshot = collector.snapshot()
+        stats = snapshot['hosts'][self.url]
+        self.assertEqual(1, stats['requests'])
+        self.assertTrue(stats['encode_time'] > 0)
+        self.assertEqual(48, stats['response_bytes'])
+        self.assertEqual(1, snapshot['endpoints']['POST _search']['requests'])
@@ -0,0 +1,174 @@
+import unittest
+
+from rawes.connection_pool import ConnectionPool
+from rawes.elastic_exception import ElasticException
+from rawes.metrics import MetricsCollector, RequestEvent, RequestHooks
+from rawes.transport import Transport
+
+
+class FakeConnectionError(Exception):
+    pass
+
+
+class MeasuredConnection(object):
+    """Fake connection reporting fixed measures, failing with the queued
+    errors first"""
+    connection_errors = (FakeConnectionError,)
+
+    def __init__(self, url, errors=()):
+        self.url = url
+        self.errors = list(errors)
+
+    def request(self, method, path, **kwargs):
+        info = kwargs.get('info', {})
+        info['request_size'] = 10
+        if self.errors:
+            error = self.errors.pop(0)
+            if isinstance(error, ElasticException):
+                info['status'] = error.status_code
+            raise error
+        info.update(status=200, response_size=20, network_time=0.5,
+                    decode_time=0.25)
+        return {'ok': True}
+
+
+class RecordingHooks(RequestHooks):
+    def __init__(self):
+        self.calls = []
+
+    def on_send(self, event):
+        self.calls.append(('send', event.host, event.attempt))
+
+    def on_response(self, event):
+        self.calls.append(('response', event.host, event.status))
+
+    def on_error(self, event):
+        self.calls.append(('error', event.host, event.status))
+
+
+class FailingHooks(RequestHooks):
+    def on_response(self, event):
+        raise RuntimeError('broken hook')
+
+
+def _event(duration, host='http://a:9200', path='tweets/_search',
+           error=None):
+    event = RequestEvent('post', path, host, encode_time=0.1)
+    event.update({'status': 200, 'request_size': 10, 'response_size': 20,
+                  'network_time': duration, 'decode_time': 0.0})
+    event.duration = duration
+    event.error = error
+    return event
+
+
+class TestRequestEvent(unittest.TestCase):
+    def test_endpoint(self):
+        self.assertEqual('POST _search',
+                         RequestEvent('post', 'tweets/_search', 'a').endpoint)
+        self.assertEqual('GET _doc',
+                         RequestEvent('get', 'tweets/_doc/1', 'a').endpoint)
+        self.assertEqual('GET',
+                         RequestEvent('get', 'tweets/tweet/1', 'a').endpoint)
+
+
+class TestMetricsCollector(unittest.TestCase):
+    def test_percentiles_and_counters(self):
+        collector = MetricsCollector()
+        for i in range(1, 101):
+            collector.on_response(_event(i / 100.0))
+        collector.on_error(_event(2.0, path='_bulk',
+                                  error=FakeConnectionError()))
+
+        snapshot = collector.snapshot()
+        host = snapshot['hosts']['http://a:9200']
+        self.assertEqual(101, host['requests'])
+        self.assertEqual(1, host['errors'])
+        self.assertEqual(1010, host['request_bytes'])
+        self.assertEqual(2020, host['response_bytes'])
+
+        search = snapshot['endpoints']['POST _search']
+        self.assertEqual(100, search['requests'])
+        self.assertEqual(0, search['errors'])
+        self.assertEqual(0.5, search['p50'])
+        self.assertEqual(0.95, search['p95'])
+        self.assertEqual(0.99, search['p99'])
+        self.assertAlmostEqual(10.0, search['encode_time'])
+        self.assertEqual(1, snapshot['endpoints']['POST _bulk']['errors'])
+
+    def test_samples_are_bounded(self):
+        collector = MetricsCollector(max_samples=10)
+        for i in range(100):
+            collector.on_response(_event(i))
+        stats = collector.snapshot()['hosts']['http://a:9200']
+        self.assertEqual(100, stats['requests'])
+        self.assertEqual(94, stats['p50'])
+
+    def test_reset(self):
+        collector = MetricsCollector()
+        collector.on_response(_event(1))
+        collector.reset()
+        self.assertEqual({'hosts': {}, 'endpoints': {}},
+                         collector.snapshot())
+
+
+class TestTransportHooks(unittest.TestCase):
+    def _transport(self, connections, hooks, **kwargs):
+        pool = ConnectionPool([(c, {}) for c in connections],
+                              randomize_hosts=False)
+        return Transport(pool, hooks=hooks, **kwargs)
+
+    def test_hooks_see_every_attempt(self):
+        hooks = RecordingHooks()
+        failing = MeasuredConnection('http://a:9200',
+                                     errors=[FakeConnectionError()])
+        transport = self._transport(
+            [failing, MeasuredConnection('http://b:9200')], [hooks])
+        self.assertEqual({'ok': True},
+                         transport.perform_request('get', '', encode_time=1))
+        self.assertEqual([
+            ('send', 'http://a:9200', 0),
+            ('error', 'http://a:9200', None),
+            ('send', 'http://b:9200', 1),
+            ('response', 'http://b:9200', 200),
+        ], hooks.calls)
+
+    def test_error_responses(self):
+        hooks = RecordingHooks()
+        collector = MetricsCollector()
+        connection = MeasuredConnection('http://a:9200', errors=[
+            ElasticException('missing', None, 404)])
+        transport = self._transport([connection], [hooks, collector])
+        self.assertRaises(ElasticException, transport.perform_request,
+                          'get', 'tweets/tweet/1')
+        self.assertEqual(('error', 'http://a:9200', 404), hooks.calls[-1])
+        stats = collector.snapshot()['endpoints']['GET']
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(10, stats['request_bytes'])
+
+    def test_measures_are_reported(self):
+        collector = MetricsCollector()
+        transport = self._transport([MeasuredConnection('http://a:9200')],
+                                    [collector])
+        transport.perform_request('post', 'tweets/_search', encode_time=0.125)
+        stats = collector.snapshot()['hosts']['http://a:9200']
+        self.assertEqual(0.125, stats['encode_time'])
+        self.assertEqual(0.5, stats['network_time'])
+        self.assertEqual(0.25, stats['decode_time'])
+        self.assertEqual(20, stats['response_bytes'])
+        self.assertTrue(stats['p99'] is not None)
+
+    def test_failing_hook_does_not_fail_the_request(self):
+        transport = self._transport([MeasuredConnection('http://a:9200')],
+                                    [FailingHooks()])
+        self.assertEqual({'ok': True}, transport.perform_request('get', ''))
+
+    def test_connections_get_no_info_without_hooks(self):
+        received = []
+
+        class Connection(object):
+            def request(self, method, path, **kwargs):
+                received.append(kwargs)
+
+        transport = self._transport([Connection()], [])
+        transport.perform_request('get', '', params={'q': 'x'})
+        self.assertEqual([{'params': {'q': 'x'}}], received)
@@ -0,0 +1,120 @@
+import gc
+import json
+import unittest
+
+from rawes.connection_pool import ConnectionPool
+from rawes.elastic import Elastic
+from rawes.serializer import JsonSerializer
+
+
+class FakeScrollConnection(object):
+    """Serves ``pages`` of hits through the scroll API"""
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def request(self, method, path, **kwargs):
+        if 'data' in kwargs:
+            kwargs['data'] = json.loads(kwargs['data'])
+        self.calls.append((method, path, kwargs))
+        if method == 'delete':
+            return {'succeeded': True}
+        if path.endswith('_search'):
+            page = 0
+        else:
+            page = int(kwargs['data']['scroll_id']) + 1
+        hits = self.pages[page] if page < len(self.pages) else []
+        return {'_scroll_id': str(page), 'hits': {'hits': hits}}
+
+
+class TestScan(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeScrollConnection([[1, 2], [3, 4], [5]])
+        self.es = Elastic(connection_pool=ConnectionPool(
+            [(self.connection, {})]))
+
+    def test_scan_yields_every_hit_and_clears_scroll(self):
+        hits = list(self.es.tweets.scan(scroll='1m', size=2))
+
+        self.assertEqual([1, 2, 3, 4, 5], hits)
+        method, path, kwargs = self.connection.calls[0]
+        self.assertEqual('tweets/_search', path)
+        self.assertEqual({'scroll': '1m', 'size': 2}, kwargs['params'])
+        self.assertEqual(('post', '_search/scroll'),
+                         self.connection.calls[1][:2])
+        method, path, kwargs = self.connection.calls[-1]
+        self.assertEqual(('delete', '_search/scroll'), (method, path))
+        self.assertEqual({'scroll_id': ['3']}, kwargs['data'])
+
+    def test_scan_is_lazy(self):
+        hits = self.es.scan('tweets')
+        self.assertEqual([], self.connection.calls)
+        self.assertEqual(1, next(hits))
+        self.assertEqual(1, len(self.connection.calls))
+
+    def test_scroll_is_cleared_when_generator_is_dropped(self):
+        hits = self.es.scan('tweets')
+        next(hits)
+        del hits
+        gc.collect()
+        self.assertEqual('delete', self.connection.calls[-1][0])
+        self.assertEqual({'scroll_id': ['0']},
+                         self.connection.calls[-1][2]['data'])
+
+
+class FakeSlicedScrollConnection(object):
+    """Serves three pages of two hits for every slice"""
+    def __init__(self):
+        self.cleared = []
+
+    def request(self, method, path, **kwargs):
+        data = json.loads(kwargs['data'])
+        if method == 'delete':
+            self.cleared.extend(data['scroll_id'])
+            return {'succeeded': True}
+        if path.endswith('_search'):
+            slice_id, page = data['slice']['id'], 0
+        else:
+            slice_id, page = map(int, data['scroll_id'].split(':'))
+            page += 1
+        hits = []
+        if page < 3:
+            hits = ['%s-%s-%s' % (slice_id, page, i) for i in range(2)]
+        return {'_scroll_id': '%s:%s' % (slice_id, page),
+                'hits': {'hits': hits}}
+
+
+class RecordingSerializer(JsonSerializer):
+    """Records the data it decodes"""
+    def __init__(self):
+        super(RecordingSerializer, self).__init__()
+        self.loaded = []
+
+    def loads(self, data):
+        self.loaded.append(data)
+        return super(RecordingSerializer, self).loads(data)
+
+
+class TestSlicedScan(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeSlicedScrollConnection()
+        self.es = Elastic(connection_pool=ConnectionPool(
+            [(self.connection, {})]))
+
+    def test_text_query_is_decoded_with_the_client_serializer(self):
+        serializer = RecordingSerializer()
+        es = Elastic(connection_pool=ConnectionPool([(self.connection, {})]),
+                     serializer=serializer)
+        query = '{"query": {"match_all": {}}}'
+        hits = list(es.sliced_scan('tweets', data=query, slices=2))
+        self.assertEqual(12, len(hits))
+        self.assertEqual([query], serializer.loaded)
+
+    def test_sliced_scan_merges_every_slice(self):
+        hits = list(self.es.sliced_scan('tweets', slices=4, queue_size=3))
+
+        self.assertEqual(set('%s-%s-%s' % (s, p, i) for s in range(4)
+                             for p in range(3) for i in range(2)), set(hits))
+        self.assertEqual(24, len(hits))
+        self.assertEqual(set('%s:3' % s for s in range(4)),
+                         set(self.connection.cleared))
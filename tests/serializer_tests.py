@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+
+import mock
+
+from rawes import serializer
+from rawes.elastic import Elastic
+from rawes.encoders import encode_date_optional_time
+from rawes.serializer import JsonSerializer, get_serializer
+
+
+def available_serializers():
+    serializers = []
+    for cls in serializer.SERIALIZERS:
+        try:
+            serializers.append(cls())
+        except ImportError:
+            pass
+    return serializers
+
+
+class OldSerializer(JsonSerializer):
+    """Backend without support for `default`"""
+    name = 'old'
+
+    def dumps(self, obj, default=None):
+        return self.json.dumps(obj)
+
+
+class TestSerializers(unittest.TestCase):
+    def test_round_trip(self):
+        doc = {'text': u'caf\xe9', 'count': 3, 'ratio': 0.25, 'tags': ['a'],
+               'missing': None, 'flag': True}
+        for backend in available_serializers():
+            encoded = backend.dumps(doc)
+            self.assertEqual(doc, backend.loads(encoded), backend.name)
+            if not isinstance(encoded, bytes):
+                encoded = encoded.encode('utf-8')
+            self.assertEqual(doc, backend.loads(encoded), backend.name)
+
+    def test_json_encoder_formats_datetimes(self):
+        doc = {'date': datetime.datetime(2013, 7, 4, 23, 14, 53)}
+        expected = encode_date_optional_time(doc['date'])
+        for backend in available_serializers():
+            encoded = backend.dumps(doc, default=encode_date_optional_time)
+            self.assertEqual({'date': expected}, backend.loads(encoded),
+                             backend.name)
+
+    def test_numeric_keys_are_encoded_as_strings(self):
+        for backend in available_serializers():
+            encoded = backend.dumps({1: 'a'})
+            self.assertEqual({'1': 'a'}, backend.loads(encoded), backend.name)
+
+    def test_backends_failing_the_probe_are_skipped(self):
+        selected = serializer._first_available((OldSerializer,
+                                                JsonSerializer))
+        self.assertEqual('json', selected.name)
+        with mock.patch.object(serializer, 'SERIALIZERS', (OldSerializer,)):
+            self.assertRaises(ValueError, get_serializer, 'old')
+
+    def test_invalid_json_raises_value_error(self):
+        for backend in available_serializers():
+            self.assertRaises(ValueError, backend.loads, b'{"a": ')
+
+    def test_default_is_selected_once(self):
+        self.assertTrue(get_serializer() is get_serializer())
+        self.assertEqual(available_serializers()[0].name,
+                         get_serializer().name)
+
+    def test_selection_by_name(self):
+        self.assertTrue(isinstance(get_serializer('json'), JsonSerializer))
+        backend = JsonSerializer()
+        self.assertTrue(get_serializer(backend) is backend)
+        self.assertRaises(ValueError, get_serializer, 'yaml')
+
+    def test_elastic_shares_its_serializer(self):
+        es = Elastic('localhost:9200', serializer='json')
+        self.assertEqual('json', es.serializer.name)
+        self.assertTrue(es.connection_pool.connections[0].serializer is
+                        es.serializer)
+        self.assertTrue(es.tweets.serializer is es.serializer)
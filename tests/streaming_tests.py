@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from rawes.streaming import iter_items
+
+RESPONSE = {
+    'took': 12,
+    'timed_out': False,
+    '_shards': {'total': 5, 'successful': 5, 'failed': 0},
+    'hits': {
+        'total': 3,
+        'max_score': 1.5,
+        'hits': [
+            {'_id': '1', '_source': {'text': u'caf\xe9 "quoted" \\ [x] {y}'}},
+            {'_id': '2', '_source': {'values': [1, 2.5, -3e10, None, True]}},
+            {'_id': '3', '_source': {}},
+        ]
+    },
+    'aggregations': {'tags': {'buckets': [{'key': 'a', 'doc_count': 2}]}}
+}
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestIterItems(unittest.TestCase):
+    def setUp(self):
+        self.data = json.dumps(RESPONSE, indent=1).encode('utf-8')
+
+    def test_hits_are_yielded(self):
+        self.assertEqual(RESPONSE['hits']['hits'],
+                         list(iter_items([self.data])))
+
+    def test_any_chunk_boundary(self):
+        # splits multibyte characters, escapes and numbers across chunks
+        for size in range(1, 20):
+            self.assertEqual(RESPONSE['hits']['hits'],
+                             list(iter_items(split(self.data, size))))
+
+    def test_items_are_yielded_before_the_end_of_the_input(self):
+        received = []
+
+        def chunks():
+            for chunk in split(self.data, 16):
+                received.append(chunk)
+                yield chunk
+
+        hits = iter_items(chunks())
+        next(hits)
+        self.assertTrue(len(b''.join(received)) < len(self.data) / 2)
+
+    def test_other_paths(self):
+        self.assertEqual([RESPONSE['aggregations']['tags']['buckets'][0]],
+                         list(iter_items(split(self.data, 7),
+                                         'aggregations.tags.buckets')))
+        self.assertEqual([12], list(iter_items(split(self.data, 3), 'took')))
+        self.assertEqual([], list(iter_items([self.data], 'hits.missing')))
+        self.assertEqual([], list(iter_items([self.data], 'took.value')))
+
+    def test_text_chunks(self):
+        text = json.dumps({'hits': {'hits': [1, 2]}})
+        self.assertEqual([1, 2], list(iter_items(split(text, 2))))
+
+    def test_truncated_input(self):
+        self.assertRaises(ValueError, list,
+                          iter_items([self.data[:len(self.data) // 2]]))
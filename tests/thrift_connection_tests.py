@@ -0,0 +1,392 @@
+import json
+import socket
+import threading
+import time
+import unittest
+
+import mock
+
+try:
+    from thrift.Thrift import TApplicationException, TMessageType
+    from thrift.protocol import TBinaryProtocol
+    from thrift.server import TServer
+    from thrift.transport import TSocket, TTransport
+
+    from rawes.thrift_connection import ThriftConnection
+    from rawes.thrift_elasticsearch import Rest
+    from rawes.thrift_elasticsearch.ttypes import Method, RestResponse
+except ImportError:
+    thrift_available = False
+else:
+    thrift_available = True
+
+from rawes.connection_pool import LeastOutstandingSelector
+from rawes.elastic import Elastic
+from rawes.elastic_exception import ElasticException
+from rawes.metrics import MetricsCollector
+
+
+class EchoHandler(object):
+    """Stand-in for the elasticsearch thrift plugin, answering with the
+    request it received"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def execute(self, request):
+        with self.lock:
+            self.requests.append(request)
+        if request.uri == 'slow':
+            time.sleep(0.5)
+        if request.uri == 'missing':
+            return RestResponse(status=404, body=b'{"error": "missing"}')
+        body = json.dumps({
+            'method': Method._VALUES_TO_NAMES[request.method],
+            'uri': request.uri,
+            'parameters': request.parameters,
+            'body': request.body.decode('utf-8') if request.body else None,
+        })
+        return RestResponse(status=200, body=body.encode('utf-8'))
+
+
+class UnansweredSocket(object):
+    """Socket sending data to the host, which closes it before answering"""
+    def __init__(self, handle):
+        self.handle = handle
+
+    def recv(self, size):
+        return b''
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+
+class StoppableServer(TServer.TThreadedServer if thrift_available
+                      else object):
+    """Threaded thrift server counting the sockets it accepts, which stops
+    accepting when closed"""
+    def __init__(self, *args, **kwargs):
+        super(StoppableServer, self).__init__(*args, **kwargs)
+        self.accepted = 0
+        self.stopped = False
+
+    def serve(self):
+        while True:
+            try:
+                client = self.serverTransport.accept()
+            except Exception:
+                if self.stopped:
+                    return
+                raise
+            self.accepted += 1
+            thread = threading.Thread(target=self.handle, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        self.stopped = True
+        # unblocks the accept call
+        self.serverTransport.handle.shutdown(socket.SHUT_RDWR)
+        self.serverTransport.close()
+
+
+@unittest.skipIf(not thrift_available, 'thrift is not installed')
+class TestThriftConnection(unittest.TestCase):
+    framed = False
+
+    def setUp(self):
+        self.handler = EchoHandler()
+        server_socket = TSocket.TServerSocket(host='127.0.0.1', port=0)
+        if self.framed:
+            transport_factory = TTransport.TFramedTransportFactory()
+        else:
+            transport_factory = TTransport.TBufferedTransportFactory()
+        self.server = StoppableServer(
+            Rest.Processor(self.handler), server_socket,
+            transport_factory, TBinaryProtocol.TBinaryProtocolFactory())
+        server_socket.listen()
+        self.port = server_socket.handle.getsockname()[1]
+        thread = threading.Thread(target=self.server.serve)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def _connection(self, timeout=5, **kwargs):
+        return ThriftConnection('127.0.0.1', self.port, timeout=timeout,
+                                framed=self.framed, **kwargs)
+
+    def test_request(self):
+        es = Elastic('thrift://127.0.0.1:{0}'.format(self.port),
+                     framed=self.framed)
+        result = es.tweets.post('_search', params={'size': 1, 'pretty': True},
+                                data={'query': {'match_all': {}}})
+        self.assertEqual({
+            'method': 'POST',
+            'uri': 'tweets/_search',
+            'parameters': {'size': '1', 'pretty': 'true'},
+            'body': '{"query": {"match_all": {}}}',
+        }, dict(result, body=json.dumps(json.loads(result['body']))))
+
+    def test_bytes_and_text_bodies(self):
+        connection = self._connection()
+        text = u'{"message": "caf\xe9"}'
+        self.assertEqual(text, connection.request('put', 'doc',
+                                                  data=text)['body'])
+        self.assertEqual(text, connection.request(
+            'put', 'doc', data=text.encode('utf-8'))['body'])
+
+    def test_errors(self):
+        connection = self._connection()
+        with self.assertRaises(ElasticException) as context:
+            connection.request('get', 'missing')
+        self.assertEqual(404, context.exception.status_code)
+        self.assertEqual({'error': 'missing'}, context.exception.result)
+
+    def test_stream_is_rejected(self):
+        connection = self._connection()
+        self.assertRaises(ValueError, connection.request, 'get', 'plain',
+                          stream=True)
+        self.assertRaises(ValueError, connection.pipeline().request, 'get',
+                          'plain', stream='hits.hits')
+        self.assertEqual('plain', connection.request('get', 'plain',
+                                                     stream=False)['uri'])
+
+    def test_custom_json_decoder_gets_text(self):
+        connection = self._connection()
+        received = []
+        connection.request('get', '', json_decoder=received.append)
+        self.assertTrue(isinstance(received[0], type(u'')))
+
+    def test_sockets_are_pooled(self):
+        connection = self._connection(pool_size=3)
+        results = []
+
+        def send(i):
+            for j in range(5):
+                uri = 'doc/{0}/{1}'.format(i, j)
+                results.append(connection.request('get', uri)['uri'] == uri)
+
+        threads = [threading.Thread(target=send, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([True] * 40, results)
+        self.assertTrue(self.server.accepted <= 3)
+        self.assertEqual(0, self.handler.requests[0].method)
+
+    def test_sockets_are_opened_lazily(self):
+        self._connection()
+        self.assertEqual(0, self.server.accepted)
+
+    def test_broken_idle_socket_is_reconnected(self):
+        connection = self._connection()
+        connection.request('get', '')
+        client = connection.clients.queue[0]
+        client._oprot.trans.close()
+        self.assertEqual('again', connection.request('get', 'again')['uri'])
+        self.assertEqual(2, self.server.accepted)
+
+    def test_unwritten_request_is_resent(self):
+        connection = self._connection()
+        connection.request('get', '')
+        connection.clients.queue[0]._oprot.trans.close()
+        self.assertEqual('again', connection.request('post', 'again',
+                                                     data='{}')['uri'])
+        self.assertEqual(['', 'again'],
+                         [request.uri for request in self.handler.requests])
+
+    def _close_idle_socket_after_request(self, connection):
+        """The next request on the idle socket is received by the host,
+        which closes the socket without answering"""
+        tsocket = connection.clients.queue[0].tsocket
+        tsocket.handle = UnansweredSocket(tsocket.handle)
+
+    def test_unanswered_read_on_reused_socket_is_resent(self):
+        connection = self._connection()
+        connection.request('get', '')
+        self._close_idle_socket_after_request(connection)
+        self.assertEqual('again', connection.request('get', 'again')['uri'])
+        self.assertEqual(2, self.server.accepted)
+
+    def test_unanswered_write_on_reused_socket_is_not_resent(self):
+        connection = self._connection()
+        connection.request('get', '')
+        self._close_idle_socket_after_request(connection)
+        self.assertRaises(connection.connection_errors, connection.request,
+                          'post', 'index', data='{}')
+        time.sleep(0.1)
+        self.assertEqual(['', 'index'],
+                         [request.uri for request in self.handler.requests])
+
+    def test_unanswered_pipelined_writes_are_not_resent(self):
+        connection = self._connection()
+        connection.request('get', '')
+        self._close_idle_socket_after_request(connection)
+        pipeline = connection.pipeline()
+        pipeline.request('get', 'read')
+        pipeline.request('post', 'index', data='{}')
+        self.assertRaises(connection.connection_errors, pipeline.execute)
+        time.sleep(0.1)
+        self.assertEqual(['', 'read', 'index'],
+                         [request.uri for request in self.handler.requests])
+
+    def test_timeout_on_reused_socket_is_not_resent(self):
+        connection = self._connection(timeout=0.1)
+        connection.request('get', '')
+        self.assertRaises(connection.timeout_errors, connection.request,
+                          'post', 'slow', data='{}')
+        self.assertEqual(['', 'slow'],
+                         [request.uri for request in self.handler.requests])
+
+    def test_timeouts_follow_the_transport_timeout_policy(self):
+        es = Elastic('thrift://127.0.0.1:{0}'.format(self.port),
+                     framed=self.framed, timeout=0.1)
+        self.assertRaises(ThriftConnection.timeout_errors, es.post, 'slow',
+                          data='{}')
+        self.assertEqual(1, len(self.handler.requests))
+
+    def test_unreachable_host_raises_connection_error(self):
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+        connection = ThriftConnection('127.0.0.1', port, timeout=5)
+        self.assertRaises(connection.connection_errors, connection.request,
+                          'get', '')
+
+    def test_accelerated_protocol(self):
+        connection = self._connection(accelerated=True)
+        self.assertEqual('fast', connection.request('get', 'fast')['uri'])
+        # large bodies are encoded by the python protocol
+        body = u'{"message": "caf\xe9"}' * 1000
+        self.assertEqual(body, connection.request('post', 'large',
+                                                  data=body)['body'])
+
+    def test_accelerated_protocol_falls_back_without_fastbinary(self):
+        with mock.patch('rawes.thrift_connection.fastbinary', None):
+            connection = self._connection(accelerated=True)
+        self.assertEqual(TBinaryProtocol.TBinaryProtocol,
+                         connection.protocol_class)
+        self.assertEqual('plain', connection.request('get', 'plain')['uri'])
+
+    def test_measures_are_stored_in_info(self):
+        connection = self._connection()
+        info = {}
+        connection.request('put', 'doc', data='{}', info=info)
+        self.assertEqual(200, info['status'])
+        self.assertEqual(2, info['request_size'])
+        self.assertTrue(info['response_size'] > 0)
+        self.assertTrue(info['network_time'] >= 0)
+        self.assertTrue(info['decode_time'] >= 0)
+
+    def test_pipeline(self):
+        connection = self._connection()
+        with connection.pipeline(window=3) as pipeline:
+            futures = [pipeline.request('get', str(i)) for i in range(10)]
+            missing = pipeline.request('get', 'missing')
+            self.assertRaises(ValueError, futures[0].result)
+        self.assertEqual([str(i) for i in range(10)],
+                         [future.result()['uri'] for future in futures])
+        with self.assertRaises(ElasticException) as context:
+            missing.result()
+        self.assertEqual(404, context.exception.status_code)
+        # sent on a single socket, which is returned to the pool
+        self.assertEqual(1, self.server.accepted)
+        self.assertEqual('single', connection.request('get', 'single')['uri'])
+        self.assertEqual(1, self.server.accepted)
+
+    def test_pipeline_execute_returns_futures(self):
+        connection = self._connection()
+        pipeline = connection.pipeline()
+        pipeline.request('put', 'doc', data='{}', params={'refresh': True})
+        futures = pipeline.execute()
+        self.assertEqual({'refresh': 'true'}, futures[0].result()['parameters'])
+        self.assertEqual([], pipeline.execute())
+
+    def test_pipeline_reconnects_broken_idle_socket(self):
+        connection = self._connection()
+        connection.request('get', '')
+        connection.clients.queue[0]._oprot.trans.close()
+        pipeline = connection.pipeline()
+        future = pipeline.request('get', 'again')
+        pipeline.execute()
+        self.assertEqual('again', future.result()['uri'])
+        self.assertEqual(2, self.server.accepted)
+
+    def test_responses_are_matched_by_sequence_id(self):
+        replies = TTransport.TMemoryBuffer()
+        oprot = TBinaryProtocol.TBinaryProtocol(replies)
+        for seqid in (1, 0):
+            oprot.writeMessageBegin('execute', TMessageType.REPLY, seqid)
+            Rest.execute_result(success=RestResponse(
+                status=200, body=str(seqid).encode('utf-8'))).write(oprot)
+            oprot.writeMessageEnd()
+        iprot = TBinaryProtocol.TBinaryProtocol(
+            TTransport.TMemoryBuffer(replies.getvalue()))
+        client = Rest.Client(iprot)
+        connection = self._connection()
+        pending, results = set([0, 1]), {}
+        connection._receive(client, pending, results)
+        connection._receive(client, pending, results)
+        self.assertEqual({0: b'0', 1: b'1'},
+                         dict((k, v.body) for k, v in results.items()))
+
+        iprot = TBinaryProtocol.TBinaryProtocol(
+            TTransport.TMemoryBuffer(replies.getvalue()))
+        self.assertRaises(TApplicationException, connection._receive,
+                          Rest.Client(iprot), set([0]), {})
+
+    def test_pipeline_connection_error(self):
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+        pipeline = ThriftConnection('127.0.0.1', port, timeout=5).pipeline()
+        future = pipeline.request('get', '')
+        self.assertRaises(ThriftConnection.connection_errors,
+                          pipeline.execute)
+        self.assertRaises(ThriftConnection.connection_errors, future.result)
+
+    def test_transport_pipeline_is_reported(self):
+        collector = MetricsCollector()
+        es = Elastic('thrift://127.0.0.1:{0}'.format(self.port),
+                     framed=self.framed, hooks=[collector],
+                     connection_pool_kwargs={
+                         'selector_class': LeastOutstandingSelector})
+        with es.transport.pipeline() as pipeline:
+            found = pipeline.request('get', 'tweets/tweet/1')
+            missing = pipeline.request('get', 'missing')
+        self.assertEqual('tweets/tweet/1', found.result()['uri'])
+        self.assertRaises(ElasticException, missing.result)
+
+        stats = collector.snapshot()['hosts']['127.0.0.1:{0}'.format(
+            self.port)]
+        self.assertEqual(2, stats['requests'])
+        connection = es.connection_pool.connections[0]
+        self.assertEqual(0, es.connection_pool.selector.outstanding.get(
+            connection, 0))
+
+    def test_transport_pipeline_failure_marks_the_host_dead(self):
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+        collector = MetricsCollector()
+        es = Elastic('thrift://127.0.0.1:{0}'.format(port),
+                     framed=self.framed, hooks=[collector])
+        pipeline = es.transport.pipeline()
+        pipeline.request('get', '')
+        self.assertRaises(ThriftConnection.connection_errors,
+                          pipeline.execute)
+        self.assertEqual([], es.connection_pool.connections)
+        self.assertEqual(1, collector.snapshot()['hosts'][
+            '127.0.0.1:{0}'.format(port)]['errors'])
+
+
+class TestFramedThriftConnection(TestThriftConnection):
+    framed = True
@@ -0,0 +1,371 @@
+import time
+import unittest
+
+from rawes.backpressure import AdaptiveLimiter
+from rawes.connection_pool import ConnectionPool, LeastOutstandingSelector
+from rawes.elastic import Elastic
+from rawes.elastic_exception import ElasticException
+from rawes.metrics import RequestHooks
+from rawes.transport import Transport
+
+
+class FakeConnectionError(Exception):
+    pass
+
+
+class FakeTimeout(Exception):
+    pass
+
+
+class FakeConnection(object):
+    connection_errors = (FakeConnectionError,)
+    timeout_errors = (FakeTimeout,)
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def request(self, method, path, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+    def __repr__(self):
+        return self.name
+
+
+class TestTransport(unittest.TestCase):
+    def _transport(self, connections, **kwargs):
+        pool = ConnectionPool([(c, {}) for c in connections],
+                              randomize_hosts=False)
+        return Transport(pool, **kwargs)
+
+    def test_connection_errors_fail_over_to_next_host(self):
+        down = FakeConnection('down', FakeConnectionError())
+        up = FakeConnection('up')
+        transport = self._transport([down, up])
+
+        self.assertEqual('up', transport.perform_request('get', ''))
+        self.assertEqual([up], transport.connection_pool.connections)
+        self.assertEqual(1, transport.connection_pool.dead_count[down])
+
+    def test_retryable_status_fails_over_to_next_host(self):
+        busy = FakeConnection('busy', ElasticException('', None, 503))
+        up = FakeConnection('up')
+        transport = self._transport([busy, up])
+
+        self.assertEqual('up', transport.perform_request('get', ''))
+        self.assertEqual([up], transport.connection_pool.connections)
+
+    def test_client_errors_are_not_retried(self):
+        missing = FakeConnection('missing', ElasticException('', None, 404))
+        up = FakeConnection('up')
+        transport = self._transport([missing, up])
+
+        self.assertRaises(ElasticException, transport.perform_request,
+                          'get', '')
+        self.assertEqual(0, up.calls)
+        self.assertEqual([missing, up], transport.connection_pool.connections)
+
+    def test_retries_are_bounded(self):
+        connections = [FakeConnection(str(i), FakeConnectionError())
+                       for i in range(5)]
+        transport = self._transport(connections, max_retries=2)
+
+        self.assertRaises(FakeConnectionError, transport.perform_request,
+                          'get', '')
+        self.assertEqual(3, sum(c.calls for c in connections))
+
+    def test_timeouts_are_only_retried_when_asked(self):
+        slow = FakeConnection('slow', FakeTimeout())
+        up = FakeConnection('up')
+        transport = self._transport([slow, up])
+        self.assertRaises(FakeTimeout, transport.perform_request, 'get', '')
+        self.assertEqual([up], transport.connection_pool.connections)
+
+        slow = FakeConnection('slow', FakeTimeout())
+        transport = self._transport([slow, up], retry_on_timeout=True)
+        self.assertEqual('up', transport.perform_request('get', ''))
+
+    def test_timeouts_that_are_connection_errors_are_not_retried(self):
+        class ConnectionTimeout(FakeConnectionError, FakeTimeout):
+            pass
+
+        slow = FakeConnection('slow', ConnectionTimeout())
+        up = FakeConnection('up')
+        transport = self._transport([slow, up])
+        self.assertRaises(ConnectionTimeout, transport.perform_request,
+                          'get', '')
+        self.assertEqual(0, up.calls)
+
+    def test_resurrected_connection_is_marked_live_on_success(self):
+        flaky = FakeConnection('flaky', FakeConnectionError())
+        transport = self._transport([flaky], max_retries=0)
+        self.assertRaises(FakeConnectionError, transport.perform_request,
+                          'get', '')
+
+        flaky.error = None
+        self.assertEqual('flaky', transport.perform_request('get', ''))
+        self.assertNotIn(flaky, transport.connection_pool.dead_count)
+
+    def test_pipelines_need_thrift_connections(self):
+        transport = self._transport([FakeConnection('http')])
+        self.assertRaises(ValueError, transport.pipeline)
+
+    def test_elastic_shares_transport_with_derived_clients(self):
+        es = Elastic(connection_pool=ConnectionPool(
+            [(FakeConnection('up'), {})]), transport_kwargs={'max_retries': 7})
+        self.assertIs(es.transport, es.tweets.tweet.transport)
+        self.assertEqual(7, es.tweets.transport.max_retries)
+        self.assertEqual('up', es.tweets.get())
+
+    def test_elastic_passes_host_attributes_to_the_pool(self):
+        es = Elastic([{'url': 'http://host1:9200', 'zone': 'a'},
+                      'http://host2:9200'])
+        opts = dict((c.url, o) for c, o in es.connection_pool.connection_opts)
+        self.assertEqual({'http://host1:9200': {'zone': 'a'},
+                          'http://host2:9200': {}}, opts)
+
+
+class FakeSniffConnection(FakeConnection):
+    nodes = {
+        'a': {'http': {'publish_address': 'inet[/10.0.0.1:9200]'}},
+        'b': {'http': {'publish_address': 'node2/10.0.0.2:9200'},
+              'attributes': {'zone': 'b'}},
+        'c': {'name': 'client node without http'},
+    }
+
+    def __init__(self, url, error=None):
+        super(FakeSniffConnection, self).__init__(url, error)
+        self.url = url
+
+    def request(self, method, path, **kwargs):
+        super(FakeSniffConnection, self).request(method, path, **kwargs)
+        if path == '_nodes/http':
+            return {'nodes': self.nodes}
+        return self.url
+
+
+class TestSniffing(unittest.TestCase):
+    def _transport(self, connections, **kwargs):
+        pool = ConnectionPool([(c, {'seed': True}) for c in connections],
+                              randomize_hosts=False)
+        return Transport(pool, connection_factory=FakeSniffConnection,
+                         connection_pool_kwargs={'randomize_hosts': False},
+                         **kwargs)
+
+    def test_sniff_on_start_replaces_hosts(self):
+        seed = FakeSniffConnection('http://10.0.0.1:9200')
+        transport = self._transport([seed], sniff_on_start=True)
+
+        pool = transport.connection_pool
+        self.assertEqual(['http://10.0.0.1:9200', 'http://10.0.0.2:9200'],
+                         [c.url for c in pool.connections])
+        self.assertIs(seed, pool.connections[0])
+        opts = dict(pool.connection_opts)
+        self.assertEqual({'seed': True}, opts[seed])
+        self.assertEqual({'zone': 'b'}, opts[pool.connections[1]])
+
+    def test_sniff_skips_unreachable_hosts(self):
+        down = FakeSniffConnection('http://down:9200', FakeConnectionError())
+        up = FakeSniffConnection('http://up:9200')
+        transport = self._transport([down, up], sniff_on_start=True)
+        self.assertEqual(2, len(transport.connection_pool.connections))
+        self.assertEqual(1, down.calls)
+
+    def test_failed_sniff_keeps_current_pool(self):
+        down = FakeSniffConnection('http://down:9200', FakeConnectionError())
+        transport = self._transport([down], sniff_on_start=True)
+        self.assertEqual([down], transport.connection_pool.connections)
+
+    def test_sniffed_pool_keeps_the_pool_settings(self):
+        seed = FakeSniffConnection('http://10.0.0.1:9200')
+        pool = ConnectionPool([(seed, {})],
+                              selector_class=LeastOutstandingSelector,
+                              dead_timeout=5,
+                              circuit_breaker_kwargs={'min_requests': 3})
+        transport = Transport(pool, connection_factory=FakeSniffConnection,
+                              sniff_on_start=True)
+        sniffed = transport.connection_pool
+        self.assertEqual(2, len(sniffed.connections))
+        self.assertTrue(isinstance(sniffed.selector,
+                                   LeastOutstandingSelector))
+        self.assertEqual(5, sniffed.dead_timeout)
+        self.assertEqual(2, len(sniffed.breakers))
+
+    def test_pools_without_urls_are_not_sniffed(self):
+        pool = ConnectionPool([(FakeConnection('thrift'), {})])
+        self.assertRaises(ValueError, Transport, pool,
+                          connection_factory=FakeSniffConnection,
+                          sniffer_interval=60)
+        transport = Transport(pool, connection_factory=FakeSniffConnection)
+        self.assertRaises(ValueError, transport.sniff_hosts)
+
+    def test_periodic_sniffing(self):
+        seed = FakeSniffConnection('http://10.0.0.1:9200')
+        transport = self._transport([seed], sniffer_interval=60)
+        transport.perform_request('get', '')
+        self.assertEqual(1, len(transport.connection_pool.connections))
+
+        transport.last_sniff -= 61
+        transport.perform_request('get', '')
+        self.assertEqual(2, len(transport.connection_pool.connections))
+
+    def test_sniff_on_connection_fail(self):
+        down = FakeSniffConnection('http://10.0.0.9:9200',
+                                   FakeConnectionError())
+        seed = FakeSniffConnection('http://10.0.0.1:9200')
+        transport = self._transport([down, seed],
+                                    sniff_on_connection_fail=True)
+
+        self.assertEqual('http://10.0.0.1:9200',
+                         transport.perform_request('get', ''))
+        self.assertEqual(['http://10.0.0.1:9200', 'http://10.0.0.2:9200'],
+                         [c.url for c in transport.connection_pool.connections])
+
+
+class SlowConnection(FakeConnection):
+    def __init__(self, name, delay):
+        super(SlowConnection, self).__init__(name)
+        self.delay = delay
+
+    def request(self, method, path, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.name
+
+
+class StreamingConnection(FakeConnection):
+    """Streams three items, failing on the last one with `error`"""
+    def __init__(self, name, error=None, delay=0):
+        super(StreamingConnection, self).__init__(name, error)
+        self.delay = delay
+
+    def request(self, method, path, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self._items()
+
+    def _items(self):
+        yield 1
+        yield 2
+        if self.error is not None:
+            raise self.error
+        yield 3
+
+
+class CompletedHooks(RequestHooks):
+    def __init__(self):
+        self.events = []
+
+    def on_response(self, event):
+        self.events.append(event)
+
+    def on_error(self, event):
+        self.events.append(event)
+
+
+class TestStreamedResponses(unittest.TestCase):
+    def setUp(self):
+        self.connection = StreamingConnection('stream')
+        self.pool = ConnectionPool([(self.connection, {})],
+                                   selector_class=LeastOutstandingSelector)
+        self.limiter = AdaptiveLimiter(initial_limit=4)
+        self.hooks = CompletedHooks()
+        self.transport = Transport(self.pool, limiter=self.limiter,
+                                   hooks=[self.hooks])
+
+    def _in_flight(self):
+        return (self.pool.selector.outstanding.get(self.connection, 0),
+                self.limiter.in_flight, len(self.hooks.events))
+
+    def test_completion_is_recorded_once_read(self):
+        items = self.transport.perform_request('get', '_search', stream=True)
+        self.assertEqual((1, 1, 0), self._in_flight())
+        self.assertEqual([1, 2, 3], list(items))
+        self.assertEqual((0, 0, 1), self._in_flight())
+        self.assertEqual(None, self.hooks.events[0].error)
+
+    def test_completion_is_recorded_once_closed(self):
+        items = self.transport.perform_request('get', '_search', stream=True)
+        self.assertEqual(1, next(items))
+        items.close()
+        self.assertEqual((0, 0, 1), self._in_flight())
+        items.close()
+        self.assertEqual(1, len(self.hooks.events))
+
+    def test_errors_while_reading_are_reported(self):
+        self.connection.error = FakeConnectionError()
+        items = self.transport.perform_request('get', '_search', stream=True)
+        self.assertRaises(FakeConnectionError, list, items)
+        self.assertEqual((0, 0, 1), self._in_flight())
+        self.assertTrue(isinstance(self.hooks.events[0].error,
+                                   FakeConnectionError))
+
+    def test_streamed_reads_are_not_hedged(self):
+        slow = StreamingConnection('slow', delay=0.05)
+        other = StreamingConnection('other')
+        pool = ConnectionPool([(slow, {}), (other, {})],
+                              randomize_hosts=False)
+        transport = Transport(pool, hedge_after=0.01)
+        self.assertEqual([1, 2, 3], list(transport.perform_request(
+            'get', '_search', stream=True)))
+        self.assertEqual((1, 0), (slow.calls, other.calls))
+
+
+class TestHedging(unittest.TestCase):
+    def _transport(self, connections, **kwargs):
+        pool = ConnectionPool([(c, {}) for c in connections],
+                              randomize_hosts=False)
+        return Transport(pool, **kwargs)
+
+    def test_slow_read_is_hedged(self):
+        slow = SlowConnection('slow', 1.0)
+        fast = SlowConnection('fast', 0)
+        transport = self._transport([slow, fast], hedge_after=0.01)
+
+        start = time.time()
+        self.assertEqual('fast', transport.perform_request('get', 'i/_doc/1'))
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_fast_read_is_not_hedged(self):
+        first = SlowConnection('first', 0)
+        second = SlowConnection('second', 0)
+        transport = self._transport([first, second], hedge_after=1)
+
+        self.assertEqual('first', transport.perform_request('get', ''))
+        self.assertEqual(0, second.calls)
+
+    def test_writes_are_not_hedged(self):
+        slow = SlowConnection('slow', 0.05)
+        fast = SlowConnection('fast', 0)
+        transport = self._transport([slow, fast], hedge_after=0.01)
+
+        self.assertEqual('slow', transport.perform_request('put', 'i/t/1'))
+        self.assertEqual(0, fast.calls)
+        self.assertEqual('fast', transport.perform_request('post',
+                                                           'i/_search'))
+
+    def test_scrolls_are_not_hedged(self):
+        slow = SlowConnection('slow', 0.05)
+        fast = SlowConnection('fast', 0)
+        transport = self._transport([slow, fast], hedge_after=0.01)
+
+        self.assertEqual('slow', transport.perform_request(
+            'post', 'i/_search', params={'scroll': '5m'}))
+        self.assertEqual('fast', transport.perform_request(
+            'get', '_search/scroll', data='{"scroll_id": "x"}'))
+        self.assertEqual('slow', transport.perform_request(
+            'get', 'i/_search?scroll=5m'))
+        self.assertEqual(1, fast.calls)
+        self.assertEqual(2, slow.calls)
+
+    def test_percentile_delay(self):
+        transport = self._transport([SlowConnection('fast', 0)],
+                                    hedge_after='p95', hedge_min_samples=10)
+        self.assertEqual(None, transport.hedge_delay)
+        for _ in range(10):
+            transport.perform_request('get', '')
+        self.assertTrue(transport.hedge_delay < 0.1)